@@ -0,0 +1,44 @@
+"""
+Helper comuni per i benchmark locali: AWS finto in memoria (moto) e
+caricamento delle Lambda come moduli. Si lanciano dalla cartella cdk/:
+
+    python -m benchmarks.<nome>
+"""
+import contextlib
+import os
+import statistics
+import threading
+from functools import wraps
+
+from moto import mock_aws
+from moto.dynamodb.responses import DynamoHandler
+
+from tests.unit.conftest import create_table, load_lambda, load_scoring  # noqa: F401  (riesportati)
+
+
+@contextlib.contextmanager
+def local_aws():
+    """moto con le scritture DynamoDB serializzate, come nei test."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-3")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    lock = threading.RLock()
+    originals = {}
+    for name in ("put_item", "update_item", "delete_item", "batch_write_item", "transact_write_items"):
+        fn = originals[name] = getattr(DynamoHandler, name)
+
+        def serialized(*args, _fn=fn, **kwargs):
+            with lock:
+                return _fn(*args, **kwargs)
+        setattr(DynamoHandler, name, wraps(fn)(serialized))
+    try:
+        with mock_aws():
+            yield
+    finally:
+        for name, fn in originals.items():
+            setattr(DynamoHandler, name, fn)
+
+
+def percentiles(samples_ms):
+    qs = statistics.quantiles(samples_ms, n=100)
+    return {"p50": qs[49], "p99": qs[98]}
@@ -0,0 +1,77 @@
+"""
+Micro-benchmark della cache album: replay di una traccia Zipf su /albums/{id}
+con e senza cache. La latenza DynamoDB è simulata con uno sleep per chiamata.
+
+    python -m benchmarks.album_cache [--albums 5000] [--requests 20000] [--ddb-ms 5]
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import time
+
+import boto3
+
+from ._local import create_table, load_lambda, local_aws, percentiles
+
+
+def zipf_trace(n_items, n_requests, s=1.1, seed=1):
+    weights = [1 / (rank ** s) for rank in range(1, n_items + 1)]
+    cum = list(itertools.accumulate(weights))
+    rnd = random.Random(seed)
+    # qualche id inesistente per esercitare la negative cache
+    return ["a%d" % bisect.bisect_left(cum, rnd.random() * cum[-1]) if rnd.random() > 0.02
+            else "missing%d" % rnd.randrange(50)
+            for _ in range(n_requests)]
+
+
+def run(app, trace, ddb_ms):
+    real_get = app.albums_table.get_item
+
+    def slow_get(**kw):
+        time.sleep(ddb_ms / 1000)
+        return real_get(**kw)
+    app.albums_table.get_item = slow_get
+
+    lat = []
+    for album_id in trace:
+        t0 = time.perf_counter()
+        app.handler({"resource": "/albums/{id}", "pathParameters": {"id": album_id}}, None)
+        lat.append((time.perf_counter() - t0) * 1000)
+    return lat
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--albums", type=int, default=5000)
+    ap.add_argument("--requests", type=int, default=20000)
+    ap.add_argument("--cache-entries", type=int, default=1000)
+    ap.add_argument("--ddb-ms", type=float, default=5.0)
+    args = ap.parse_args()
+
+    with local_aws():
+        table = create_table(boto3.resource("dynamodb"), "Albums", "album_id")
+        with table.batch_writer() as batch:
+            for n in range(args.albums):
+                batch.put_item(Item={"album_id": "a%d" % n, "title": "Album %d" % n,
+                                     "artist": "Artist", "songs": ["song"] * 12,
+                                     "ratings_sum": 7, "ratings_count": 2})
+        os.environ["ALBUMS_TABLE"] = "Albums"
+        trace = zipf_trace(args.albums, args.requests)
+
+        for label, entries in (("senza cache", 0), ("con cache", args.cache_entries)):
+            app = load_lambda("albums")
+            app.cache = app.LRUCache(entries, 32 * 1024 * 1024 if entries else 0)
+            app.cache.log_stats = lambda: None
+            lat = run(app, trace, args.ddb_ms)
+            st = app.cache.stats
+            lookups = st["hits"] + st["misses"]
+            hit_rate = st["hits"] / lookups if lookups else 0
+            p = percentiles(lat)
+            print(f"{label:12s} hit rate {hit_rate:6.1%}  p50 {p['p50']:7.3f} ms  p99 {p['p99']:7.3f} ms"
+                  f"  evictions {st['evictions']}")
+
+
+if __name__ == "__main__":
+    main()
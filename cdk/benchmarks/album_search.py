@@ -0,0 +1,114 @@
+"""
+Benchmark dell'indice di ricerca album su un catalogo sintetico: tempo di build,
+dimensione dell'artefatto, tempo di caricamento e latenza p50/p99 delle query
+(esatte, prefisso, refusi). Come riferimento, il vecchio fallback del frontend:
+filtro per sottostringa su tutta la lista album.
+
+    python -m benchmarks.album_search [--albums 100000] [--queries 2000]
+"""
+import argparse
+import itertools
+import os
+import random
+import string
+import time
+
+from ._local import load_lambda, local_aws, percentiles
+
+
+def make_words(rnd, n):
+    words = set()
+    while len(words) < n:
+        words.add("".join(rnd.choice(string.ascii_lowercase) for _ in range(rnd.randint(3, 10))))
+    return sorted(words)
+
+
+def catalog(n_albums, seed=1):
+    rnd = random.Random(seed)
+    words = make_words(rnd, 20000)
+    artists = [" ".join(rnd.choices(words, k=rnd.randint(1, 2))).title() for _ in range(n_albums // 8)]
+    # distribuzione Zipf sulle parole: poche molto comuni, coda lunga
+    cum = list(itertools.accumulate(1 / (rank ** 1.05) for rank in range(1, len(words) + 1)))
+    for n in range(n_albums):
+        yield {
+            "album_id": "a%d" % n,
+            "title": " ".join(rnd.choices(words, cum_weights=cum, k=rnd.randint(1, 4))).title(),
+            "artist": rnd.choice(artists),
+            "cover": "https://i.scdn.co/image/%032x" % rnd.getrandbits(128),
+            "year": rnd.randint(1960, 2025),
+            "title_slug": "album-%d" % n,
+            "songs": [" ".join(rnd.choices(words, cum_weights=cum, k=rnd.randint(1, 4))) for _ in range(10)],
+        }
+
+
+def typo(rnd, word):
+    i = rnd.randrange(len(word))
+    return word[:i] + rnd.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+def make_queries(albums, n, seed=2):
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        album = rnd.choice(albums)
+        words = album["title"].lower().split()
+        kind = rnd.choice(("exact", "prefix", "typo", "artist"))
+        if kind == "exact":
+            queries.append(" ".join(words))
+        elif kind == "prefix":
+            queries.append(" ".join(words[:-1] + [words[-1][:max(2, len(words[-1]) // 2)]]))
+        elif kind == "typo":
+            queries.append(" ".join(typo(rnd, w) if len(w) > 4 else w for w in words))
+        else:
+            queries.append(album["artist"].lower())
+    return queries
+
+
+def timed(fn, queries):
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        lat.append((time.perf_counter() - t0) * 1000)
+    return percentiles(lat)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--albums", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=2000)
+    args = ap.parse_args()
+
+    with local_aws():
+        os.environ.setdefault("ALBUMS_TABLE", "Albums")
+        os.environ.setdefault("SEARCH_BUCKET", "search-bucket")
+        builder = load_lambda("search_index")
+        albums_app = load_lambda("albums")
+
+        albums = list(catalog(args.albums))
+        t0 = time.perf_counter()
+        blob = builder.serialize(builder.build_index(albums))
+        build_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index = albums_app.SearchIndex.from_bytes(blob)
+        load_s = time.perf_counter() - t0
+
+        print(f"catalogo {len(albums)} album, vocabolario {len(index.vocab)} parole")
+        print(f"build {build_s:.1f} s   artefatto {len(blob) / 1024 / 1024:.1f} MiB (gzip)   load {load_s * 1000:.0f} ms")
+
+        queries = make_queries(albums, args.queries)
+        p = timed(lambda q: index.search(q, 10), queries)
+        print(f"{'indice':18s} p50 {p['p50']:7.3f} ms  p99 {p['p99']:7.3f} ms")
+
+        # vecchio fallback: sottostringa sul titolo su tutta la lista (solo match esatti di frammenti)
+        titles = [(a["album_id"], a["title"].lower()) for a in albums]
+        p = timed(lambda q: [i for i, t in titles if q in t][:10], queries[:200])
+        print(f"{'scan sottostringa':18s} p50 {p['p50']:7.3f} ms  p99 {p['p99']:7.3f} ms")
+
+        hits = sum(1 for q in queries[:200] if index.search(q, 10))
+        print(f"query con almeno un risultato: {hits}/200")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark offline dello scoring delle classifiche (containers/scoring.py):
+qualità del ranking e tempo, sulle pesature e sul vecchio comportamento dello
+scraper (primi TOP_K album nell'ordine del dict, score ignorato).
+
+Senza --recorded genera una registrazione sintetica con una "popolarità vera"
+nascosta per album: i mercati vedono soprattutto gli album popolari, ciascuno
+con il suo rumore, e (come la search vera) senza campo popularity. La qualità
+è NDCG@k / precision@k rispetto a quella verità.
+
+Con --recorded usa risultati di ricerca veri (registrati con --record, servono
+SPOTIPY_CLIENT_ID/SECRET): lì la verità non c'è e si confrontano le pesature
+tra loro (overlap@k con la media semplice).
+
+    python -m benchmarks.chart_scoring [--albums 400] [--years 56] [--top 20]
+    python -m benchmarks.chart_scoring --record rec.json.gz --year 2019
+    python -m benchmarks.chart_scoring --recorded rec.json.gz
+"""
+import argparse
+import gzip
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+from ._local import load_scoring
+
+MARKETS = ["US", "GB", "DE", "FR", "IT"]
+
+
+def synthetic_recording(year, n_albums, per_market_fetch, seed):
+    """Registrazione + verità: {"markets": {m: [album, ...]}}, {album_id: popolarità vera}."""
+    rnd = random.Random(seed)
+    truth = {f"{year}x{n}": rnd.paretovariate(1.5) for n in range(n_albums)}
+    albums = {aid: {"id": aid, "name": f"Album {aid}", "album_type": "album",
+                    "release_date": f"{year}-01-01", "artists": [{"name": f"Artist {aid}"}],
+                    "images": [{"url": f"https://img/{aid}.jpg"}]}
+              for aid in truth}
+    markets = {}
+    for m in MARKETS:
+        local = {aid: math.log(q) + rnd.gauss(0, 0.6) for aid, q in truth.items()}   # gusti locali
+        ranked = sorted(local, key=local.get, reverse=True)
+        # la search non è un ordinamento perfetto: qualche posizione di disordine
+        shuffled = sorted(range(len(ranked)), key=lambda i: i + rnd.gauss(0, 4))
+        markets[m] = [albums[ranked[i]] for i in shuffled[:per_market_fetch]]
+    return {"year": year, "per_market_fetch": per_market_fetch, "markets": markets}, truth
+
+
+def record(year, markets, per_market_fetch, path):
+    """Risultati veri di sp.search per anno/mercato, nel formato letto da --recorded."""
+    from spotipy import Spotify
+    from spotipy.oauth2 import SpotifyClientCredentials
+    sp = Spotify(auth_manager=SpotifyClientCredentials())
+    out = {"year": year, "per_market_fetch": per_market_fetch, "markets": {}}
+    for m in markets:
+        items = []
+        while len(items) < per_market_fetch:
+            res = sp.search(q=f"year:{year}", type="album", market=m,
+                            limit=min(50, per_market_fetch - len(items)), offset=len(items))
+            batch = res["albums"]["items"]
+            items += batch
+            if not batch:
+                break
+        out["markets"][m] = items
+    with gzip.open(path, "wt") as f:
+        json.dump(out, f)
+    print(f"registrati {sum(map(len, out['markets'].values()))} risultati in {path}")
+
+
+def observations(scoring, rec):
+    """Stesso filtro e stesso segnale di aggregate_for_markets nello scraper."""
+    year, fetched = str(rec["year"]), rec["per_market_fetch"]
+    for m, items in rec["markets"].items():
+        for pos, alb in enumerate(items):
+            if alb.get("album_type") != "album" or (alb.get("release_date") or "")[:4] != year or not alb.get("id"):
+                continue
+            pop = alb.get("popularity")
+            yield m, scoring.Candidate.from_album(alb), float(pop) if pop is not None else scoring.position_score(pos, fetched)
+
+
+def legacy_top(rec, k):
+    """Vecchio build_chart_entries: ordine di inserimento del dict, niente score."""
+    agg = {}
+    for m, items in rec["markets"].items():
+        for alb in items:
+            if alb.get("album_type") == "album" and (alb.get("release_date") or "")[:4] == str(rec["year"]):
+                agg.setdefault(alb["id"], alb)
+    return list(agg)[:k]
+
+
+def python_mean_top(scoring, rec, k):
+    """Media con dict + sort completo, come test.py prima del modulo di scoring."""
+    acc = defaultdict(lambda: [0.0, 0])
+    for _, c, signal in observations(scoring, rec):
+        a = acc[c.id]
+        a[0] += signal
+        a[1] += 1
+    return sorted(acc, key=lambda aid: acc[aid][0] / acc[aid][1], reverse=True)[:k]
+
+
+def ndcg(ranked, truth, k):
+    ideal = sorted(truth.values(), reverse=True)[:k]
+    dcg = sum(truth.get(aid, 0) / math.log2(i + 2) for i, aid in enumerate(ranked[:k]))
+    return dcg / sum(q / math.log2(i + 2) for i, q in enumerate(ideal))
+
+
+def precision(ranked, truth, k):
+    best = set(sorted(truth, key=truth.get, reverse=True)[:k])
+    return len(best & set(ranked[:k])) / k
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--albums", type=int, default=400)
+    ap.add_argument("--years", type=int, default=56)
+    ap.add_argument("--fetch", type=int, default=100)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--recorded")
+    ap.add_argument("--record")
+    ap.add_argument("--year", type=int, default=2019)
+    args = ap.parse_args()
+
+    if args.record:
+        return record(args.year, MARKETS, args.fetch, args.record)
+
+    scoring = load_scoring()
+    if args.recorded:
+        with gzip.open(args.recorded, "rt") as f:
+            runs = [(json.load(f), None)]
+    else:
+        runs = [synthetic_recording(1970 + y, args.albums, args.fetch, seed=y) for y in range(args.years)]
+
+    methods = {"legacy (dict order)": lambda rec: legacy_top(rec, args.top),
+               "python mean + sort": lambda rec: python_mean_top(scoring, rec, args.top)}
+    for name in scoring.WEIGHTINGS:
+        methods[name] = (lambda rec, name=name: [c.id for c, _ in scoring.rank(
+            scoring.aggregate(observations(scoring, rec)), args.top, name)])
+
+    results = {}
+    for label, fn in methods.items():
+        t0 = time.perf_counter()
+        ranked = [fn(rec) for rec, _ in runs]
+        results[label] = (ranked, (time.perf_counter() - t0) * 1000 / len(runs))
+
+    k = args.top
+    first = runs[0][0]
+    print(f"{len(runs)} anni × {len(first['markets'])} mercati × {first['per_market_fetch']} risultati, top {k}")
+    for label, (ranked, ms) in results.items():
+        if args.recorded:
+            reference = results["mean"][0][0]
+            quality = f"overlap@{k} con mean {len(set(ranked[0]) & set(reference)) / k:5.2f}"
+        else:
+            quality = (f"NDCG@{k} {sum(ndcg(r, t, k) for r, (_, t) in zip(ranked, runs)) / len(runs):5.3f}  "
+                       f"P@{k} {sum(precision(r, t, k) for r, (_, t) in zip(ranked, runs)) / len(runs):5.2f}")
+        print(f"{label:20s} {quality}  {ms:7.3f} ms/anno")
+
+
+if __name__ == "__main__":
+    main()
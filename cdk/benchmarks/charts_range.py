@@ -0,0 +1,115 @@
+"""
+Benchmark GET /charts?from=&to=&top= contro il percorso attuale del frontend
+(una richiesta /charts/{year} per anno, in sequenza). DynamoDB è una tabella in
+memoria con latenza simulata (moto costa decine di ms di CPU per query e sotto
+GIL falserebbe il confronto); --http-ms simula il round trip browser → API Gateway.
+
+    python -m benchmarks.charts_range [--from 1970] [--to 2025] [--top 10] [--ddb-ms 8] [--http-ms 40]
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from ._local import load_lambda, local_aws
+
+
+class FakeChartsTable:
+    """query() per chiave esatta con Limit: latenza fissa + costo per item letto."""
+
+    def __init__(self, ddb_ms, per_item_ms=0.05):
+        self.partitions = {}
+        self.ddb_ms = ddb_ms
+        self.per_item_ms = per_item_ms
+        self.items_read = 0
+        self.lock = threading.Lock()
+
+    def put_item(self, Item):
+        self.partitions.setdefault(Item["chart_key"], []).append(Item)
+
+    def query(self, KeyConditionExpression, ScanIndexForward=True, Limit=None):
+        chart_key = KeyConditionExpression.get_expression()["values"][1]
+        items = sorted(self.partitions.get(chart_key, []), key=lambda i: i["rank"],
+                       reverse=not ScanIndexForward)[:Limit]
+        with self.lock:
+            self.items_read += len(items)
+        time.sleep((self.ddb_ms + self.per_item_ms * len(items)) / 1000)
+        return {"Items": [dict(i) for i in items]}
+
+
+def seed(table, years, per_year=20):
+    ts = "2025-03-01T03:00:00Z"
+    for year in years:
+        table.put_item(Item={"chart_key": str(year), "rank": Decimal(0), "kind": "manifest", "regions": {"GLOBAL"}})
+        for rank in range(1, per_year + 1):
+            table.put_item(Item={
+                "chart_key": str(year), "rank": Decimal(rank), "year": year,
+                "album_id": "%d-%d" % (year, rank), "title": "Album %d" % rank, "artist": "Artist",
+                "cover": "https://i.scdn.co/image/%d%d" % (year, rank), "fetched_at": ts,
+                "songs": ["Song %d" % n for n in range(12)],
+            })
+
+
+def per_year_path(app, years, http_ms):
+    size = 0
+    for year in years:
+        time.sleep(http_ms / 1000)
+        resp = app.handler({"resource": "/charts/{year}", "pathParameters": {"year": str(year)}}, None)
+        size += len(resp["body"])
+    return size
+
+
+def range_path(app, year_from, year_to, top, http_ms):
+    time.sleep(http_ms / 1000)
+    resp = app.handler({"resource": "/charts", "queryStringParameters":
+                        {"from": str(year_from), "to": str(year_to), "top": str(top)}}, None)
+    assert resp["statusCode"] == 200
+    return len(resp["body"])
+
+
+def timed(fn, repeat):
+    samples, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), size
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--from", dest="year_from", type=int, default=1970)
+    ap.add_argument("--to", dest="year_to", type=int, default=2025)
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--ddb-ms", type=float, default=8.0)
+    ap.add_argument("--http-ms", type=float, default=40.0)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    years = range(args.year_from, args.year_to + 1)
+
+    with local_aws():
+        os.environ["CHARTS_TABLE"] = "Charts"
+        app = load_lambda("charts_read")
+        fake = FakeChartsTable(args.ddb_ms)
+        seed(fake, years)
+        app.table = fake
+        app._thread_table = lambda: fake
+
+        seq_ms, seq_bytes = timed(lambda: per_year_path(app, years, args.http_ms), args.repeat)
+        seq_read, fake.items_read = fake.items_read // args.repeat, 0
+        rng_ms, rng_bytes = timed(lambda: range_path(app, args.year_from, args.year_to, args.top,
+                                                     args.http_ms), args.repeat)
+        rng_read = fake.items_read // args.repeat
+        rng_lambda_ms, _ = timed(lambda: range_path(app, args.year_from, args.year_to, args.top, 0), args.repeat)
+
+    print(f"{len(years)} anni, top {args.top}, ddb {args.ddb_ms} ms/query, http {args.http_ms} ms/richiesta")
+    print(f"{'per anno (attuale)':20s} {seq_ms:8.1f} ms  {len(years):3d} richieste  "
+          f"{seq_read:5d} item letti  {seq_bytes / 1024:7.1f} KiB")
+    print(f"{'range parallelo':20s} {rng_ms:8.1f} ms    1 richiesta   "
+          f"{rng_read:5d} item letti  {rng_bytes / 1024:7.1f} KiB  (di cui Lambda {rng_lambda_ms:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Benchmark della migrazione ChartsTable → AlbumsTable (lambda/seed_from_charts)
+su un catalogo di 50k album, contro il vecchio percorso (scan sequenziale +
+get_item + put_item per album). Le tabelle sono in memoria con latenza
+simulata per chiamata: moto costa ms di CPU per richiesta e sotto GIL
+falserebbe il confronto tra thread.
+
+    python -m benchmarks.seed_from_charts [--albums 50000] [--segments 16] [--update-ms 6]
+"""
+import argparse
+import os
+import re
+import threading
+import time
+import zlib
+
+from ._local import load_lambda
+
+LAMBDA_TIMEOUT_S = 300
+
+
+class FakeDynamo:
+    """Charts + Albums in dict, con la latenza di DynamoDB visto da una Lambda nella stessa regione."""
+
+    def __init__(self, scan_ms, get_ms, batch_get_ms, write_ms, page_items):
+        self.charts, self.albums = [], {}
+        self.scan_ms, self.get_ms, self.batch_get_ms, self.write_ms = scan_ms, get_ms, batch_get_ms, write_ms
+        self.page_items = page_items   # ~1 MB di voci con tracce per pagina di scan
+        self.lock = threading.Lock()
+        self.calls = {"scan": 0, "get_item": 0, "batch_get_item": 0, "put_item": 0, "update_item": 0}
+
+    def _call(self, name, ms):
+        with self.lock:
+            self.calls[name] += 1
+        time.sleep(ms / 1000)
+
+    # --- ChartsTable ---
+    def scan(self, Segment=0, TotalSegments=1, ExclusiveStartKey=None, **_):
+        self._call("scan", self.scan_ms)
+        mine = [it for it in self.charts
+                if zlib.crc32(it["chart_key"].encode()) % TotalSegments == Segment] if TotalSegments > 1 else self.charts
+        start = ExclusiveStartKey["i"] if ExclusiveStartKey else 0
+        page = mine[start:start + self.page_items]
+        resp = {"Items": page}
+        if start + self.page_items < len(mine):
+            resp["LastEvaluatedKey"] = {"i": start + self.page_items}
+        return resp
+
+    # --- AlbumsTable ---
+    def get_item(self, Key, **_):
+        self._call("get_item", self.get_ms)
+        item = self.albums.get(Key["album_id"])
+        return {"Item": dict(item)} if item else {}
+
+    def put_item(self, Item):
+        self._call("put_item", self.write_ms)
+        with self.lock:
+            self.albums[Item["album_id"]] = dict(Item)
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        self._call("update_item", self.write_ms)
+        with self.lock:
+            item = self.albums.setdefault(Key["album_id"], dict(Key))
+            for name, default, value in re.findall(r"(#\w+) = (?:if_not_exists\(#\w+, (:\w+)\)|(:\w+))",
+                                                   UpdateExpression):
+                field = ExpressionAttributeNames[name]
+                if default:
+                    item.setdefault(field, ExpressionAttributeValues[default])
+                else:
+                    item[field] = ExpressionAttributeValues[value]
+
+    def batch_get_item(self, RequestItems):
+        self._call("batch_get_item", self.batch_get_ms)
+        (table, req), = RequestItems.items()
+        return {"Responses": {table: [dict(self.albums[k["album_id"]]) for k in req["Keys"]
+                                      if k["album_id"] in self.albums]}}
+
+
+def build_charts(db, n_albums):
+    """Ogni album in classifica globale e in una regionale; 1/5 anche l'anno dopo."""
+    per_year = -(-n_albums // 56)
+    for n in range(n_albums):
+        year = 1970 + n // per_year
+        item = {"chart_key": str(year), "rank": n % per_year + 1, "album_id": "a%d" % n,
+                "title": "Album %d" % n, "artist": "Artist %d" % (n % 5000),
+                "release_date": "%d-01-01" % year, "cover": "https://img/%d.jpg" % n,
+                "songs": ["Track %d" % t for t in range(12)]}
+        db.charts.append(item)
+        db.charts.append(dict(item, chart_key="%d#EUROPE" % year))
+        if n % 5 == 0:
+            db.charts.append(dict(item, chart_key=str(year + 1), rank=10_000 + n))
+
+
+def legacy(app, db, budget_s):
+    """Il vecchio loop, fermato dopo budget_s: ritorna album/s per estrapolare."""
+    started, count, seen, kwargs = time.time(), 0, set(), {}
+    while time.time() - started < budget_s:
+        resp = db.scan(**kwargs)
+        for item in resp["Items"]:
+            album = app.catalog_fields(item)
+            if not album or album["album_id"] in seen:
+                continue
+            seen.add(album["album_id"])
+            db.get_item(Key={"album_id": album["album_id"]})
+            db.put_item(Item=album)
+            count += 1
+            if time.time() - started >= budget_s:
+                break
+        if "LastEvaluatedKey" not in resp:
+            break
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    return count / (time.time() - started)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--albums", type=int, default=50_000)
+    ap.add_argument("--segments", type=int, default=16)
+    ap.add_argument("--scan-ms", type=float, default=25)
+    ap.add_argument("--get-ms", type=float, default=4)
+    ap.add_argument("--batch-get-ms", type=float, default=12)
+    ap.add_argument("--update-ms", type=float, default=6)
+    ap.add_argument("--page-items", type=int, default=1000)
+    ap.add_argument("--legacy-seconds", type=float, default=10)
+    args = ap.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "eu-west-3")
+    os.environ.update(CHARTS_TABLE="Charts", ALBUMS_TABLE="Albums", SEED_SCAN_SEGMENTS=str(args.segments))
+    app = load_lambda("seed_from_charts")
+    db = FakeDynamo(args.scan_ms, args.get_ms, args.batch_get_ms, args.update_ms, args.page_items)
+    build_charts(db, args.albums)
+    app._thread_tables = lambda: (db, db, db)
+    print(f"{len(db.charts)} voci in ChartsTable, {args.albums} album distinti")
+
+    rate = legacy(app, db, args.legacy_seconds)
+    db.albums.clear()
+    estimate = args.albums / rate
+    print(f"vecchio loop        {rate:8.1f} album/s → {estimate:7.0f} s stimati "
+          f"({'OLTRE' if estimate > LAMBDA_TIMEOUT_S else 'dentro'} il timeout di {LAMBDA_TIMEOUT_S}s)")
+
+    for label in ("pipeline (vuota)", "pipeline (rilancio)"):
+        for k in db.calls:
+            db.calls[k] = 0
+        stats = app.migrate_charts_to_albums()
+        print(f"{label:19s} {stats['albums_per_s']:8.1f} album/s → {stats['seconds']:7.1f} s "
+              f"| scritti {stats['written']} invariati {stats['unchanged']} | chiamate {db.calls}")
+        assert stats["albums"] == args.albums and stats["seconds"] < LAMBDA_TIMEOUT_S
+
+
+if __name__ == "__main__":
+    main()
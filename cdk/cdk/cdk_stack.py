@@ -21,6 +21,7 @@ from aws_cdk import (
     aws_ecs_patterns as ecs_patterns,
     aws_secretsmanager as secretsmanager,
     Duration,
+    Size,
     RemovalPolicy,
 )
 from constructs import Construct
@@ -196,12 +197,22 @@ class CdkStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
             removal_policy=RemovalPolicy.DESTROY,
         )
+        # Like alle recensioni: un item per (recensione, utente)
+        likes_table = dynamodb.Table(
+            self, "LikesTable",
+            partition_key={"name": "review_id", "type": dynamodb.AttributeType.STRING},   # album_id#user_id
+            sort_key={"name": "liker_id", "type": dynamodb.AttributeType.STRING},
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
         charts_table = dynamodb.Table(
             self, "ChartsTable",
             partition_key={"name": "chart_key", "type": dynamodb.AttributeType.STRING},
             sort_key={"name": "rank", "type": dynamodb.AttributeType.NUMBER},  # 👈 AGGIUNTO
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
             removal_policy=RemovalPolicy.DESTROY,
+            # le voci nuove/modificate arrivano a ChartsSyncLambda (old image: si saltano le MODIFY senza cambi)
+            stream=dynamodb.StreamViewType.NEW_AND_OLD_IMAGES,
         )
 
         # IMPORT del secret già esistente (nessuna creazione)
@@ -242,6 +253,51 @@ class CdkStack(Stack):
             projection_type=dynamodb.ProjectionType.ALL,
         )
 
+        # 🔹 GSI per la lista album filtrata per anno / artista (proiezione leggera per le liste)
+        # ⚠️ CloudFormation aggiunge un solo GSI per update di tabella e un indice si può
+        # interrogare solo quando è ACTIVE. Il rollout va per stadi, contesto
+        # "albums_index_stage" in cdk.json: si alza di uno per deploy, solo dopo che
+        # l'indice del deploy precedente è ACTIVE (aws dynamodb describe-table).
+        #   0 → nessun indice per le liste
+        #   1 → crea YearIndex
+        #   2 → crea ArtistIndex; la Lambda albums usa YearIndex
+        #   3 → la Lambda albums usa anche ArtistIndex
+        # Finché un indice non è passato alla Lambda, il filtro è una scan filtrata.
+        albums_index_stage = int(self.node.try_get_context("albums_index_stage") or 0)
+        list_projection = ["title", "artist", "cover", "average_rating", "ratings_sum", "ratings_count"]
+        if albums_index_stage >= 1:
+            albums_table.add_global_secondary_index(
+                index_name="YearIndex",
+                partition_key=dynamodb.Attribute(name="year", type=dynamodb.AttributeType.NUMBER),
+                sort_key=dynamodb.Attribute(name="title_lower", type=dynamodb.AttributeType.STRING),
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                non_key_attributes=list_projection,
+            )
+        if albums_index_stage >= 2:
+            albums_table.add_global_secondary_index(
+                index_name="ArtistIndex",
+                partition_key=dynamodb.Attribute(name="artist_lower", type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="year", type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                non_key_attributes=list_projection,
+            )
+        # indici già ACTIVE al deploy precedente: solo questi arrivano alla Lambda albums
+        albums_list_indexes = {}
+        if albums_index_stage >= 2:
+            albums_list_indexes["ALBUMS_YEAR_INDEX"] = "YearIndex"
+        if albums_index_stage >= 3:
+            albums_list_indexes["ALBUMS_ARTIST_INDEX"] = "ArtistIndex"
+
+        # 🔹 GSI recensioni per utente (profilo, export, cancellazione account) senza scan.
+        # Solo recensioni con timestamp numerico: quelle legacy le sistema BackfillRatingsLambda.
+        ratings_table.add_global_secondary_index(
+            index_name="UserIndex",
+            partition_key=dynamodb.Attribute(name="user_id", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="timestamp", type=dynamodb.AttributeType.NUMBER),
+            projection_type=dynamodb.ProjectionType.INCLUDE,
+            non_key_attributes=["rating", "comment", "likes"],
+        )
+
         # --------------------------
         # Lambda: Notify (invia email con SES)
         # --------------------------
@@ -272,8 +328,7 @@ class CdkStack(Stack):
             environment={
                 "RATINGS_TABLE": ratings_table.table_name,
                 "ALBUMS_TABLE": albums_table.table_name,   # 👈 aggiungi la virgola qui
-                "USERS_TABLE": users_table.table_name,
-                "SNS_TOPIC_ARN": likes_topic.topic_arn,   # 👈 nuovo
+                "LIKES_TABLE": likes_table.table_name,
             },
 
             timeout=Duration.seconds(30),
@@ -282,8 +337,7 @@ class CdkStack(Stack):
 
         ratings_table.grant_read_write_data(ratings_fn)
         albums_table.grant_read_write_data(ratings_fn)
-        users_table.grant_read_data(ratings_fn)
-        likes_topic.grant_publish(ratings_fn)
+        likes_table.grant_read_write_data(ratings_fn)
 
 
         # Collego notify_fn a ratings_fn
@@ -293,6 +347,37 @@ class CdkStack(Stack):
 
 
 
+        # --------------------------
+        # Indice di ricerca album (artefatto gzip su S3, ricostruito ogni notte)
+        # --------------------------
+        search_bucket = s3.Bucket(
+            self, "SearchIndexBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+        )
+        search_index_key = "search/albums-index.json.gz"
+
+        search_index_fn = _lambda.DockerImageFunction(
+            self, "SearchIndexLambda",
+            code=_lambda.DockerImageCode.from_image_asset("lambda/search_index"),
+            environment={
+                "ALBUMS_TABLE": albums_table.table_name,
+                "SEARCH_BUCKET": search_bucket.bucket_name,
+                "SEARCH_INDEX_KEY": search_index_key,
+            },
+            timeout=Duration.minutes(10),
+            memory_size=2048,
+        )
+        albums_table.grant_read_data(search_index_fn)
+        search_bucket.grant_put(search_index_fn)
+
+        # dopo lo scraper delle 3:00
+        events.Rule(
+            self, "SearchIndexSchedule",
+            schedule=events.Schedule.cron(minute="30", hour="5"),
+        ).add_target(targets.LambdaFunction(search_index_fn))
+
         # --------------------------
         # Lambda per leggere album (SOLO Docker)
         # --------------------------
@@ -300,12 +385,20 @@ class CdkStack(Stack):
             self, "GetAlbumsLambda",
             code=_lambda.DockerImageCode.from_image_asset("lambda/albums"),
             environment={
-                "ALBUMS_TABLE": albums_table.table_name
+                "ALBUMS_TABLE": albums_table.table_name,
+                # cache in-process degli album (metadati cambiano solo col job notturno)
+                "ALBUM_CACHE_TTL": "300",
+                "ALBUM_CACHE_MAX_ENTRIES": "2000",
+                "SEARCH_BUCKET": search_bucket.bucket_name,
+                "SEARCH_INDEX_KEY": search_index_key,
+                **albums_list_indexes,
             },
             timeout=Duration.seconds(30),
-            memory_size=512,
+            # l'indice di ricerca vive in memoria
+            memory_size=1024,
         )
         albums_table.grant_read_data(get_albums_fn)
+        search_bucket.grant_read(get_albums_fn)
 
         # --------------------------
         # Lambda Functions (Docker)
@@ -321,12 +414,14 @@ class CdkStack(Stack):
             self, "FavoritesLambda",
             code=_lambda.DockerImageCode.from_image_asset("lambda/favorites"),
             environment={              # 👈 aggiunto
-                "USERS_TABLE": users_table.table_name
+                "USERS_TABLE": users_table.table_name,
+                "ALBUMS_TABLE": albums_table.table_name,   # GET /users/favorites con i metadati
             },
             timeout=Duration.seconds(30),   # (facoltativo: aggiungi timeout e memoria)
             memory_size=256,
         )
         users_table.grant_read_write_data(favorites_fn)
+        albums_table.grant_read_data(favorites_fn)
 
 
         # --------------------------
@@ -389,12 +484,23 @@ class CdkStack(Stack):
         # --------------------------
         # Lambda per migrare da ChartsTable → AlbumsTable
         # --------------------------
+        def catalog_image(name):
+            """
+            SeedFromCharts e ChartsSync condividono lambda/shared/album_catalog.py: build
+            context lambda/, ma nell'asset entrano solo la cartella della Lambda e shared/.
+            """
+            return _lambda.DockerImageCode.from_image_asset(
+                "lambda", file=f"{name}/Dockerfile",
+                exclude=["*", f"!{name}", "!shared", "**/__pycache__"],
+            )
+
         seed_from_charts_fn = _lambda.DockerImageFunction(
             self, "SeedFromChartsLambda",
-            code=_lambda.DockerImageCode.from_image_asset("lambda/seed_from_charts"),
+            code=catalog_image("seed_from_charts"),
             environment={
                 "CHARTS_TABLE": charts_table.table_name,
                 "ALBUMS_TABLE": albums_table.table_name,
+                "SEED_SCAN_SEGMENTS": "16",   # scan parallela: un thread per segmento
             },
             timeout=Duration.minutes(5),
             memory_size=512,
@@ -405,7 +511,60 @@ class CdkStack(Stack):
         albums_table.grant_read_write_data(seed_from_charts_fn)
 
         # --------------------------
-        # Lambda SNS Subscribe (Docker)
+        # Sync incrementale ChartsTable → AlbumsTable dallo stream (SeedFromCharts resta per il backfill)
+        # --------------------------
+        charts_sync_fn = _lambda.DockerImageFunction(
+            self, "ChartsSyncLambda",
+            code=catalog_image("charts_sync"),
+            environment={
+                "ALBUMS_TABLE": albums_table.table_name,
+            },
+            timeout=Duration.seconds(60),
+            memory_size=256,
+        )
+        albums_table.grant_read_write_data(charts_sync_fn)
+        charts_sync_fn.add_event_source(lambda_event_sources.DynamoEventSource(
+            charts_table,
+            starting_position=_lambda.StartingPosition.LATEST,
+            batch_size=500,
+            max_batching_window=Duration.seconds(2),   # un anno dello scraper (globale + regioni) in un batch
+            retry_attempts=10,
+            bisect_batch_on_error=True,
+            report_batch_item_failures=True,
+        ))
+
+        # --------------------------
+        # Backfill RatingsTable per UserIndex: timestamp legacy (stringa/mancante) → millisecondi
+        # (invocazione manuale, ripartibile: rilanciare finché non risponde "done": true)
+        # --------------------------
+        backfill_ratings_fn = _lambda.DockerImageFunction(
+            self, "BackfillRatingsLambda",
+            code=_lambda.DockerImageCode.from_image_asset("lambda/backfill_ratings"),
+            environment={
+                "RATINGS_TABLE": ratings_table.table_name,
+            },
+            timeout=Duration.minutes(15),
+            memory_size=256,
+        )
+        ratings_table.grant_read_write_data(backfill_ratings_fn)
+
+        # --------------------------
+        # Migrazione una tantum ChartsTable: chiavi legacy "YEAR#region" → schema a chiavi esatte + manifest
+        # (invocazione manuale, ripartibile: rilanciare finché non risponde "done": true)
+        # --------------------------
+        migrate_charts_fn = _lambda.DockerImageFunction(
+            self, "MigrateChartsLambda",
+            code=_lambda.DockerImageCode.from_image_asset("lambda/migrate_charts"),
+            environment={
+                "CHARTS_TABLE": charts_table.table_name,
+            },
+            timeout=Duration.minutes(15),
+            memory_size=512,
+        )
+        charts_table.grant_read_write_data(migrate_charts_fn)
+
+        # --------------------------
+        # Lambda SNS Subscribe (Docker): job ripartibile, rilanciare finché non risponde "done": true
         # --------------------------
         sns_subscribe_fn = _lambda.DockerImageFunction(
             self, "SnsSubscribeLambda",
@@ -413,16 +572,33 @@ class CdkStack(Stack):
             environment={
                 "USERS_TABLE": users_table.table_name,
                 "SNS_TOPIC_ARN": likes_topic.topic_arn,
+                "SUBSCRIBE_SCAN_SEGMENTS": "8",
+                "SUBSCRIBE_WORKERS": "16",
+                "SUBSCRIBE_RATE": "80",   # sotto la quota Subscribe dell'account (100/s)
             },
-            timeout=Duration.seconds(30),
-            memory_size=256,
+            timeout=Duration.minutes(15),
+            memory_size=512,
         )
 
-        # Permessi: lettura DynamoDB + subscribe a SNS
-        users_table.grant_read_data(sns_subscribe_fn)
+        # Permessi: stato iscrizioni + checkpoint su UsersTable, subscribe e lista iscritti su SNS
+        users_table.grant_read_write_data(sns_subscribe_fn)
         likes_topic.grant_subscribe(sns_subscribe_fn)
+        sns_subscribe_fn.add_to_role_policy(iam.PolicyStatement(
+            actions=["sns:ListSubscriptionsByTopic"],
+            resources=[likes_topic.topic_arn],
+        ))
+
+        # Snapshot JSON (gzip) delle classifiche scritte dallo scraper, servite da charts_read
+        chart_snapshots_bucket = s3.Bucket(
+            self, "ChartSnapshotsBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            removal_policy=RemovalPolicy.DESTROY,
+            auto_delete_objects=True,
+        )
 
         # Task per lo scraper Spotify (scrive su ALBUMS_TABLE)
+        # N task in parallelo, uno per shard di anni (max 5: è il limite di target per regola EventBridge)
+        scraper_shards = 4
         spotify_task_def = ecs.FargateTaskDefinition(
             self, "SpotifyScraperTaskDef",
             memory_limit_mib=512,
@@ -442,7 +618,18 @@ class CdkStack(Stack):
                 "END_YEAR": "2025",
                 "PER_MARKET_FETCH": "100",
                 "TOP_K": "20",
+                "CHART_WEIGHTING": "bayesian",   # mean | coverage | bayesian (containers/scoring.py)
+                # fetch Spotify in parallelo; SPOTIFY_RATE/BURST sono la quota TOTALE, divisa tra gli shard
+                "SPOTIFY_WORKERS": "4",
+                "SPOTIFY_RATE": "8",
+                "SPOTIFY_BURST": "8",
+                "SHARD_COUNT": str(scraper_shards),   # SHARD_INDEX arriva dall'override del target
                 "AWS_REGION": self.region,
+                "SNAPSHOT_BUCKET": chart_snapshots_bucket.bucket_name,
+                # run incrementali: anno corrente ogni giorno, ultimi 5 anni ogni settimana, il resto ogni mese
+                "REFRESH_POLICY": "0:1,5:7,*:30",
+                # cache delle risposte Spotify: SQLite in /tmp, ricaricata/salvata su S3 tra un task e l'altro
+                "CACHE_BUCKET": chart_snapshots_bucket.bucket_name,   # chiave per shard: cache/spotify-cache-<i>of<N>
             },
             secrets={
                 "SPOTIPY_CLIENT_ID": ecs.Secret.from_secrets_manager(spotify_secret, "SPOTIPY_CLIENT_ID"),
@@ -452,6 +639,7 @@ class CdkStack(Stack):
 
         # ⬇️ permessi corretti alla task role
         charts_table.grant_read_write_data(spotify_task_def.task_role)
+        chart_snapshots_bucket.grant_read_write(spotify_task_def.task_role)
         # (rimuovi la grant su albums_table se non serve più)
 
 
@@ -467,13 +655,18 @@ class CdkStack(Stack):
             schedule=events.Schedule.cron(minute="0", hour="3")
         )
 
-        spotify_rule.add_target(targets.EcsTask(
-            cluster=cluster,
-            task_definition=spotify_task_def,
-            subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
-            security_groups=[spotify_sg],
-            assign_public_ip=True,
-        ))
+        for shard in range(scraper_shards):
+            spotify_rule.add_target(targets.EcsTask(
+                cluster=cluster,
+                task_definition=spotify_task_def,
+                subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
+                security_groups=[spotify_sg],
+                assign_public_ip=True,
+                container_overrides=[targets.ContainerOverride(
+                    container_name="SpotifyScraperContainer",
+                    environment=[targets.TaskEnvironmentVariable(name="SHARD_INDEX", value=str(shard))],
+                )],
+            ))
 
 
 
@@ -482,9 +675,13 @@ class CdkStack(Stack):
         # --------------------------
         # SQS Queue
         # --------------------------
+        # Finestra di raccolta dei digest like (batching window dell'event source SQS)
+        digest_window = Duration.seconds(60)
+
         queue = sqs.Queue(
             self, "AppQueue",
-            visibility_timeout=Duration.seconds(30)
+            # ≥ 6 × timeout del consumer + batching window (raccomandazione AWS)
+            visibility_timeout=Duration.minutes(13)
         )
 
         # Producer Lambda
@@ -499,14 +696,37 @@ class CdkStack(Stack):
         )
         queue.grant_send_messages(producer_fn)
 
-        # Consumer Lambda
+        # Ratings → eventi like in coda (SNS e UsersTable fuori dal path HTTP)
+        ratings_fn.add_environment("QUEUE_URL", queue.queue_url)
+        queue.grant_send_messages(ratings_fn)
+
+        # Consumer Lambda: digest dei like, una email SES per destinatario per finestra
         consumer_fn = _lambda.DockerImageFunction(
             self, "ConsumerLambda",
             code=_lambda.DockerImageCode.from_image_asset("lambda/consumer"),
-            timeout=Duration.seconds(30),
-            memory_size=256
+            # un batch pieno (500 like) può voler dire centinaia di destinatari, inviati uno alla
+            # volta: ~36 s alla quota SES di 14 email/s. Vicino al timeout i digest rimasti
+            # tornano in coda (batchItemFailures) invece di far riconsegnare tutto il batch.
+            timeout=Duration.minutes(2),
+            memory_size=256,
+            environment={
+                "USERS_TABLE": users_table.table_name,
+                "SES_SOURCE_EMAIL": "tua_email_verificata@dominio.com",
+            },
+        )
+        users_table.grant_read_data(consumer_fn)
+        consumer_fn.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["ses:SendEmail", "ses:SendRawEmail"],
+                resources=["*"]
+            )
         )
-        consumer_fn.add_event_source(lambda_event_sources.SqsEventSource(queue))
+        consumer_fn.add_event_source(lambda_event_sources.SqsEventSource(
+            queue,
+            batch_size=500,
+            max_batching_window=digest_window,
+            report_batch_item_failures=True,   # ritentano solo i messaggi falliti
+        ))
 
 
         # Lambda Charts Read (Docker)
@@ -514,12 +734,14 @@ class CdkStack(Stack):
             self, "ChartsReadLambda",
             code=_lambda.DockerImageCode.from_image_asset("lambda/charts_read"),
             environment={
-                "CHARTS_TABLE": charts_table.table_name
+                "CHARTS_TABLE": charts_table.table_name,
+                "SNAPSHOT_BUCKET": chart_snapshots_bucket.bucket_name,
             },
             timeout=Duration.seconds(30),
             memory_size=256,
         )
         charts_table.grant_read_data(charts_read_fn)
+        chart_snapshots_bucket.grant_read(charts_read_fn)
 
 
 
@@ -536,6 +758,8 @@ class CdkStack(Stack):
             self, "RateYourMusicApi",
             rest_api_name="RateYourMusicApi",
             deploy_options=apigw.StageOptions(stage_name="prod"),
+            # gzip lato API Gateway (Accept-Encoding): le snapshot delle classifiche sono JSON grandi
+            min_compression_size=Size.kibibytes(1),
             default_cors_preflight_options=apigw.CorsOptions(
                 allow_origins=["*"],  # oppure [f"https://{distribution.attr_domain_name}"]
                 allow_methods=["GET", "POST", "OPTIONS"],
@@ -548,6 +772,8 @@ class CdkStack(Stack):
         albums_resource.add_method("GET", apigw.LambdaIntegration(get_albums_fn))
         album_resource = albums_resource.add_resource("{id}")
         album_resource.add_method("GET", apigw.LambdaIntegration(get_albums_fn))
+        # ✅ GET /albums/search?q=...&k=10
+        albums_resource.add_resource("search").add_method("GET", apigw.LambdaIntegration(get_albums_fn))
         # ✅ Nuovo endpoint GET /albums/by-title/{title}
         album_by_title = albums_resource.add_resource("by-title").add_resource("{title}")
         album_by_title.add_method("GET", apigw.LambdaIntegration(get_albums_fn))
@@ -575,6 +801,14 @@ class CdkStack(Stack):
             authorization_type=apigw.AuthorizationType.COGNITO,
         )
 
+        # /ratings/{album_id}/likes?reviews=u1,u2 → quali recensioni ho già likato
+        ratings_id.add_resource("likes").add_method(
+            "GET",
+            apigw.LambdaIntegration(ratings_fn),
+            authorizer=authorizer,
+            authorization_type=apigw.AuthorizationType.COGNITO,
+        )
+
         # /ratings/{album_id}/{review_user_id}/like
         review_user = ratings_id.add_resource("{review_user_id}").add_resource("like")
         review_user.add_method(
@@ -591,24 +825,38 @@ class CdkStack(Stack):
         # /users/favorites/{album_id}
         users_resource = api.root.add_resource("users")
 
+        # GET /users/{user_id}/ratings?limit=&cursor= (recensioni di un utente, da UserIndex)
+        users_resource.add_resource("{user_id}").add_resource("ratings").add_method(
+            "GET",
+            apigw.LambdaIntegration(ratings_fn),
+        )
+
         # aggiungo CORS al livello di /users/favorites
         favorites_resource = users_resource.add_resource(
             "favorites",
             default_cors_preflight_options=apigw.CorsOptions(
                 allow_origins=["*"],   # meglio: [f"https://{distribution.attr_domain_name}"]
-                allow_methods=["OPTIONS", "POST"],
+                allow_methods=["OPTIONS", "GET", "POST", "DELETE"],
                 allow_headers=["Content-Type", "Authorization"],
             )
         )
-
-        fav_id = favorites_resource.add_resource("{album_id}")
-        fav_id.add_method(
-            "POST",
+        # GET /users/favorites?limit=&cursor= (preferiti con i metadati degli album)
+        favorites_resource.add_method(
+            "GET",
             apigw.LambdaIntegration(favorites_fn),
             authorizer=authorizer,
             authorization_type=apigw.AuthorizationType.COGNITO,
         )
 
+        fav_id = favorites_resource.add_resource("{album_id}")
+        for method in ("POST", "DELETE"):
+            fav_id.add_method(
+                method,
+                apigw.LambdaIntegration(favorites_fn),
+                authorizer=authorizer,
+                authorization_type=apigw.AuthorizationType.COGNITO,
+            )
+
 
         # Producer
         producer_resource = api.root.add_resource("producer")
@@ -642,12 +890,24 @@ class CdkStack(Stack):
 
         # --- API: /charts/{year} (senza region) ---
         charts_resource = api.root.add_resource("charts")
+        # GET /charts?from=1970&to=2025&top=10 (più anni in una richiesta)
+        charts_resource.add_method(
+            "GET",
+            apigw.LambdaIntegration(charts_read_fn),
+            authorization_type=apigw.AuthorizationType.NONE,
+        )
         charts_year = charts_resource.add_resource("{year}")
         charts_year.add_method(
             "GET",
             apigw.LambdaIntegration(charts_read_fn),
             authorization_type=apigw.AuthorizationType.NONE,
         )
+        # --- API: /charts/{year}/{region} (chiave esatta "1999#EUROPE") ---
+        charts_year.add_resource("{region}").add_method(
+            "GET",
+            apigw.LambdaIntegration(charts_read_fn),
+            authorization_type=apigw.AuthorizationType.NONE,
+        )
 
 
 
@@ -1,21 +1,50 @@
-import os, time, json, sys
-from collections import defaultdict
-from typing import List, Dict, Any
+import os, time, json, sys, random
+import gzip, hashlib, calendar, zlib
+import sqlite3
+import shutil
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple
 
 import boto3
+import requests
 from botocore.exceptions import ClientError
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 from spotipy.exceptions import SpotifyException
 from decimal import Decimal
 
+import scoring
+
 # -------- Config da ENV --------
 CHARTS_TABLE       = os.environ["CHARTS_TABLE"]                    # 👈 usa CHARTS_TABLE
 START_YEAR         = int(os.getenv("START_YEAR", "1970"))
 END_YEAR           = int(os.getenv("END_YEAR", "2025"))
 PER_MARKET_FETCH   = int(os.getenv("PER_MARKET_FETCH", "100"))     # paging a blocchi max 50
 TOP_K              = int(os.getenv("TOP_K", "20"))
-SLEEP_BETWEEN_CALL = float(os.getenv("SLEEP_BETWEEN_CALL", "0.25"))
+CHART_WEIGHTING    = os.getenv("CHART_WEIGHTING", "bayesian")       # mean | coverage | bayesian (scoring.WEIGHTINGS)
+SPOTIFY_WORKERS    = int(os.getenv("SPOTIFY_WORKERS", "8"))         # richieste Spotify in parallelo
+SPOTIFY_RATE       = float(os.getenv("SPOTIFY_RATE", "8"))          # richieste/s, per TUTTI gli shard insieme
+SPOTIFY_BURST      = int(os.getenv("SPOTIFY_BURST", "8"))
+# Più task in parallelo: lo shard i di N fa gli anni START_YEAR + i, + i + N, ...
+SHARD_INDEX        = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT        = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SUFFIX       = f"-{SHARD_INDEX}of{SHARD_COUNT}" if SHARD_COUNT > 1 else ""
+SNAPSHOT_BUCKET    = os.getenv("SNAPSHOT_BUCKET")                  # snapshot JSON per charts_read (opzionale)
+SNAPSHOT_PREFIX    = "charts"
+SNAPSHOT_MANIFEST  = f"{SNAPSHOT_PREFIX}/manifest.json"
+# Ogni quanto ricontrollare un anno: "anni_fa:giorni", il primo che copre l'età dell'anno vince
+REFRESH_POLICY     = os.getenv("REFRESH_POLICY", "0:1,5:7,*:30")   # anno corrente 1g, ultimi 5 7g, altri 30g
+FORCE_REFRESH      = os.getenv("FORCE_REFRESH", "") == "1"          # ignora policy e fingerprint
+RESUME_WINDOW_H    = float(os.getenv("RESUME_WINDOW_HOURS", "20"))  # un run interrotto si riprende solo entro N ore
+# Cache su disco delle risposte Spotify (SQLite); CACHE_PATH vuoto = disattivata
+CACHE_PATH         = os.getenv("CACHE_PATH", "/tmp/spotify-cache.sqlite")
+CACHE_MAX_MB       = float(os.getenv("CACHE_MAX_MB", "256"))
+CACHE_TTL_HOURS    = os.getenv("CACHE_TTL_HOURS", "search:12,album:720")  # la search deve scadere prima del refresh giornaliero
+CACHE_BUCKET       = os.getenv("CACHE_BUCKET")                      # seed/persist tra un task Fargate e l'altro (opzionale)
+CACHE_KEY          = os.getenv("CACHE_KEY") or f"cache/spotify-cache{SHARD_SUFFIX}.sqlite.gz"   # una per shard
+COPY_CHUNK         = 1024 * 1024                                     # seed/persist della cache a blocchi da 1 MB
 
 # Definizione gruppi/regioni → lista mercati Spotify
 EUROPE_MARKETS = ["IT","FR","DE","ES","NL","SE","GB","IE","PT","BE","AT","CH","DK","NO","FI","GR","PL","CZ","HU","RO","SK","SI","HR","BG","LT","LV","EE","LU","MT","CY"]
@@ -33,26 +62,228 @@ REGION_GROUPS = {
 # -------- Clients --------
 dynamodb = boto3.resource("dynamodb")
 charts = dynamodb.Table(CHARTS_TABLE)
+s3 = boto3.client("s3")
+
+def http_session(pool_size: int = SPOTIFY_WORKERS) -> requests.Session:
+    """
+    Sessione senza il Retry di urllib3 che spotipy monta di default: i 429 devono
+    arrivare a _retryable (con Retry-After) per rallentare il limiter globale.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+sp = Spotify(
+    auth_manager=SpotifyClientCredentials(
+        client_id=os.environ["SPOTIPY_CLIENT_ID"],
+        client_secret=os.environ["SPOTIPY_CLIENT_SECRET"]
+    ),
+    requests_session=http_session(),
+)
+
+# -------- Rate limiting --------
+class RateLimiter:
+    """
+    Token bucket condiviso da tutti i thread del pool.
+    Un 429 ferma TUTTI i thread fino a Retry-After e dimezza il rate;
+    ogni risposta ok lo fa risalire un po' verso quello configurato (AIMD).
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float = 0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.clock, self.sleep = clock, sleep
+        self.updated = clock()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "waited_s": 0.0}
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1 - 1e-9:   # tolleranza sugli arrotondamenti float
+                        self.tokens -= 1
+                        self.stats["requests"] += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.stats["waited_s"] += wait
+            self.sleep(wait)
+
+    def throttled(self, retry_after: float):
+        with self.lock:
+            now = self.clock()
+            self.paused_until = max(self.paused_until, now + retry_after)
+            self.rate = max(self.min_rate, self.rate / 2)
+            # niente token accumulati durante la pausa: si riparte piano
+            self.tokens = 0.0
+            self.updated = self.paused_until
+            self.stats["throttled"] += 1
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+# Quota Spotify divisa in parti uguali: gli shard non si parlano, così insieme restano sotto SPOTIFY_RATE
+limiter = RateLimiter(SPOTIFY_RATE / SHARD_COUNT, max(1, SPOTIFY_BURST // SHARD_COUNT))
+pool = ThreadPoolExecutor(max_workers=SPOTIFY_WORKERS)
+
+# -------- Cache risposte --------
+class ResponseCache:
+    """
+    Risposte Spotify su SQLite, chiave = endpoint + parametri, body JSON compresso (zlib).
+    TTL per endpoint; oltre max_bytes si espellono le meno usate di recente (LRU).
+    Una sola connessione condivisa dai thread del pool, serializzata da un lock:
+    le letture sono di pochi microsecondi contro le centinaia di ms di una chiamata HTTP.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttls: Dict[str, float], clock=time.time):
+        self.path, self.max_bytes, self.ttls, self.clock = path, max_bytes, ttls, clock
+        self.lock = threading.Lock()
+        self.conn = None   # aperta al primo uso: il seed da S3 deve arrivare prima
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "stores": 0}
+
+    @staticmethod
+    def parse_ttls(spec: str) -> Dict[str, float]:
+        """"search:12,album:720" → endpoint → secondi"""
+        return {name.strip(): float(hours) * 3600 for name, hours in (p.split(":") for p in spec.split(","))}
+
+    @staticmethod
+    def key(endpoint: str, **params) -> str:
+        return endpoint + "?" + json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+    def _db(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, body BLOB NOT NULL,
+                expires_at REAL NOT NULL, used_at REAL NOT NULL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used_at)")
+            self.conn.execute("DELETE FROM responses WHERE expires_at <= ?", (self.clock(),))
+            self.bytes = self.conn.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        return self.conn
+
+    def get(self, key: str):
+        with self.lock:
+            db, now = self._db(), self.clock()
+            row = db.execute("SELECT body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if row[1] <= now:
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.bytes -= len(row[0])
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+        return json.loads(zlib.decompress(row[0]))
 
-sp = Spotify(auth_manager=SpotifyClientCredentials(
-    client_id=os.environ["SPOTIPY_CLIENT_ID"],
-    client_secret=os.environ["SPOTIPY_CLIENT_SECRET"]
-))
+    def put(self, endpoint: str, key: str, value):
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+        body = zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        with self.lock:
+            db, now = self._db(), self.clock()
+            old = db.execute("SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)).fetchone()
+            db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                       (key, endpoint, body, now + ttl, now))
+            self.bytes += len(body) - (old[0] if old else 0)
+            self.stats["stores"] += 1
+            if self.bytes > self.max_bytes:
+                self._evict(db)
+
+    def _evict(self, db):
+        # si scende al 90% per non espellere a ogni put
+        target = self.max_bytes * 0.9
+        rows = db.execute("SELECT key, LENGTH(body) FROM responses ORDER BY used_at").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self.bytes <= target:
+                break
+            doomed.append((key,))
+            self.bytes -= size
+        db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self.stats["evictions"] += len(doomed)
+
+    def seed(self, bucket: str, key: str):
+        """Scarica la cache del task precedente (gzip) se in locale non c'è."""
+        if self.conn is not None or os.path.exists(self.path):
+            return
+        # tutto in streaming (S3 → .gz su disco → SQLite): la cache può pesare più della RAM del task
+        gz_path, part_path = self.path + ".gz", self.path + ".part"
+        try:
+            with open(gz_path, "wb") as f:
+                s3.download_fileobj(bucket, key, f)
+            with gzip.open(gz_path, "rb") as src, open(part_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+            os.replace(part_path, self.path)   # niente file a metà se il download si interrompe
+            print(f"🗄️ Cache Spotify da s3://{bucket}/{key}: {os.path.getsize(gz_path)} byte", flush=True)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            print("🗄️ Nessuna cache Spotify su S3, si parte vuoti", flush=True)
+        finally:
+            for tmp in (gz_path, part_path):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def persist(self, bucket: str, key: str):
+        """Compatta il file (niente scaduti, niente WAL) e lo carica su S3 per il prossimo task."""
+        gz_path = self.path + ".gz"
+        with self.lock:
+            db = self._db()
+            db.execute("DELETE FROM responses WHERE expires_at <= ?", (self.clock(),))
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            db.execute("VACUUM")
+            with open(self.path, "rb") as src, gzip.open(gz_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK)
+        try:
+            size = os.path.getsize(gz_path)
+            with open(gz_path, "rb") as f:
+                s3.upload_fileobj(f, bucket, key)   # multipart oltre 8 MB, a blocchi
+        finally:
+            os.remove(gz_path)
+        print(f"🗄️ Cache Spotify salvata su s3://{bucket}/{key}: {size} byte", flush=True)
+
+cache = ResponseCache(CACHE_PATH, int(CACHE_MAX_MB * 1024 * 1024),
+                      ResponseCache.parse_ttls(CACHE_TTL_HOURS)) if CACHE_PATH else None
 
 # -------- Helpers --------
 def _retryable(fn, *args, **kwargs):
     backoff = 0.5
     for attempt in range(7):
+        limiter.acquire()
         try:
-            return fn(*args, **kwargs)
+            result = fn(*args, **kwargs)
+            limiter.succeeded()
+            return result
         except SpotifyException as e:
             status = getattr(e, "http_status", None)
-            if status in (429, 500, 502, 503, 504):
-                retry_after = getattr(e, "headers", {}).get("Retry-After")
-                wait = float(retry_after) if retry_after else backoff
-                wait = min(wait, 15.0)
-                print(f"⏳ Spotify {status}, retry tra {wait}s...", flush=True)
-                time.sleep(wait)
+            if status == 429:
+                retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+                wait = min(float(retry_after) if retry_after else backoff, 60.0)
+                print(f"⏳ Spotify 429, tutti in pausa per {wait}s...", flush=True)
+                limiter.throttled(wait)   # la pausa la fa acquire(), per tutti i thread
+                backoff = min(backoff * 2, 15.0)
+                continue
+            if status in (500, 502, 503, 504):
+                print(f"⏳ Spotify {status}, retry tra {backoff}s...", flush=True)
+                time.sleep(backoff)
                 backoff = min(backoff * 2, 15.0)
                 continue
             raise
@@ -63,115 +294,144 @@ def _retryable(fn, *args, **kwargs):
                 continue
             raise
 
-def search_albums_year_market(year: int, market: str, want: int) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
+def search_albums_year_market(year: int, market: str, want: int) -> Iterator[Dict[str, Any]]:
+    """Album della search una pagina (max 50) alla volta: in memoria c'è solo la pagina corrente."""
     remaining = want
     offset = 0
     while remaining > 0:
         limit = min(remaining, 50)
-        res = _retryable(
-            sp.search,
-            q=f"year:{year}",
-            type="album",
-            limit=limit,
-            offset=offset,
-            market=market
-        ) or {}
+        params = dict(q=f"year:{year}", type="album", limit=limit, offset=offset, market=market)
+        key = cache and ResponseCache.key("search", **params)
+        res = cache.get(key) if cache else None
+        if res is None:
+            res = _retryable(sp.search, **params) or {}
+            if cache and res:
+                cache.put("search", key, res)
         batch = (res.get("albums") or {}).get("items", [])
         if not batch:
             break
-        items.extend(batch)
+        yield from batch
         remaining -= len(batch)
         offset += len(batch)
-        time.sleep(SLEEP_BETWEEN_CALL)
         if len(batch) < limit:
             break
-    return items
 
-def aggregate_for_markets(year: int, markets: List[str] | None, per_market_fetch: int) -> Dict[str, Dict[str, Any]]:
+def market_candidates(year: int, market: str, per_market_fetch: int) -> List[Tuple[scoring.Candidate, float]]:
+    """
+    Pagine → filtro → Candidate + segnale, dentro il worker: del JSON Spotify
+    (immagini, available_markets, artisti...) non sopravvive niente alla pagina.
+    """
+    out = []
+    for pos, alb in enumerate(search_albums_year_market(year, market, per_market_fetch)):
+        if alb.get("album_type") != "album":
+            continue
+        if (alb.get("release_date") or "")[:4] != str(year):
+            continue
+        if not alb.get("id"):
+            continue
+        # la search dà album semplificati, di solito senza popularity: vale la posizione
+        pop = alb.get("popularity")
+        signal = float(pop) if pop is not None else scoring.position_score(pos, per_market_fetch)
+        out.append((scoring.Candidate.from_album(alb), signal))
+    return out
+
+def aggregate_for_markets(year: int, markets: List[str] | None, per_market_fetch: int) -> scoring.Aggregate:
     """
-    Ritorna un dict album_id -> {sum, n, album, markets:set}
-    Se markets è None: usa un insieme di mercati “proxy” prendendo market=None (GLOBAL-like).
+    Ricerca per mercato in parallelo, poi aggregazione per album (scoring.aggregate).
+    Se markets è None: usa un insieme di mercati “proxy” (GLOBAL-like).
     """
-    agg: Dict[str, Dict[str, Any]] = defaultdict(lambda: {"sum": 0.0, "n": 0, "album": None, "markets": set()})
-    # Caso GLOBAL: facciamo una sola ricerca senza 'market' e usiamo popularity del payload (se presente)
+    # Caso GLOBAL: spotipy non consente search senza mercato, usiamo un insieme “ampio”
     if markets is None:
-        # spotipy non consente search senza mercato? Allora usiamo un mercato “ampio”
         markets = ["US","GB","DE","FR","IT","BR","MX","JP","AU","CA","ES","NL","SE"]
 
-    for m in markets:
+    def fetch(m):
+        print(f"📡 {year} – fetch market {m}...", flush=True)
         try:
-            print(f"📡 {year} – fetch market {m}...", flush=True)
-            items = search_albums_year_market(year, m, per_market_fetch)
-            for alb in items:
-                if alb.get("album_type") != "album":
-                    continue
-                rd = (alb.get("release_date") or "")[:4]
-                if rd != str(year):
-                    continue
-                aid = alb.get("id")
-                if not aid:
-                    continue
-                pop = alb.get("popularity") or 0
-                agg[aid]["sum"] += float(pop)
-                agg[aid]["n"] += 1
-                agg[aid]["album"] = alb
-                agg[aid]["markets"].add(m)
+            return market_candidates(year, m, per_market_fetch)
         except Exception as e:
             print(f"⚠️ {year} market {m}: {e}", flush=True)
-    return agg
+            return []
 
-def build_chart_entries(year: int, agg: Dict[str, Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
-    ranked = []
-    for aid, a in agg.items():
-        alb = a["album"]
-        if not alb or a["n"] == 0:
-            continue
-        artist = (alb.get("artists") or [{}])[0].get("name", "Unknown")
-        ranked.append({
-            "album_id": aid,
-            "title": alb.get("name"),
-            "artist": artist,
-            "release_date": alb.get("release_date", ""),
-            "cover": (alb.get("images") or [{}])[0].get("url", ""),
-        })
-
-    # dedup su (artist, title)
-    seen = set()
-    deduped = []
-    for r in ranked:   # 👈 non serve più ordinare per score
-        key = (r["artist"].lower(), r["title"].lower())
-        if key in seen:
-            continue
-        seen.add(key)
-        deduped.append(r)
-        if len(deduped) >= top_k:
-            break
-    return deduped
+    def observations():
+        # l'ordine dei mercati resta quello della lista (= ordine di prima apparizione degli album)
+        for m, found in zip(markets, pool.map(fetch, markets)):
+            for candidate, signal in found:
+                yield m, candidate, signal
+
+    return scoring.aggregate(observations())
+
+def build_chart_entries(year: int, agg: scoring.Aggregate, top_k: int) -> List[Dict[str, Any]]:
+    # top-k per score, dedup su (artist, title): stesso disco con id diversi per mercato
+    ranked = scoring.rank(agg, top_k, CHART_WEIGHTING, key=lambda c: (c.artist.lower(), c.title.lower()))
+    return [{
+        "album_id": c.id,
+        "title": c.title,
+        "artist": c.artist,
+        "release_date": c.release_date,
+        "cover": c.cover,
+        "score": round(score, 2),
+    } for c, score in ranked]
 
 
 
 
-def get_album_details(album_id: str) -> Dict[str, Any]:
-    """Recupera solo le tracce di un album da Spotify"""
+# Dettagli album condivisi tra tutti gli anni del run: ogni album si scarica una volta sola
+ALBUMS_BATCH = 20   # limite di GET /v1/albums?ids=
+_details_cache: Dict[str, Dict[str, Any]] = {}
+_details_lock = threading.Lock()
+
+def _all_tracks(alb: Dict[str, Any]) -> List[str]:
+    """Tracce dell'album, seguendo le pagine successive alla prima (album con più di 50 tracce)."""
+    page = alb.get("tracks") or {}
+    names = [t.get("name") for t in page.get("items", [])]
+    while page.get("next"):
+        page = _retryable(sp.next, page) or {}
+        names += [t.get("name") for t in page.get("items", [])]
+    return names
+
+def _fetch_details_chunk(chunk: List[str]) -> Dict[str, Dict[str, Any]]:
     try:
-        alb = _retryable(sp.album, album_id)
-        if not alb:
-            return {}
-        return {
-            "songs": [t.get("name") for t in alb.get("tracks", {}).get("items", [])]
-        }
+        res = _retryable(sp.albums, chunk) or {}
+        # stesso ordine degli id; null per gli id che Spotify non conosce
+        found = {aid: {"songs": _all_tracks(alb) if alb else []}
+                 for aid, alb in zip(chunk, res.get("albums") or [])}
+        if cache:
+            # per album e non per blocco: gli id arrivano raggruppati diversamente a ogni anno/run
+            for aid, details in found.items():
+                if details["songs"]:
+                    cache.put("album", ResponseCache.key("album", id=aid), details)
+        return found
     except Exception as e:
-        print(f"⚠️ Dettagli album {album_id} non trovati: {e}", flush=True)
-        return {"songs": []}
+        print(f"⚠️ Dettagli album {','.join(chunk)} non trovati: {e}", flush=True)
+        return {}   # non in cache: si ritenta al prossimo anno che li contiene
+
+def get_album_details(album_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Tracce per più album: cache del run + GET /albums?ids= a blocchi di 20, in parallelo sul pool."""
+    ids = list(dict.fromkeys(album_ids))
+    with _details_lock:
+        missing = [a for a in ids if a not in _details_cache]
+    if cache:
+        from_disk = {a: cache.get(ResponseCache.key("album", id=a)) for a in missing}
+        from_disk = {a: d for a, d in from_disk.items() if d is not None}
+        with _details_lock:
+            _details_cache.update(from_disk)
+        missing = [a for a in missing if a not in from_disk]
+    chunks = [missing[i:i + ALBUMS_BATCH] for i in range(0, len(missing), ALBUMS_BATCH)]
+    for found in pool.map(_fetch_details_chunk, chunks):
+        with _details_lock:
+            _details_cache.update(found)
+    with _details_lock:
+        return {a: _details_cache.get(a, {"songs": []}) for a in ids}
 
-    
 
 def save_chart(year: int, entries: List[Dict[str, Any]]):
     chart_key = str(year)
     ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
     seen_ids = set()
+    saved = []
+    # dettagli (tracce) in blocco PRIMA di aprire il batch_writer
+    details_by_id = get_album_details([e["album_id"] for e in entries])
     with charts.batch_writer() as batch:
         for idx, e in enumerate(entries, start=1):
             if e["album_id"] in seen_ids:
@@ -179,7 +439,7 @@ def save_chart(year: int, entries: List[Dict[str, Any]]):
                 continue
             seen_ids.add(e["album_id"])
 
-            details = get_album_details(e["album_id"])
+            details = details_by_id.get(e["album_id"]) or {}
 
             item = {
                 "chart_key": chart_key,   # PK = anno
@@ -195,27 +455,268 @@ def save_chart(year: int, entries: List[Dict[str, Any]]):
                 "songs": details.get("songs", []),
             }
             batch.put_item(Item=item)
+            saved.append(item)
             print(f"✅ {year} #{idx}: {e['artist']} – {e['title']}", flush=True)
 
+    # Manifest dell'anno (rank 0): charts_read risponde 404 con una sola query, senza scan
+    charts.update_item(
+        Key={"chart_key": chart_key, "rank": 0},
+        UpdateExpression="ADD regions :r SET kind = :k, updated_at = :ts",
+        ExpressionAttributeValues={":r": {"GLOBAL"}, ":k": "manifest", ":ts": ts},
+    )
+    return saved
+
+
+# -------- Snapshot per charts_read --------
+def chart_document(items: List[Dict[str, Any]]) -> str:
+    """
+    Body di GET /charts/{year} già pronto: stesso JSON canonico (chiavi ordinate,
+    separatori compatti) e quindi stesso ETag che produrrebbe charts_read.
+    """
+    clean = [{k: v for k, v in it.items() if k not in ("fetched_at", "region")} for it in items]
+    clean.sort(key=lambda x: x.get("rank", 10**9))
+    return json.dumps({"items": clean}, sort_keys=True, separators=(",", ":"))
+
+def write_snapshot(version: str, year: int, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Un oggetto gzip per anno, sotto un prefisso per run: i run vecchi restano leggibili."""
+    body = chart_document(items)
+    blob = gzip.compress(body.encode("utf-8"), compresslevel=9)
+    key = f"{SNAPSHOT_PREFIX}/{version}/{year}.json.gz"
+    s3.put_object(Bucket=SNAPSHOT_BUCKET, Key=key, Body=blob,
+                  ContentType="application/json", ContentEncoding="gzip")
+    return {
+        "key": key,
+        "etag": '"%s"' % hashlib.sha256(body.encode("utf-8")).hexdigest()[:32],
+        "fetched_at": max((it.get("fetched_at") or "" for it in items), default=""),
+        "entries": len(items),
+        "bytes": len(blob),
+    }
+
+def publish_manifest(version: str, years: Dict[str, Dict[str, Any]]):
+    """
+    Il manifest è l'unico oggetto che charts_read rilegge: scritto UNA volta a fine run,
+    cambia versione in modo atomico. Gli anni non rifatti in questo run restano quelli vecchi.
+    Con più shard lo riscrivono in tanti: read-modify-write condizionato sull'ETag, si
+    rilegge e si riprova se un altro shard l'ha cambiato nel frattempo.
+    """
+    for attempt in range(10):
+        try:
+            obj = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_MANIFEST)
+            manifest, condition = json.loads(obj["Body"].read()), {"IfMatch": obj["ETag"]}
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("NoSuchKey", "404"):
+                raise
+            manifest, condition = {"years": {}}, {"IfNoneMatch": "*"}
+        manifest["years"].update(years)
+        manifest["version"] = version
+        manifest["generated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        try:
+            s3.put_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_MANIFEST,
+                          Body=json.dumps(manifest, separators=(",", ":")).encode("utf-8"),
+                          ContentType="application/json", CacheControl="no-cache", **condition)
+            break
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise
+            print(f"🔁 Manifest cambiato da un altro shard, riprovo ({attempt + 1})", flush=True)
+            time.sleep(random.uniform(0.05, 0.5))
+    else:
+        raise RuntimeError("manifest snapshot: troppi conflitti con gli altri shard")
+    print(f"🗂️ Manifest snapshot {version}: {len(years)} anni aggiornati", flush=True)
+
+
+
+# -------- Run incrementali --------
+# Stato per anno sul manifest (rank 0): fingerprint della classifica sorgente + checked_at.
+# Stato del run in un item di checkpoint: anni già completati e snapshot non ancora pubblicati.
+MANIFEST_RANK = 0
+CHECKPOINT_KEY = {"chart_key": f"SCRAPER#run{SHARD_SUFFIX}", "rank": 0}   # uno per shard
+REFRESH_SLACK_S = 2 * 3600   # il run delle 03:00 di ieri non deve far saltare quello di oggi per pochi minuti
+
+def _iso(epoch: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch))
+
+def _epoch(iso: str) -> float:
+    return calendar.timegm(time.strptime(iso, "%Y-%m-%dT%H:%M:%SZ"))
+
+def parse_refresh_policy(spec: str) -> List[tuple]:
+    """"0:1,5:7,*:30" → [(0, 1 giorno), (5, 7 giorni), (inf, 30 giorni)] in secondi, per età crescente."""
+    rules = []
+    for part in spec.split(","):
+        age, days = part.strip().split(":")
+        rules.append((float("inf") if age.strip() == "*" else int(age), float(days) * 86400))
+    return sorted(rules)
 
+def refresh_interval(year: int, now: float, policy: List[tuple]) -> float:
+    age = time.gmtime(now).tm_year - year
+    for max_age, interval in policy:
+        if age <= max_age:
+            return interval
+    return policy[-1][1]
 
-def run_for_year(year: int):
+def year_due(year: int, state: Dict[str, Any], now: float, policy: List[tuple]) -> bool:
+    if FORCE_REFRESH or not state.get("checked_at") or not state.get("fingerprint"):
+        return True
+    return now - _epoch(state["checked_at"]) >= refresh_interval(year, now, policy) - REFRESH_SLACK_S
+
+def chart_fingerprint(entries: List[Dict[str, Any]]) -> str:
+    """Hash della classifica così come esce da Spotify (ordine compreso), prima di scaricare le tracce."""
+    fields = [[e["album_id"], e["title"], e["artist"], e.get("release_date", ""), e.get("cover", "")]
+              for e in entries]
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()[:32]
+
+def year_state(year: int) -> Dict[str, Any]:
+    return charts.get_item(Key={"chart_key": str(year), "rank": MANIFEST_RANK},
+                           ProjectionExpression="fingerprint, checked_at",
+                           ConsistentRead=True).get("Item") or {}
+
+def mark_checked(year: int, fingerprint: str, now: float):
+    charts.update_item(
+        Key={"chart_key": str(year), "rank": MANIFEST_RANK},
+        UpdateExpression="SET kind = :k, fingerprint = :f, checked_at = :ts",
+        ExpressionAttributeValues={":k": "manifest", ":f": fingerprint, ":ts": _iso(now)},
+    )
+
+def start_run(now: float) -> Dict[str, Any]:
+    """
+    Riprende il run interrotto (task Fargate andato in crash) se è abbastanza recente,
+    altrimenti ne apre uno nuovo. Gli snapshot già scritti e mai pubblicati passano
+    comunque al run nuovo: quegli anni potrebbero non essere più da rifare.
+    """
+    previous = charts.get_item(Key=CHECKPOINT_KEY, ConsistentRead=True).get("Item") or {}
+    interrupted = previous.get("status") == "running"
+    pending = dict(previous.get("snapshots") or {}) if interrupted else {}
+    if interrupted and now - _epoch(previous["started_at"]) < RESUME_WINDOW_H * 3600:
+        run = {"version": previous["version"], "started_at": previous["started_at"],
+               "done_years": {int(y) for y in previous.get("done_years") or ()}, "snapshots": pending}
+        print(f"♻️ Riprendo il run {run['version']}: {len(run['done_years'])} anni già completati", flush=True)
+        return run
+    run = {"version": time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now)), "started_at": _iso(now),
+           "done_years": set(), "snapshots": pending}
+    charts.put_item(Item=dict(CHECKPOINT_KEY, status="running", version=run["version"],
+                              started_at=run["started_at"], snapshots=pending))
+    return run
+
+def checkpoint_year(year: int, snapshot: Dict[str, Any] | None):
+    update = "ADD done_years :y SET last_year = :n, updated_at = :ts"
+    values = {":y": {year}, ":n": year, ":ts": _iso(time.time())}
+    names = {}
+    if snapshot:
+        # JSON e non mappa: al resume torna com'era (int e non Decimal) per publish_manifest
+        update += ", snapshots.#y = :s"
+        names["#y"] = str(year)
+        values[":s"] = json.dumps(snapshot)
+    charts.update_item(Key=CHECKPOINT_KEY, UpdateExpression=update, ExpressionAttributeValues=values,
+                       **({"ExpressionAttributeNames": names} if names else {}))
+
+def finish_run(summary: Dict[str, Any]):
+    charts.update_item(
+        Key=CHECKPOINT_KEY,
+        UpdateExpression="SET #s = :s, finished_at = :ts, counts = :c REMOVE done_years, snapshots",
+        ExpressionAttributeNames={"#s": "status"},
+        ExpressionAttributeValues={":s": "done", ":ts": _iso(time.time()), ":c": summary["years"]},
+    )
+
+
+def memory_mb() -> Tuple[float, float]:
+    """(RSS attuale, picco del processo) in MiB. L'attuale da /proc (Linux, come su Fargate)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024   # KiB su Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except OSError:
+        current = peak
+    return current, peak
+
+def shard_years(start: int, end: int, index: int, count: int) -> List[int]:
+    """
+    Anni dello shard, a passo count invece che a blocchi contigui: gli anni recenti
+    (gli unici da rifare quasi ogni notte) finiscono su task diversi.
+    """
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"shard {index}/{count} non valido")
+    return [y for y in range(start, end + 1) if (y - start) % count == index]
+
+
+def run_for_year(year: int, previous_fingerprint: str | None = None):
+    """Ritorna (fingerprint, item salvati); item None se la classifica non è cambiata."""
     print(f"🧮 Aggrego {year}", flush=True)
     # lista mercati fissi per avere un po' di diversità
     markets = ["US","GB","DE","FR","IT"]
     agg = aggregate_for_markets(year, markets, PER_MARKET_FETCH)
     entries = build_chart_entries(year, agg, TOP_K)
-    save_chart(year, entries)
+    fingerprint = chart_fingerprint(entries)
+    if entries and fingerprint == previous_fingerprint and not FORCE_REFRESH:
+        print(f"⏭️ {year}: classifica invariata, niente tracce né scritture", flush=True)
+        return fingerprint, None
+    return fingerprint, save_chart(year, entries)
+
 
 
 
 
 
+def run_years(run: Dict[str, Any], now: float, policy: List[tuple],
+              snapshots: Dict[str, Dict[str, Any]], years: Dict[str, int]):
+    for year in shard_years(START_YEAR, END_YEAR, SHARD_INDEX, SHARD_COUNT):
+        if year in run["done_years"]:
+            years["resumed"] += 1
+            continue
+        state = year_state(year)
+        snapshot = None
+        if not year_due(year, state, now, policy):
+            years["skipped"] += 1
+        else:
+            fingerprint, items = run_for_year(year, state.get("fingerprint"))
+            if items is None:
+                years["unchanged"] += 1
+                mark_checked(year, fingerprint, now)
+            elif not items:
+                # Spotify non ha risposto niente di utile: niente fingerprint, si riprova al prossimo run
+                print(f"⚠️ {year}: classifica vuota, anno da ricontrollare", flush=True)
+                years["empty"] += 1
+            else:
+                years["scraped"] += 1
+                if SNAPSHOT_BUCKET:
+                    snapshot = snapshots[str(year)] = write_snapshot(run["version"], year, items)
+                mark_checked(year, fingerprint, now)
+        checkpoint_year(year, snapshot)
+        current, peak = memory_mb()
+        print(f"📏 {year}: RSS {current:.0f} MiB, picco {peak:.0f} MiB", flush=True)
+
+def main(now: float | None = None):
+    print(f"▶️ RUN years {START_YEAR}-{END_YEAR} | per_market_fetch={PER_MARKET_FETCH} | top_k={TOP_K} "
+          f"| workers={SPOTIFY_WORKERS} rate={SPOTIFY_RATE}/s | refresh={REFRESH_POLICY}"
+          f"{' (FORCE)' if FORCE_REFRESH else ''} | shard {SHARD_INDEX + 1}/{SHARD_COUNT} "
+          f"a {limiter.rate:g} req/s", flush=True)
+    started = time.time()
+    now = started if now is None else now
+    policy = parse_refresh_policy(REFRESH_POLICY)
+    if cache and CACHE_BUCKET:
+        cache.seed(CACHE_BUCKET, CACHE_KEY)
+    run = start_run(now)
+    version, snapshots = run["version"], {y: json.loads(s) for y, s in run["snapshots"].items()}
+    years = {"scraped": 0, "unchanged": 0, "skipped": 0, "empty": 0, "resumed": 0}
+    try:
+        run_years(run, now, policy, snapshots, years)
+    finally:
+        # anche dopo un crash: il task che riprende trova le risposte già scaricate
+        if cache and CACHE_BUCKET:
+            cache.persist(CACHE_BUCKET, CACHE_KEY)
+    if SNAPSHOT_BUCKET and snapshots:
+        publish_manifest(version, snapshots)
+    summary = {"seconds": round(time.time() - started, 1), "version": version, "years": years,
+               "shard": {"index": SHARD_INDEX, "count": SHARD_COUNT,
+                         "years": shard_years(START_YEAR, END_YEAR, SHARD_INDEX, SHARD_COUNT)},
+               "spotify": dict(limiter.stats), "cache": dict(cache.stats) if cache else None,
+               "peak_rss_mb": round(memory_mb()[1], 1)}
+    finish_run(summary)
+    st, cs = summary["spotify"], summary["cache"] or {"hits": 0, "misses": 0}
+    print(f"🏁 Run completato in {summary['seconds']}s | anni {years} | richieste Spotify {st['requests']} "
+          f"| 429 {st['throttled']} | attesa nel limiter (somma thread) {st['waited_s']:.1f}s "
+          f"| cache hit {cs['hits']} miss {cs['misses']} | picco RSS {summary['peak_rss_mb']} MiB", flush=True)
+    return summary
 
-def main():
-    print(f"▶️ RUN years {START_YEAR}-{END_YEAR} | per_market_fetch={PER_MARKET_FETCH} | top_k={TOP_K}", flush=True)
-    for year in range(START_YEAR, END_YEAR + 1):
-        run_for_year(year)
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,163 @@
+"""
+Scoring delle classifiche: aggregazione per album dei risultati di ricerca
+per mercato (array NumPy indicizzati per album), pesature intercambiabili e
+top-k con heap.
+
+Lo usano lo scraper (app.py, ricerca album) e test.py (ricerca tracce): una
+osservazione è (mercato, candidato, segnale) e il segnale è la popularity se
+Spotify la manda, altrimenti un punteggio dalla posizione nei risultati
+(la search restituisce album "semplificati", senza popularity).
+
+Del payload Spotify (immagini, mercati disponibili, artisti...) si tengono solo
+i campi della classifica: un Candidate con __slots__ per album e le osservazioni
+in colonne array.array, così il JSON di ogni pagina si può buttare appena letto.
+"""
+import heapq
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+class Candidate:
+    """I soli campi di un album che finiscono in classifica."""
+
+    __slots__ = ("id", "title", "artist", "release_date", "cover")
+
+    def __init__(self, id, title, artist, release_date, cover):
+        self.id = id
+        self.title = title
+        self.artist = artist
+        self.release_date = release_date
+        self.cover = cover
+
+    @classmethod
+    def from_album(cls, alb: Dict[str, Any]) -> "Candidate":
+        return cls(alb["id"], alb.get("name") or "",
+                   (alb.get("artists") or [{}])[0].get("name", "Unknown"),
+                   alb.get("release_date") or "",
+                   (alb.get("images") or [{}])[0].get("url", ""))
+
+    def __repr__(self):
+        return f"Candidate({self.id!r}, {self.artist!r} – {self.title!r})"
+
+
+class Aggregate:
+    """Una riga per album, nell'ordine in cui è stato visto la prima volta."""
+
+    __slots__ = ("ids", "candidates", "sums", "counts", "markets_hit", "n_markets")
+
+    def __init__(self, ids, candidates, sums, counts, markets_hit, n_markets):
+        self.ids = ids                    # album_id per riga
+        self.candidates = candidates      # Candidate per riga (il primo visto)
+        self.sums = sums                  # somma dei segnali
+        self.counts = counts              # numero di osservazioni
+        self.markets_hit = markets_hit    # mercati distinti in cui compare
+        self.n_markets = n_markets
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def position_score(position: int, fetched: int) -> float:
+    """100 per il primo risultato, a scendere linearmente fino all'ultimo richiesto."""
+    return 100.0 * (1 - position / max(fetched, 1))
+
+
+def aggregate(observations: Iterable[Tuple[str, Candidate, float]]) -> Aggregate:
+    """
+    (mercato, candidato, segnale) → Aggregate, consumando le osservazioni una alla
+    volta (vanno bene generatori). Il loop Python fa solo l'indicizzazione
+    (id → riga, mercato → colonna) in colonne compatte da 4-8 byte per osservazione;
+    somme, conteggi e copertura sono bincount.
+    """
+    row_of: Dict[str, int] = {}
+    col_of: Dict[str, int] = {}
+    ids: List[str] = []
+    candidates: List[Candidate] = []
+    rows, cols, signals = array("i"), array("i"), array("d")
+    for market, candidate, signal in observations:
+        row = row_of.get(candidate.id)
+        if row is None:
+            row = row_of[candidate.id] = len(ids)
+            ids.append(candidate.id)
+            candidates.append(candidate)
+        rows.append(row)
+        cols.append(col_of.setdefault(market, len(col_of)))
+        signals.append(signal or 0.0)
+
+    n, n_markets = len(ids), max(len(col_of), 1)
+    r = np.frombuffer(rows, dtype=np.int32).astype(np.int64)
+    c = np.frombuffer(cols, dtype=np.int32).astype(np.int64)
+    sums = np.bincount(r, weights=np.frombuffer(signals, dtype=np.float64), minlength=n)
+    counts = np.bincount(r, minlength=n).astype(np.float64)
+    # copertura: coppie (album, mercato) distinte, poi conteggio per album
+    cells = np.unique(r * n_markets + c)
+    markets_hit = np.bincount(cells // n_markets, minlength=n).astype(np.float64)
+    return Aggregate(ids, candidates, sums, counts, markets_hit, n_markets)
+
+
+# -------- Pesature --------
+def mean_score(agg: Aggregate) -> np.ndarray:
+    """Media del segnale: un album visto in un solo mercato vale quanto uno visto ovunque."""
+    return agg.sums / np.maximum(agg.counts, 1)
+
+
+def coverage_score(agg: Aggregate, alpha: float = 1.0) -> np.ndarray:
+    """Media pesata per la quota di mercati in cui l'album compare (alpha = quanto conta)."""
+    return mean_score(agg) * (agg.markets_hit / agg.n_markets) ** alpha
+
+
+def bayesian_score(agg: Aggregate, prior_weight: float = 3.0, prior_mean: float | None = None) -> np.ndarray:
+    """
+    Media con prior: prior_weight osservazioni fittizie pari alla media globale.
+    Con poche osservazioni lo score resta vicino alla media, con tante tende alla sua.
+    """
+    total = agg.counts.sum()
+    m = prior_mean if prior_mean is not None else (agg.sums.sum() / total if total else 0.0)
+    return (prior_weight * m + agg.sums) / (prior_weight + agg.counts)
+
+
+WEIGHTINGS: Dict[str, Callable[..., np.ndarray]] = {
+    "mean": mean_score,
+    "coverage": coverage_score,
+    "bayesian": bayesian_score,
+}
+
+
+def score(agg: Aggregate, weighting: str | Callable[..., np.ndarray] = "bayesian", **params) -> np.ndarray:
+    fn = WEIGHTINGS[weighting] if isinstance(weighting, str) else weighting
+    return fn(agg, **params)
+
+
+# -------- Top-k --------
+def top_k(scores: np.ndarray, k: int, key: Callable[[int], Any] | None = None) -> List[int]:
+    """
+    Righe dei k score più alti, a parità vince l'album visto prima.
+    Heap su tutte le righe (heapify O(n)) e pop finché servono: con key si
+    scartano i duplicati (es. stessa coppia artista/titolo con id diversi)
+    senza dover ordinare tutto né sapere in anticipo quanti scartarne.
+    """
+    heap = list(zip((-scores).tolist(), range(len(scores))))
+    heapq.heapify(heap)
+    picked: List[int] = []
+    seen = set()
+    while heap and len(picked) < k:
+        _, row = heapq.heappop(heap)
+        if key is not None:
+            dedup = key(row)
+            if dedup in seen:
+                continue
+            seen.add(dedup)
+        picked.append(row)
+    return picked
+
+
+def rank(agg: Aggregate, k: int, weighting: str | Callable[..., np.ndarray] = "bayesian",
+         key: Callable[[Candidate], Any] | None = None, **params) -> List[Tuple[Candidate, float]]:
+    """Top-k come (candidato, score); key riceve il Candidate."""
+    if not len(agg):
+        return []
+    scores = score(agg, weighting, **params)
+    rows = top_k(scores, k, (lambda row: key(agg.candidates[row])) if key else None)
+    return [(agg.candidates[row], float(scores[row])) for row in rows]
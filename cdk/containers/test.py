@@ -1,9 +1,10 @@
 import os, time
-from collections import defaultdict
 from spotipy import Spotify
 from spotipy.oauth2 import SpotifyClientCredentials
 from spotipy.exceptions import SpotifyException
 
+import scoring
+
 YEAR = 2025
 LIMIT = 10
 GLOBAL_MARKETS = ["US","GB","DE","FR","IT","ES","NL","SE","BR","MX","JP","AU","CA"]
@@ -32,43 +33,35 @@ def search_tracks_year_market(year, market, want=60, sleep=0.25):
             break
     return got
 
-def top_albums_by_year(markets, year, per_market_fetch=50, limit=10):
-    album_scores = defaultdict(lambda: {"sum":0, "n":0, "album":None})
-    for m in markets:
-        try:
-            items = search_tracks_year_market(year, m, want=per_market_fetch)
+def top_albums_by_year(markets, year, per_market_fetch=50, limit=10, weighting="mean"):
+    """Classifica dalle tracce: ogni traccia è un'osservazione (mercato, suo album, sua popularity)."""
+    def observations():
+        for m in markets:
+            try:
+                items = search_tracks_year_market(year, m, want=per_market_fetch)
+            except SpotifyException as e:
+                print(f"⚠️ market {m}: {e}")
+                continue
             for tr in items:
-                pop = tr.get("popularity") or 0
                 alb = tr.get("album") or {}
                 # filtra riedizioni o compilation: tieni solo release_date nell'anno
                 if (alb.get("release_date") or "")[:4] != str(year):
                     continue
-                aid = alb.get("id")
-                if not aid: 
+                if not alb.get("id"):
                     continue
-                album_scores[aid]["sum"] += pop
-                album_scores[aid]["n"] += 1
-                album_scores[aid]["album"] = alb
-        except SpotifyException as e:
-            print(f"⚠️ market {m}: {e}")
+                yield m, scoring.Candidate.from_album(alb), tr.get("popularity") or 0
 
     ranked = []
-    for aid, agg in album_scores.items():
-        if not agg["album"]: 
-            continue
-        mean = agg["sum"] / max(1, agg["n"])
-        alb = agg["album"]
-        artist = (alb.get("artists") or [{}])[0].get("name", "Sconosciuto")
+    for c, score in scoring.rank(scoring.aggregate(observations()), limit, weighting):
         ranked.append({
-            "album_id": aid,
-            "title": alb.get("name"),
-            "artist": artist,
+            "album_id": c.id,
+            "title": c.title,
+            "artist": c.artist,
             "year": str(year),
-            "score": round(mean, 1),
-            "cover": (alb.get("images") or [{}])[0].get("url", "")
+            "score": round(score, 1),
+            "cover": c.cover
         })
-    ranked.sort(key=lambda x: x["score"], reverse=True)
-    return ranked[:limit]
+    return ranked
 
 if __name__ == "__main__":
     it = top_albums_by_year(["IT"], YEAR, per_market_fetch=50, limit=LIMIT)
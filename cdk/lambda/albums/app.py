@@ -1,13 +1,70 @@
 import os
 import json
+import time
+import base64
+import hashlib
+import gzip
+import heapq
+import re
+import sys
+import unicodedata
 import boto3
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
 from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
 import urllib.parse
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
 dynamodb = boto3.resource("dynamodb")
 albums_table = dynamodb.Table(os.environ["ALBUMS_TABLE"])
 
+# GSI per le liste filtrate, passati dallo stack solo dal deploy dopo quello che
+# li crea (uno per deploy, vedi albums_index_stage in cdk_stack.py); senza, scan filtrata
+YEAR_INDEX = os.getenv("ALBUMS_YEAR_INDEX")
+ARTIST_INDEX = os.getenv("ALBUMS_ARTIST_INDEX")
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+BATCH_GET_SIZE = 100     # limite BatchGetItem
+MAX_BATCH_IDS = 500      # GET /albums?ids=...
+
+# Cache in-process (vive tra invocazioni "warm" dello stesso container).
+# ⚠️ La cache tiene l'album intero, contatori compresi: average_rating e ratings_count
+# di /albums/{id}, /by-title e /by-slug possono restare indietro fino a ALBUM_CACHE_TTL
+# secondi (la Lambda ratings non può invalidare le cache degli altri container).
+# Sulle risposte dalla cache l'header Age dice da quanti secondi: i valori aggiornati
+# sono quelli di GET /ratings/{album_id}, che il frontend usa già per la pagina album.
+CACHE_MAX_ENTRIES = int(os.getenv("ALBUM_CACHE_MAX_ENTRIES", "2000"))
+CACHE_MAX_BYTES = int(os.getenv("ALBUM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("ALBUM_CACHE_TTL", "300"))             # secondi
+CACHE_NEGATIVE_TTL = float(os.getenv("ALBUM_CACHE_NEGATIVE_TTL", "60"))
+
+# Cache-Control per browser / edge: i metadati cambiano di rado, si rivalida con ETag
+CACHE_CONTROL = "public, max-age=300"
+CACHE_CONTROL_NOT_FOUND = "public, max-age=60"
+
+# Indice di ricerca prebuilt (job lambda/search_index → S3), caricato una volta per container
+SEARCH_BUCKET = os.getenv("SEARCH_BUCKET")
+SEARCH_INDEX_KEY = os.getenv("SEARCH_INDEX_KEY", "search/albums-index.json.gz")
+SEARCH_REFRESH_SECONDS = float(os.getenv("SEARCH_REFRESH_SECONDS", "600"))  # ogni quanto ricontrollare l'ETag
+DEFAULT_SEARCH_K = 10
+MAX_SEARCH_K = 50
+MAX_PREFIX_EXPANSIONS = 50     # parole del vocabolario per token prefisso
+FUZZY_MIN_DICE = 0.5           # similarità minima (trigrammi) per i refusi
+FIELD_WEIGHTS = (3.0, 2.0, 1.0)   # titolo, artista, canzone
+FIELD_SHIFT = 30                  # voce posting = campo << 30 | doc_id (come in search_index)
+DOC_MASK = (1 << FIELD_SHIFT) - 1
+MAX_TOKEN_POSTINGS = 5000         # voci scorse al massimo per token
+MAX_PROBE_LOOKUPS = 1500          # bisect (candidati x parole x campi); oltre conviene scorrere
+
+# Campi per le viste a lista (niente songs & co.); average_rating è derivata dai contatori
+LIST_FIELDS = ["album_id", "title", "artist", "cover", "year",
+               "average_rating", "ratings_sum", "ratings_count"]
+
 
 def decimal_default(obj):
     if isinstance(obj, Decimal):
@@ -15,6 +72,469 @@ def decimal_default(obj):
     raise TypeError
 
 
+def canonical_json(obj):
+    """Body con l'ETag: chiavi ordinate e separatori compatti, l'hash non dipende dall'ordine degli attributi."""
+    return json.dumps(obj, default=decimal_default, sort_keys=True, separators=(",", ":"))
+
+
+def with_average(item):
+    """average_rating calcolata in lettura dai contatori ratings_sum / ratings_count."""
+    if "ratings_sum" in item:
+        count = int(item.get("ratings_count", 0) or 0)
+        item["average_rating"] = float(item["ratings_sum"]) / count if count > 0 else 0
+    return item
+
+
+class LRUCache:
+    """
+    Cache LRU con TTL, limitata per numero di voci e per byte.
+    Salva le risposte già serializzate (status, body): niente json.dumps sugli hit.
+    """
+
+    def __init__(self, max_entries, max_bytes, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.data = OrderedDict()   # key -> (expires_at, status, body, headers, size, stored_at)
+        self.bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry[0] <= self.clock():
+            self._drop(key)
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+        self.data.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1], entry[2], entry[3]
+
+    def put(self, key, status, body, ttl, headers=None):
+        size = len(body.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self.data:
+            self._drop(key)
+        now = self.clock()
+        self.data[key] = (now + ttl, status, body, headers or {}, size, now)
+        self.bytes += size
+        while len(self.data) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self.data)))
+            self.stats["evictions"] += 1
+
+    def age(self, key):
+        """Secondi da quando la voce è entrata in cache (per l'header Age)."""
+        return max(0, int(self.clock() - self.data[key][5]))
+
+    def _drop(self, key):
+        self.bytes -= self.data.pop(key)[4]
+
+    def log_stats(self):
+        print(json.dumps({"album_cache": dict(self.stats, entries=len(self.data), bytes=self.bytes)}))
+
+
+cache = LRUCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+def cached(key, loader):
+    """
+    Read-through: su miss chiama loader() → (status, body, headers); cacha 200 e 404
+    (negative caching). Un hit porta l'header Age: browser ed edge lo scalano dal
+    max-age, così la risposta non resta vecchia più di CACHE_CONTROL in totale.
+    """
+    hit = cache.get(key)
+    if hit is not None:
+        status, body, headers = hit
+        return status, body, dict(headers, Age=str(cache.age(key)))
+    status, body, headers = loader()
+    if status == 200:
+        cache.put(key, status, body, CACHE_TTL, headers)
+    elif status == 404:
+        cache.put(key, status, body, CACHE_NEGATIVE_TTL, headers)
+    return status, body, headers
+
+
+def http_date(iso_ts):
+    """"2025-01-31T03:12:00Z" → data HTTP (Last-Modified)."""
+    dt = datetime.strptime(iso_ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return format_datetime(dt, usegmt=True)
+
+
+def validators(body, items):
+    """ETag (hash stabile del body) + Last-Modified dal più recente updated_at degli item."""
+    headers = {"ETag": '"%s"' % hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}
+    stamps = [i["updated_at"] for i in items if i.get("updated_at")]
+    if stamps:
+        try:
+            headers["Last-Modified"] = http_date(max(stamps))
+        except ValueError:
+            pass
+    return headers
+
+
+def not_modified(event, headers):
+    """If-None-Match ha la precedenza su If-Modified-Since (RFC 9110)."""
+    req = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    if_none_match = req.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or headers.get("ETag") in tags
+    if_modified_since = req.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(headers["Last-Modified"])
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(event, status, body, validator_headers):
+    headers = cors_headers()
+    headers["Cache-Control"] = CACHE_CONTROL if status == 200 else CACHE_CONTROL_NOT_FOUND
+    headers.update(validator_headers)
+    if status == 200 and not_modified(event, validator_headers):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": status, "headers": headers, "body": body}
+
+
+NOT_FOUND = json.dumps({"error": "Album non trovato"})
+
+
+def load_by_title(title_norm):
+    resp = albums_table.query(
+        IndexName="TitleLowerIndex",
+        KeyConditionExpression=Key("title_lower").eq(title_norm)
+    )
+    items = [with_average(i) for i in resp.get("Items", [])]
+    if not items:
+        return 404, NOT_FOUND, {}
+    body = canonical_json(items)
+    return 200, body, validators(body, items)
+
+
+def load_by_slug(slug_norm):
+    resp = albums_table.query(
+        IndexName="TitleSlugIndex",
+        KeyConditionExpression=Key("title_slug").eq(slug_norm)
+    )
+    items = [with_average(i) for i in resp.get("Items", [])]
+    if not items:
+        return 404, NOT_FOUND, {}
+    body = canonical_json(items[0])
+    return 200, body, validators(body, items[:1])
+
+
+def load_by_id(album_id):
+    item = albums_table.get_item(Key={"album_id": album_id}).get("Item")
+    if not item:
+        return 404, NOT_FOUND, {}
+    body = canonical_json(with_average(item))
+    return 200, body, validators(body, [item])
+
+
+def encode_cursor(last_key):
+    """LastEvaluatedKey → token opaco per il client."""
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, default=decimal_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")),
+                         parse_int=Decimal, parse_float=Decimal)
+    except (ValueError, UnicodeError):
+        raise ValueError("Cursor non valido")
+    if not isinstance(key, dict):
+        raise ValueError("Cursor non valido")
+    return key
+
+
+def list_albums(params):
+    """
+    Una pagina della lista album, proiettata sui LIST_FIELDS.
+    Filtri ?year= e ?artist= serviti da YearIndex / ArtistIndex (query, non scan).
+    Finché l'indice non è passato dallo stack, o se DynamoDB lo rifiuta (ancora in
+    creazione), il filtro ripiega su una scan filtrata.
+    """
+    try:
+        limit = max(1, min(int(params.get("limit") or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit non valido")
+
+    kwargs = {
+        "Limit": limit,
+        # year è parola riservata: proiezione sempre via alias
+        "ProjectionExpression": ", ".join(f"#{f}" for f in LIST_FIELDS),
+        "ExpressionAttributeNames": {f"#{f}": f for f in LIST_FIELDS},
+    }
+    if params.get("cursor"):
+        kwargs["ExclusiveStartKey"] = decode_cursor(params["cursor"])
+
+    year = (params.get("year") or "").strip()
+    artist = urllib.parse.unquote(params.get("artist") or "").strip().lower()
+    if year and not year.isdigit():
+        raise ValueError("Anno non valido")
+
+    resp = None
+    if artist and ARTIST_INDEX:
+        cond = Key("artist_lower").eq(artist)
+        if year:
+            cond = cond & Key("year").eq(int(year))
+        resp = query_index(ARTIST_INDEX, cond, kwargs)
+    elif year and not artist and YEAR_INDEX:
+        resp = query_index(YEAR_INDEX, Key("year").eq(int(year)), kwargs)
+    if resp is None and (artist or year):
+        cond = None
+        if artist:
+            cond = Attr("artist_lower").eq(artist)
+        if year:
+            cond = Attr("year").eq(int(year)) if cond is None else cond & Attr("year").eq(int(year))
+        resp = albums_table.scan(FilterExpression=cond, **kwargs)
+    elif resp is None:
+        # Nessun filtro: scan paginata e proiettata, una pagina per richiesta
+        resp = albums_table.scan(**kwargs)
+
+    items = []
+    for it in resp.get("Items", []):
+        with_average(it)
+        it.pop("ratings_sum", None)
+        items.append(it)
+    return {"items": items, "next_cursor": encode_cursor(resp.get("LastEvaluatedKey"))}
+
+
+def query_index(index_name, cond, kwargs):
+    """Query sul GSI; None se DynamoDB non lo accetta (indice ancora CREATING / in backfill)."""
+    try:
+        return albums_table.query(IndexName=index_name, KeyConditionExpression=cond, **kwargs)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ValidationException":
+            raise
+        print(f"{index_name} non utilizzabile, scan filtrata:", str(e))
+        return None
+
+
+def batch_get_albums(ids, fields=None):
+    """
+    GET /albums?ids=a,b,c: BatchGetItem a blocchi di 100 con retry (backoff) sulle
+    UnprocessedKeys. Ritorna gli item nell'ordine richiesto + gli id mancanti.
+    """
+    ids = list(dict.fromkeys(ids))
+    request_opts = {}
+    if fields:
+        names = ["album_id"] + fields
+        if "average_rating" in fields:
+            names += ["ratings_sum", "ratings_count"]   # la media è derivata dai contatori
+        names = list(dict.fromkeys(names))
+        request_opts = {
+            "ProjectionExpression": ", ".join(f"#{i}" for i in range(len(names))),
+            "ExpressionAttributeNames": {f"#{i}": n for i, n in enumerate(names)},
+        }
+
+    found = {}
+    table_name = albums_table.name
+    for start in range(0, len(ids), BATCH_GET_SIZE):
+        chunk = ids[start:start + BATCH_GET_SIZE]
+        request = {table_name: dict(request_opts, Keys=[{"album_id": i} for i in chunk])}
+        backoff = 0.05
+        for attempt in range(8):
+            resp = dynamodb.batch_get_item(RequestItems=request)
+            for it in resp.get("Responses", {}).get(table_name, []):
+                found[it["album_id"]] = with_average(it)
+            request = resp.get("UnprocessedKeys") or None
+            if not request:
+                break
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 1.0)
+        else:
+            raise RuntimeError("BatchGetItem: UnprocessedKeys dopo troppi tentativi")
+
+    if fields:
+        for it in found.values():
+            for extra in set(it) - set(fields) - {"album_id"}:
+                it.pop(extra)
+    return {
+        "items": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],
+    }
+
+
+# ⚠️ normalize / trigrams devono restare identiche a quelle in lambda/search_index/app.py
+def normalize(text):
+    """minuscolo, senza accenti, solo lettere/numeri → lista di parole"""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"\w+", text)
+
+
+def trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _u32(b64):
+    arr = array("I")
+    arr.frombytes(base64.b64decode(b64))
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+class SearchIndex:
+    """
+    Indice invertito in memoria: vocabolario ordinato (prefissi con bisect),
+    posting list campo << FIELD_SHIFT | doc_id (ordinate per campo, poi doc_id)
+    e trigrammi del vocabolario per i refusi.
+    """
+
+    def __init__(self, data, etag=None):
+        self.version = data.get("version")
+        self.etag = etag
+        self.docs = data["docs"]
+        self.vocab = data["vocab"]
+        self.post_off = _u32(data["post_off"])
+        self.post = _u32(data["post"])
+        self.grams = {g: i for i, g in enumerate(data["grams"])}
+        self.gram_off = _u32(data["gram_off"])
+        self.gram_post = _u32(data["gram_post"])
+
+    @classmethod
+    def from_bytes(cls, blob, etag=None):
+        return cls(json.loads(gzip.decompress(blob)), etag)
+
+    def expand(self, token):
+        """token della query → {word_id: peso}: esatto 1.0, prefisso 0.8, fuzzy 0.6 * dice"""
+        matches = {}
+        vocab = self.vocab
+        i = bisect_left(vocab, token)
+        for j in range(i, min(i + MAX_PREFIX_EXPANSIONS, len(vocab))):
+            if not vocab[j].startswith(token):
+                break
+            matches[j] = 1.0 if vocab[j] == token else 0.8
+        if len(token) >= 3 and 1.0 not in matches.values():   # niente fuzzy se c'è il match esatto
+            grams = trigrams(token)
+            shared = defaultdict(int)
+            for g in grams:
+                gi = self.grams.get(g)
+                if gi is None:
+                    continue
+                for word_id in self.gram_post[self.gram_off[gi]:self.gram_off[gi + 1]]:
+                    shared[word_id] += 1
+            for word_id, n in shared.items():
+                dice = 2.0 * n / (len(grams) + len(vocab[word_id]))
+                if dice >= FUZZY_MIN_DICE:
+                    matches[word_id] = max(matches.get(word_id, 0.0), 0.6 * dice)
+        return matches
+
+    def _span(self, word_id):
+        return self.post_off[word_id], self.post_off[word_id + 1]
+
+    def _scan(self, matches):
+        """
+        Scorre le posting list (prima i titoli, poi artisti e canzoni) fino a
+        MAX_TOKEN_POSTINGS voci: per le parole comunissime basta la parte che pesa di più.
+        Per ogni album tiene solo il match migliore (30 canzoni non battono un titolo).
+        """
+        best, budget = {}, MAX_TOKEN_POSTINGS
+        for field, field_weight in enumerate(FIELD_WEIGHTS):
+            lo_key, hi_key = field << FIELD_SHIFT, (field + 1) << FIELD_SHIFT
+            for word_id, weight in matches:
+                lo, hi = self._span(word_id)
+                start = bisect_left(self.post, lo_key, lo, hi)
+                end = bisect_left(self.post, hi_key, start, hi)
+                score = weight * field_weight
+                for entry in self.post[start:min(end, start + budget)]:
+                    doc_id = entry & DOC_MASK
+                    if score > best.get(doc_id, 0.0):
+                        best[doc_id] = score
+                budget -= end - start
+                if budget <= 0:
+                    return best
+        return best
+
+    def _probe(self, matches, candidates):
+        """Token troppo comune da scorrere: verifica solo gli album già candidati (bisect)."""
+        best = {}
+        post = self.post
+        spans = [(self._span(word_id), weight) for word_id, weight in matches]
+        for doc_id in candidates:
+            for field, field_weight in enumerate(FIELD_WEIGHTS):
+                hit = 0.0
+                key = field << FIELD_SHIFT | doc_id
+                for (lo, hi), weight in spans:
+                    i = bisect_left(post, key, lo, hi)
+                    if i < hi and post[i] == key:
+                        hit = weight
+                        break
+                if hit:
+                    best[doc_id] = hit * field_weight
+                    break
+        return best
+
+    def search(self, query, k=DEFAULT_SEARCH_K):
+        tokens = []
+        for token in dict.fromkeys(normalize(query)):
+            matches = sorted(self.expand(token).items(), key=lambda kv: -kv[1])
+            cost = sum(self.post_off[w + 1] - self.post_off[w] for w, _ in matches)
+            tokens.append((cost, matches))
+        tokens.sort(key=lambda t: t[0])   # prima i token rari: restringono i candidati
+
+        scores = defaultdict(float)
+        for cost, matches in tokens:
+            lookups = len(scores) * len(matches) * len(FIELD_WEIGHTS)
+            if cost > MAX_TOKEN_POSTINGS and 0 < lookups <= MAX_PROBE_LOOKUPS:
+                best = self._probe(matches, list(scores))
+            else:
+                best = self._scan(matches)
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+
+        top = heapq.nlargest(k, scores.items(), key=lambda kv: (kv[1], -kv[0]))
+        results = []
+        for doc_id, score in top:
+            album_id, title, artist, cover, year, slug = self.docs[doc_id]
+            results.append({"album_id": album_id, "title": title, "artist": artist, "cover": cover,
+                            "year": year, "title_slug": slug, "score": round(score, 3)})
+        return results
+
+
+_search = {"index": None, "checked_at": 0.0}
+s3 = boto3.client("s3")
+
+
+def search_index():
+    """Carica l'artefatto alla prima richiesta; poi ogni SEARCH_REFRESH_SECONDS controlla l'ETag su S3."""
+    now = time.monotonic()
+    current = _search["index"]
+    if current is not None and now - _search["checked_at"] < SEARCH_REFRESH_SECONDS:
+        return current
+    if not SEARCH_BUCKET:
+        raise RuntimeError("SEARCH_BUCKET non configurato")
+    try:
+        if current is not None:
+            etag = s3.head_object(Bucket=SEARCH_BUCKET, Key=SEARCH_INDEX_KEY)["ETag"]
+            if etag == current.etag:
+                _search["checked_at"] = now
+                return current
+        obj = s3.get_object(Bucket=SEARCH_BUCKET, Key=SEARCH_INDEX_KEY)
+        _search["index"] = SearchIndex.from_bytes(obj["Body"].read(), obj.get("ETag"))
+        _search["checked_at"] = now
+        print(f"🔎 Indice di ricerca caricato: versione {_search['index'].version}, "
+              f"{len(_search['index'].docs)} album")
+    except Exception as e:
+        if current is None:
+            raise
+        # meglio un indice vecchio che nessun indice
+        print("Refresh indice di ricerca fallito:", str(e))
+        _search["checked_at"] = now
+    return _search["index"]
+
+
 def cors_headers():
     return {
         "Access-Control-Allow-Origin": "*",
@@ -38,16 +558,9 @@ def handler(event, context):
             decoded = urllib.parse.unquote(raw)
             title_norm = decoded.lower()
 
-            resp = albums_table.query(
-                IndexName="TitleLowerIndex",
-                KeyConditionExpression=Key("title_lower").eq(title_norm)
-            )
-            items = resp.get("Items", [])
-            if not items:
-                return {"statusCode": 404, "headers": cors_headers(),
-                        "body": json.dumps({"error": "Album non trovato"})}
-            return {"statusCode": 200, "headers": cors_headers(),
-                    "body": json.dumps(items, default=decimal_default)}
+            status, body, validator_headers = cached(("title", title_norm), lambda: load_by_title(title_norm))
+            cache.log_stats()
+            return conditional_response(event, status, body, validator_headers)
 
         # ✅ GET /albums/by-slug/{slug}
         if path == "/albums/by-slug/{slug}":
@@ -59,16 +572,32 @@ def handler(event, context):
             decoded = urllib.parse.unquote(raw)
             slug_norm = decoded.lower()
 
-            resp = albums_table.query(
-                IndexName="TitleSlugIndex",
-                KeyConditionExpression=Key("title_slug").eq(slug_norm)
-            )
-            items = resp.get("Items", [])
-            if not items:
-                return {"statusCode": 404, "headers": cors_headers(),
-                        "body": json.dumps({"error": "Album non trovato"})}
-            return {"statusCode": 200, "headers": cors_headers(),
-                    "body": json.dumps(items[0], default=decimal_default)}
+            status, body, validator_headers = cached(("slug", slug_norm), lambda: load_by_slug(slug_norm))
+            cache.log_stats()
+            return conditional_response(event, status, body, validator_headers)
+
+        # ✅ GET /albums/search?q=...&k=10 (prefissi + refusi, top-k dall'indice prebuilt)
+        if path == "/albums/search":
+            params = event.get("queryStringParameters") or {}
+            query = urllib.parse.unquote(params.get("q") or "").strip()
+            try:
+                k = max(1, min(int(params.get("k") or DEFAULT_SEARCH_K), MAX_SEARCH_K))
+            except ValueError:
+                k = None
+            if not query or k is None:
+                return {"statusCode": 400, "headers": cors_headers(),
+                        "body": json.dumps({"error": "Parametri q / k non validi"})}
+            try:
+                index = search_index()
+            except Exception as e:
+                print("Indice di ricerca non disponibile:", str(e))
+                return {"statusCode": 503, "headers": cors_headers(),
+                        "body": json.dumps({"error": "Ricerca non disponibile"})}
+            headers = cors_headers()
+            headers["Cache-Control"] = "public, max-age=60"
+            return {"statusCode": 200, "headers": headers,
+                    "body": json.dumps({"query": query, "version": index.version,
+                                        "items": index.search(query, k)})}
 
         # ✅ GET /albums/{id}
         if path == "/albums/{id}":
@@ -76,20 +605,29 @@ def handler(event, context):
             if not album_id:
                 return {"statusCode": 400, "headers": cors_headers(),
                         "body": json.dumps({"error": "Album ID mancante"})}
-            response = albums_table.get_item(Key={"album_id": album_id})
-            item = response.get("Item")
-            if not item:
-                return {"statusCode": 404, "headers": cors_headers(),
-                        "body": json.dumps({"error": "Album non trovato"})}
-            return {"statusCode": 200, "headers": cors_headers(),
-                    "body": json.dumps(item, default=decimal_default)}
+            status, body, validator_headers = cached(("id", album_id), lambda: load_by_id(album_id))
+            cache.log_stats()
+            return conditional_response(event, status, body, validator_headers)
 
-        # ✅ GET /albums (listing base)
+        # ✅ GET /albums?ids=a,b,c[&fields=title,cover] (bulk) oppure
+        #    GET /albums?limit=&cursor=&year=&artist= (lista paginata)
         if path == "/albums":
-            response = albums_table.scan()
-            items = response.get("Items", [])
+            params = event.get("queryStringParameters") or {}
+            if params.get("ids"):
+                ids = [i.strip() for i in params["ids"].split(",") if i.strip()]
+                fields = [f.strip() for f in (params.get("fields") or "").split(",") if f.strip()]
+                if len(ids) > MAX_BATCH_IDS:
+                    return {"statusCode": 400, "headers": cors_headers(),
+                            "body": json.dumps({"error": f"Troppi id (max {MAX_BATCH_IDS})"})}
+                return {"statusCode": 200, "headers": cors_headers(),
+                        "body": json.dumps(batch_get_albums(ids, fields), default=decimal_default)}
+            try:
+                page = list_albums(params)
+            except ValueError as e:
+                return {"statusCode": 400, "headers": cors_headers(),
+                        "body": json.dumps({"error": str(e)})}
             return {"statusCode": 200, "headers": cors_headers(),
-                    "body": json.dumps(items, default=decimal_default)}
+                    "body": json.dumps(page, default=decimal_default)}
 
         return {"statusCode": 404, "headers": cors_headers(),
                 "body": json.dumps({"error": "Endpoint non trovato"})}
@@ -0,0 +1,136 @@
+"""
+Backfill di RatingsTable per il GSI UserIndex (user_id / timestamp numerico):
+
+- timestamp stringa ISO (recensioni di seed_data & co.) → millisecondi epoch;
+- timestamp stringa numerica → numero;
+- timestamp mancante → ora del backfill, con timestamp_backfilled = true.
+
+Un item con timestamp non numerico non entra nel GSI (e con il GSI attivo non si
+può più nemmeno riscrivere così): dopo il backfill ogni recensione compare in
+GET /users/{user_id}/ratings. La scan filtra lato DynamoDB le sole recensioni da
+sistemare; ogni update è condizionato al timestamp letto, quindi una recensione
+riscritta nel frattempo dalla Lambda ratings non viene toccata.
+
+Ripartibile come migrate_charts: dopo ogni pagina il LastEvaluatedKey va in un
+item di checkpoint nella tabella stessa; si rilancia finché la risposta non ha
+"done": true ({"restart": true} riparte da capo).
+"""
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import boto3
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ["RATINGS_TABLE"])
+
+CHECKPOINT_KEY = {"album_id": "MIGRATION#ratings-user-index", "user_id": "-"}
+PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "500"))
+TIME_MARGIN_MS = 30_000   # si ferma (salvando il checkpoint) prima del timeout Lambda
+
+
+def load_checkpoint():
+    return table.get_item(Key=CHECKPOINT_KEY, ConsistentRead=True).get("Item") or {}
+
+
+def save_checkpoint(last_key, stats, done=False):
+    item = dict(CHECKPOINT_KEY, done=done, stats=stats,
+                updated_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    if last_key:
+        item["last_key"] = json.dumps(last_key)
+    table.put_item(Item=item)
+
+
+def numeric_timestamp(value, now_ms):
+    """timestamp legacy → (millisecondi epoch, stimato?)"""
+    if value is None:
+        return now_ms, True
+    text = str(value).strip()
+    if text.isdigit():
+        return int(text), False
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return now_ms, True
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)   # seed_data scriveva utcnow() senza fuso
+    return int(dt.timestamp() * 1000), False
+
+
+def fix_review(item, stats, now_ms):
+    old = item.get("timestamp")
+    ts, estimated = numeric_timestamp(old, now_ms)
+    sets = "SET #ts = :ts" + (", timestamp_backfilled = :true" if estimated else "")
+    values = {":ts": ts}
+    if estimated:
+        values[":true"] = True
+    if old is None:
+        condition = "attribute_exists(user_id) AND attribute_not_exists(#ts)"
+    else:
+        condition = "#ts = :old"
+        values[":old"] = old
+    try:
+        table.update_item(
+            Key={"album_id": item["album_id"], "user_id": item["user_id"]},
+            UpdateExpression=sets,
+            ConditionExpression=condition,
+            ExpressionAttributeNames={"#ts": "timestamp"},
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+            raise
+        stats["changed_meanwhile"] += 1
+        return
+    stats["estimated" if estimated else "converted"] += 1
+
+
+def run(max_pages=None, remaining_ms=lambda: float("inf")):
+    checkpoint = load_checkpoint()
+    stats = defaultdict(int, {k: int(v) for k, v in (checkpoint.get("stats") or {}).items()})
+    if checkpoint.get("done"):
+        return {"done": True, "stats": dict(stats)}
+
+    scan_kwargs = {
+        "Limit": PAGE_SIZE,
+        # solo recensioni senza timestamp numerico (il checkpoint stesso escluso)
+        "FilterExpression": "(attribute_not_exists(#ts) OR NOT attribute_type(#ts, :n)) "
+                            "AND album_id <> :checkpoint",
+        "ProjectionExpression": "album_id, user_id, #ts",
+        "ExpressionAttributeNames": {"#ts": "timestamp"},
+        "ExpressionAttributeValues": {":n": "N", ":checkpoint": CHECKPOINT_KEY["album_id"]},
+    }
+    if checkpoint.get("last_key"):
+        scan_kwargs["ExclusiveStartKey"] = json.loads(checkpoint["last_key"])
+        print(f"↪️ Riprendo da {checkpoint['last_key']}")
+
+    pages = 0
+    now_ms = int(time.time() * 1000)
+    while True:
+        resp = table.scan(**scan_kwargs)
+        for item in resp.get("Items", []):
+            fix_review(item, stats, now_ms)
+        stats["scanned"] += resp.get("ScannedCount", 0)
+        pages += 1
+        last_key = resp.get("LastEvaluatedKey")
+        if not last_key:
+            save_checkpoint(None, dict(stats), done=True)
+            print(f"🎉 Backfill completato: {dict(stats)}")
+            return {"done": True, "stats": dict(stats)}
+        save_checkpoint(last_key, dict(stats))
+        scan_kwargs["ExclusiveStartKey"] = last_key
+        if (max_pages and pages >= max_pages) or remaining_ms() < TIME_MARGIN_MS:
+            print(f"⏸️ Interrotto dopo {pages} pagine, rilanciare per continuare: {dict(stats)}")
+            return {"done": False, "stats": dict(stats)}
+
+
+def handler(event, context):
+    event = event or {}
+    if event.get("restart"):
+        table.delete_item(Key=CHECKPOINT_KEY)
+    remaining = context.get_remaining_time_in_millis if context else (lambda: float("inf"))
+    result = run(max_pages=event.get("max_pages"), remaining_ms=remaining)
+    return {"statusCode": 200, "body": json.dumps(result)}
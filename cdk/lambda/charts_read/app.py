@@ -1,17 +1,200 @@
 # lambda/charts_read/app.py
 import os, json
+import gzip
+import hashlib
+import threading
+import time
 import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from decimal import Decimal
-from boto3.dynamodb.conditions import Key, Attr
+from email.utils import format_datetime, parsedate_to_datetime
+from boto3.dynamodb.conditions import Key
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(os.environ["CHARTS_TABLE"])
 
+# Le classifiche cambiano al massimo una volta al giorno (scraper delle 03:00 UTC):
+# il browser tiene 10 minuti, le edge cache un'ora, poi si rivalida con ETag/Last-Modified.
+CACHE_CONTROL = "public, max-age=600, s-maxage=3600, stale-while-revalidate=86400"
+
+# Schema a chiavi esatte (vedi lambda/migrate_charts):
+#   "1999"         → classifica globale (rank 1..N) + manifest dell'anno a rank 0
+#   "1999#EUROPE"  → classifica di regione
+MANIFEST_RANK = 0
+# GET /charts?from=&to=&top=: una query per anno, in parallelo
+DEFAULT_TOP = 10
+MAX_TOP = 50
+MAX_RANGE_YEARS = 100
+RANGE_WORKERS = int(os.getenv("CHARTS_RANGE_WORKERS", "16"))
+
+# Snapshot pre-serializzate dallo scraper (containers/app.py): /charts/{year} senza DynamoDB
+SNAPSHOT_BUCKET = os.getenv("SNAPSHOT_BUCKET")
+SNAPSHOT_MANIFEST_KEY = os.getenv("SNAPSHOT_MANIFEST_KEY", "charts/manifest.json")
+SNAPSHOT_MANIFEST_TTL = float(os.getenv("SNAPSHOT_MANIFEST_TTL", "60"))  # secondi tra due controlli
+
+# Se un anno ha solo classifiche regionali, /charts/{year} serve la prima disponibile
+REGION_PREFERENCE = ["GLOBAL", "EUROPE", "US", "IT"]
+
 def _dec(o):
     if isinstance(o, Decimal):
-        return float(o)
+        return int(o) if o == o.to_integral_value() else float(o)   # rank 1, non 1.0: come lo scraper
     raise TypeError
 
+def _dumps(obj):
+    """JSON canonico (chiavi ordinate, separatori compatti): stesso contenuto → stesso body e stesso ETag."""
+    return json.dumps(obj, default=_dec, sort_keys=True, separators=(",", ":"))
+
+def _http_date(iso_ts):
+    dt = datetime.strptime(iso_ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return format_datetime(dt, usegmt=True)
+
+def _validators(body, items):
+    """ETag = hash stabile del body; Last-Modified = fetched_at più recente della classifica."""
+    headers = {"ETag": '"%s"' % hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}
+    stamps = [it["fetched_at"] for it in items if it.get("fetched_at")]
+    if stamps:
+        try:
+            headers["Last-Modified"] = _http_date(max(stamps))
+        except ValueError:
+            pass
+    return headers
+
+def _not_modified(event, headers):
+    """If-None-Match ha la precedenza su If-Modified-Since (RFC 9110)."""
+    req = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    if_none_match = req.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or headers.get("ETag") in tags
+    if_modified_since = req.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(headers["Last-Modified"])
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _query_chart(chart_key, limit=None, tbl=None):
+    kwargs = {"Limit": limit} if limit else {}
+    resp = (tbl or table).query(
+        KeyConditionExpression=Key("chart_key").eq(chart_key),
+        ScanIndexForward=True,  # rank crescente (manifest per primo)
+        **kwargs
+    )
+    return resp.get("Items", [])
+
+def load_chart(year, region=None, top=None, tbl=None):
+    """
+    Una query per chiave esatta, mai scan. Anno/regione inesistenti → [] con UNA lettura.
+    Con top legge solo le prime N posizioni (Limit, +1 per il manifest a rank 0).
+    Ritorna le voci della classifica (senza manifest).
+    """
+    region = (region or "GLOBAL").strip().upper()
+    if region != "GLOBAL":
+        return _query_chart(f"{year}#{region}", top, tbl)
+
+    items = _query_chart(year, top + 1 if top else None, tbl)
+    entries = [it for it in items if int(it.get("rank", 0)) != MANIFEST_RANK][:top]
+    if entries or not items:
+        return entries
+
+    # Solo manifest: anno con sole classifiche regionali (dati legacy migrati)
+    regions = set(items[0].get("regions") or ())
+    for candidate in REGION_PREFERENCE + sorted(regions):
+        if candidate in regions and candidate != "GLOBAL":
+            return _query_chart(f"{year}#{candidate}", top, tbl)
+    return []
+
+# I resource boto3 non sono thread-safe: una Table per thread del pool (riusata tra invocazioni warm)
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=RANGE_WORKERS)
+
+def _thread_table():
+    if not hasattr(_local, "table"):
+        _local.table = boto3.session.Session().resource("dynamodb").Table(os.environ["CHARTS_TABLE"])
+    return _local.table
+
+def _clean(items):
+    """Ordina per rank e toglie i campi interni; ritorna i fetched_at (per Last-Modified)."""
+    items.sort(key=lambda x: x.get("rank", 10**9))
+    fetched = [{"fetched_at": it.pop("fetched_at", None)} for it in items]
+    for it in items:
+        it.pop("region", None)
+    return fetched
+
+def load_range(year_from, year_to, top, region=None):
+    """
+    Fan-out delle query per anno sul thread pool; la risposta si assembla
+    in ordine di anno man mano che i risultati arrivano.
+    Ritorna (body JSON, fetched_at di tutte le voci).
+    """
+    years = range(year_from, year_to + 1)
+    futures = [_executor.submit(lambda y: load_chart(str(y), region, top, _thread_table()), y) for y in years]
+
+    parts, missing, fetched = [], [], []
+    for year, future in zip(years, futures):
+        items = future.result()
+        if not items:
+            missing.append(year)
+            continue
+        fetched += _clean(items)
+        parts.append(_dumps({"year": year, "items": items}))
+    # "charts" è la prima chiave in ordine alfabetico: il body resta canonico
+    rest = _dumps({"from": year_from, "to": year_to, "top": top, "missing": missing})
+    return '{"charts":[' + ",".join(parts) + "]," + rest[1:], fetched
+
+s3 = boto3.client("s3")
+# manifest corrente + body già decompressi, per (chiave S3, ETag) della voce del manifest:
+# la versione non basta, shard partiti nello stesso secondo pubblicano la stessa
+_snapshots = {"manifest": None, "etag": None, "checked_at": None, "docs": {}}
+
+def _doc_id(entry):
+    return entry["key"], entry.get("etag")
+
+def _manifest():
+    """Manifest delle snapshot; riletto al più ogni SNAPSHOT_MANIFEST_TTL (GET condizionale)."""
+    now = time.monotonic()
+    checked_at = _snapshots["checked_at"]
+    if checked_at is not None and now - checked_at < SNAPSHOT_MANIFEST_TTL:
+        return _snapshots["manifest"]
+    _snapshots["checked_at"] = now
+    kwargs = {"IfNoneMatch": _snapshots["etag"]} if _snapshots["etag"] else {}
+    try:
+        obj = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=SNAPSHOT_MANIFEST_KEY, **kwargs)
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code")
+        if code not in ("304", "NotModified", "NoSuchKey", "404"):
+            print("Manifest snapshot non leggibile:", str(e))
+        return _snapshots["manifest"]
+    manifest = json.loads(obj["Body"].read())
+    # tiene solo i body ancora nel manifest: quelli sostituiti non servono più
+    current = {_doc_id(e) for e in (manifest.get("years") or {}).values()}
+    _snapshots["docs"] = {d: body for d, body in _snapshots["docs"].items() if d in current}
+    _snapshots.update(manifest=manifest, etag=obj.get("ETag"))
+    return manifest
+
+def load_snapshot(year):
+    """(body, validatori) della snapshot dell'anno; None se non c'è (→ query DynamoDB)."""
+    if not SNAPSHOT_BUCKET:
+        return None
+    manifest = _manifest()
+    entry = ((manifest or {}).get("years") or {}).get(year)
+    if not entry:
+        return None
+    body = _snapshots["docs"].get(_doc_id(entry))
+    if body is None:
+        blob = s3.get_object(Bucket=SNAPSHOT_BUCKET, Key=entry["key"])["Body"].read()
+        body = _snapshots["docs"][_doc_id(entry)] = gzip.decompress(blob).decode("utf-8")
+    headers = {"ETag": entry["etag"]}
+    if entry.get("fetched_at"):
+        try:
+            headers["Last-Modified"] = _http_date(entry["fetched_at"])
+        except ValueError:
+            pass
+    return body, headers
+
 def _cors():
     return {
         "Access-Control-Allow-Origin": "*",
@@ -19,13 +202,47 @@ def _cors():
         "Access-Control-Allow-Headers": "Content-Type,Authorization",
     }
 
+def _parse_range(qs):
+    """?from=1970&to=2025&top=10 → (from, to, top); ValueError se non validi."""
+    try:
+        year_from = int(qs.get("from") or "")
+        year_to = int(qs.get("to") or year_from)
+        top = int(qs.get("top") or DEFAULT_TOP)
+    except ValueError:
+        raise ValueError("Parametri from / to / top non validi")
+    if year_to < year_from or year_to - year_from + 1 > MAX_RANGE_YEARS:
+        raise ValueError(f"Intervallo non valido (max {MAX_RANGE_YEARS} anni)")
+    if not 1 <= top <= MAX_TOP:
+        raise ValueError(f"top deve essere tra 1 e {MAX_TOP}")
+    return year_from, year_to, top
+
+def _respond(event, body, fetched=None, validator_headers=None):
+    headers = _cors()
+    headers["Cache-Control"] = CACHE_CONTROL
+    validator_headers = validator_headers or _validators(body, fetched)
+    headers.update(validator_headers)
+    if _not_modified(event, validator_headers):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": headers, "body": body}
+
 def handler(event, context):
     try:
         path = event.get("resource") or ""
         params = event.get("pathParameters") or {}
 
-        # Supporta /charts/{year} e /charts/{region}/{year}
-        if path in ("/charts/{year}", "/charts/{region}/{year}"):
+        # GET /charts?from=1970&to=2025&top=10[&region=EUROPE]
+        if path == "/charts":
+            qs = event.get("queryStringParameters") or {}
+            try:
+                year_from, year_to, top = _parse_range(qs)
+            except ValueError as e:
+                return {"statusCode": 400, "headers": _cors(),
+                        "body": json.dumps({"error": str(e)})}
+            body, fetched = load_range(year_from, year_to, top, qs.get("region"))
+            return _respond(event, body, fetched)
+
+        # Supporta /charts/{year}, /charts/{year}/{region} e il vecchio /charts/{region}/{year}
+        if path in ("/charts/{year}", "/charts/{year}/{region}", "/charts/{region}/{year}"):
             year = str(params.get("year") or "").strip()
         else:
             return {"statusCode": 404, "headers": _cors(),
@@ -35,39 +252,21 @@ def handler(event, context):
             return {"statusCode": 400, "headers": _cors(),
                     "body": json.dumps({"error": "Anno non valido"})}
 
-        # 1) Nuovo schema: chart_key == "1971"
-        resp = table.query(
-            KeyConditionExpression=Key("chart_key").eq(year),
-            ScanIndexForward=True  # rank crescente
-        )
-        items = resp.get("Items", [])
+        if not params.get("region"):
+            snapshot = load_snapshot(year)
+            if snapshot:
+                body, validator_headers = snapshot
+                return _respond(event, body, validator_headers=validator_headers)
 
-        # 2) Fallback compat vecchio schema: chart_key == "1971#EUROPE" / "1971#US" ecc.
+        items = load_chart(year, params.get("region"))
         if not items:
-            scan_kwargs = {"FilterExpression": Attr("chart_key").begins_with(f"{year}#")}
-            items = []
-            lek = None
-            while True:
-                if lek:
-                    scan_kwargs["ExclusiveStartKey"] = lek
-                s = table.scan(**scan_kwargs)
-                items.extend(s.get("Items", []))
-                lek = s.get("LastEvaluatedKey")
-                if not lek:
-                    break
-
-            if not items:
-                return {"statusCode": 404, "headers": _cors(),
-                        "body": json.dumps({"error": f"No chart for year {year}"})}
-
-        # Ordina per rank e ripulisci campi legacy
-        items.sort(key=lambda x: x.get("rank", 10**9))
-        for it in items:
-            it.pop("region", None)
-            it.pop("fetched_at", None)
-
-        return {"statusCode": 200, "headers": _cors(),
-                "body": json.dumps({"items": items}, default=_dec)}
+            return {"statusCode": 404, "headers": _cors(),
+                    "body": json.dumps({"error": f"No chart for year {year}"})}
+
+        # fetched_at serve prima per Last-Modified
+        fetched = _clean(items)
+        body = _dumps({"items": items})
+        return _respond(event, body, fetched)
 
     except Exception as e:
         return {"statusCode": 500, "headers": _cors(),
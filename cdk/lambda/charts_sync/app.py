@@ -0,0 +1,100 @@
+"""
+Sync incrementale ChartsTable → AlbumsTable dallo stream DynamoDB della tabella
+classifiche: appena lo scraper scrive una voce, l'album diventa navigabile
+(lista, ricerca per titolo/artista) senza rilanciare SeedFromCharts.
+
+Per ogni batch dello stream:
+- solo INSERT/MODIFY di voci con album_id (niente manifest, checkpoint, REMOVE);
+- MODIFY che non cambiano i campi catalogo (es. solo fetched_at) si saltano;
+- un album toccato da più voci (globale + regioni) si scrive una volta sola;
+- BatchGetItem dei campi attuali: gli album già allineati non si riscrivono
+  (un replay dello stream non produce scritture);
+- update_item con SET dei soli campi catalogo, mai i contatori rating, e
+  condizione su chart_fetched_at: una voce vecchia riconsegnata dopo una più
+  nuova non torna indietro.
+
+Campi catalogo, confronto, BatchGetItem e upsert sono in album_catalog (lambda/shared),
+gli stessi di SeedFromCharts.
+"""
+import os
+import time
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+from album_catalog import catalog_fields, fetch_existing, same_catalog, upsert_album
+
+dynamodb = boto3.resource("dynamodb")
+ALBUMS_TABLE = os.environ["ALBUMS_TABLE"]
+albums_table = dynamodb.Table(ALBUMS_TABLE)
+
+_deserializer = TypeDeserializer()
+
+def _image(record, which):
+    raw = (record.get("dynamodb") or {}).get(which)
+    return {k: _deserializer.deserialize(v) for k, v in raw.items()} if raw else None
+
+def albums_from_records(records):
+    """
+    album_id → (campi catalogo, fetched_at della voce, SequenceNumber dei record).
+    Più voci per lo stesso album nel batch: vince quella scritta per ultima dallo scraper.
+    """
+    touched, skipped = {}, 0
+    for record in records:
+        if record.get("eventName") not in ("INSERT", "MODIFY"):
+            skipped += 1
+            continue
+        new = _image(record, "NewImage")
+        album = catalog_fields(new)
+        if album is None or same_catalog(album, catalog_fields(_image(record, "OldImage"))):
+            skipped += 1
+            continue
+        seq = record["dynamodb"]["SequenceNumber"]
+        fetched_at = new.get("fetched_at") or ""
+        current = touched.get(album["album_id"])
+        if current is None or fetched_at >= current[1]:
+            seqs = (current[2] if current else []) + [seq]
+            touched[album["album_id"]] = (album, fetched_at, seqs)
+        else:
+            current[2].append(seq)
+    return touched, skipped
+
+def handler(event, context):
+    """
+    Event source DynamoDB Streams con ReportBatchItemFailures: in caso di errore
+    si restituisce il primo SequenceNumber non applicato e lo stream riparte da lì
+    (le scritture già fatte sono idempotenti).
+    """
+    records = event.get("Records", [])
+    touched, skipped = albums_from_records(records)
+    stats = {"records": len(records), "skipped": skipped, "albums": len(touched),
+             "unchanged": 0, "written": 0, "stale": 0}
+    if not touched:
+        print(f"🔁 Stream ChartsTable: {stats}")
+        return {"batchItemFailures": []}
+
+    ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    try:
+        existing = fetch_existing(dynamodb, ALBUMS_TABLE, list(touched))
+    except Exception as e:
+        print("Errore lettura AlbumsTable:", str(e))
+        first = min((s for _, _, seqs in touched.values() for s in seqs), key=int)
+        return {"batchItemFailures": [{"itemIdentifier": first}]}
+
+    failed = []
+    for album_id, (album, fetched_at, seqs) in touched.items():
+        if same_catalog(album, existing.get(album_id)):
+            stats["unchanged"] += 1
+            continue
+        try:
+            if upsert_album(albums_table, album, ts, fetched_at):
+                stats["written"] += 1
+            else:
+                stats["stale"] += 1
+        except Exception as e:
+            print(f"Errore upsert {album_id}:", str(e))
+            failed.extend(seqs)
+
+    print(f"🔁 Stream ChartsTable: {stats}")
+    # SequenceNumber sono stringhe numeriche di lunghezza variabile: confronto numerico
+    return {"batchItemFailures": [{"itemIdentifier": min(failed, key=int)}] if failed else []}
@@ -1,4 +1,132 @@
+import json
+import os
+import time
+from collections import defaultdict
+
+import boto3
+
+dynamodb = boto3.resource("dynamodb")
+USERS_TABLE = os.environ["USERS_TABLE"]
+
+ses = boto3.client("ses", region_name="eu-west-3")  # usa la tua regione SES
+SOURCE_EMAIL = os.environ["SES_SOURCE_EMAIL"]
+
+BATCH_GET_SIZE = 100   # limite BatchGetItem
+MAX_DIGEST_LINES = int(os.getenv("MAX_DIGEST_LINES", "20"))
+TIME_MARGIN_MS = int(os.getenv("DIGEST_TIME_MARGIN_MS", "5000"))   # niente send così vicino al timeout
+
+
+def parse_event(record):
+    """Evento like dal body SQS; None per i messaggi di altro tipo (es. producer)."""
+    try:
+        body = json.loads(record["body"])
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(body, dict) or body.get("type") != "review_liked":
+        return None
+    return body
+
+
+def fetch_emails(user_ids):
+    """user_id -> email con BatchGetItem (blocchi da 100, retry su UnprocessedKeys)."""
+    keys = [{"user_id": u} for u in dict.fromkeys(user_ids)]
+    emails = {}
+    for i in range(0, len(keys), BATCH_GET_SIZE):
+        request = {USERS_TABLE: {"Keys": keys[i:i + BATCH_GET_SIZE], "ProjectionExpression": "user_id, email"}}
+        backoff = 0.05
+        while request:
+            resp = dynamodb.batch_get_item(RequestItems=request)
+            for it in resp.get("Responses", {}).get(USERS_TABLE, []):
+                if it.get("email"):
+                    emails[it["user_id"]] = it["email"]
+            request = resp.get("UnprocessedKeys") or None
+            if request:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 1.0)
+    return emails
+
+
+def build_digests(events):
+    """
+    Raggruppa per destinatario (autore della recensione) e deduplica
+    sulla coppia (recensione, liker): SQS consegna at-least-once.
+    Ritorna review_user_id -> {"likes": [...], "message_ids": [...]}
+    """
+    digests = defaultdict(lambda: {"likes": {}, "message_ids": []})
+    for message_id, e in events:
+        d = digests[e["review_user_id"]]
+        d["message_ids"].append(message_id)
+        d["likes"].setdefault((e["album_id"], e.get("liker_id")), e)
+    return digests
+
+
+def digest_text(likes):
+    likes = sorted(likes, key=lambda e: e.get("ts", 0))
+    lines = [f"- {e.get('liker_email') or 'un utente'} sul tuo commento all'album {e['album_id']}"
+             for e in likes[:MAX_DIGEST_LINES]]
+    if len(likes) > MAX_DIGEST_LINES:
+        lines.append(f"... e altri {len(likes) - MAX_DIGEST_LINES} like")
+    return f"Hai ricevuto {len(likes)} nuovi like:\n" + "\n".join(lines)
+
+
+def send_digest(to_email, likes):
+    n = len(likes)
+    ses.send_email(
+        Source=SOURCE_EMAIL,
+        Destination={"ToAddresses": [to_email]},
+        Message={
+            "Subject": {"Data": "Nuovo like al tuo commento" if n == 1 else f"{n} nuovi like ai tuoi commenti"},
+            "Body": {"Text": {"Data": digest_text(likes)}},
+        },
+    )
+
+
 def handler(event, context):
+    """
+    Digest delle notifiche like: la finestra di raccolta è la batching window
+    dell'event source SQS, qui si manda UNA email per destinatario per batch.
+    Con ReportBatchItemFailures ritentano solo i messaggi dei digest falliti.
+    Vicino al timeout i digest non ancora inviati tornano in coda allo stesso modo:
+    un timeout a metà giro farebbe riconsegnare tutto il batch, e chi ha già avuto
+    la sua email la riceverebbe di nuovo.
+    """
+    remaining_ms = context.get_remaining_time_in_millis if context else (lambda: float("inf"))
+    events = []
     for record in event["Records"]:
-        print("Messaggio ricevuto:", record["body"])
-    return {"statusCode": 200}
+        like = parse_event(record)
+        if like is None:
+            print("Messaggio ricevuto:", record["body"])
+            continue
+        events.append((record["messageId"], like))
+
+    if not events:
+        return {"batchItemFailures": []}
+
+    digests = build_digests(events)
+
+    try:
+        # Un solo giro su UsersTable per tutto il batch
+        emails = fetch_emails(list(digests))
+    except Exception as e:
+        print("Errore lettura UsersTable:", str(e))
+        return {"batchItemFailures": [{"itemIdentifier": mid} for mid, _ in events]}
+
+    failures, sent, deferred = [], 0, 0
+    for user_id, d in digests.items():
+        to_email = emails.get(user_id)
+        if not to_email:
+            continue
+        if remaining_ms() < TIME_MARGIN_MS:
+            deferred += 1
+            failures.extend({"itemIdentifier": mid} for mid in d["message_ids"])
+            continue
+        try:
+            send_digest(to_email, list(d["likes"].values()))
+            sent += 1
+        except Exception as e:
+            print(f"Errore SES per {user_id}:", str(e))
+            failures.extend({"itemIdentifier": mid} for mid in d["message_ids"])
+
+    print(f"📨 {len(events)} eventi like → {sent} email digest, {deferred} rimandati (timeout), "
+          f"{len(failures)} messaggi da ritentare")
+    return {"batchItemFailures": failures}
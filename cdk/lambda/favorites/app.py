@@ -1,9 +1,22 @@
 import json
 import boto3
 import os
+import base64
+import time
+from bisect import bisect_right
+from decimal import Decimal
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(os.environ["USERS_TABLE"])
+ALBUMS_TABLE = os.environ["ALBUMS_TABLE"]
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100      # = limite BatchGetItem: una sola richiesta per pagina
+
+# Campi album restituiti (come le viste a lista di lambda/albums); average_rating è derivata dai contatori,
+# quella salvata serve per gli album legacy senza ratings_sum
+LIST_FIELDS = ["album_id", "title", "artist", "cover", "year",
+               "average_rating", "ratings_sum", "ratings_count"]
 
 def response(status, body):
     return {
@@ -14,7 +27,95 @@ def response(status, body):
             "Access-Control-Allow-Headers": "Content-Type,Authorization",
             "Access-Control-Allow-Methods": "OPTIONS,GET,POST,DELETE,PUT"
         },
-        "body": json.dumps(body)
+        "body": json.dumps(body, default=decimal_default)
+    }
+
+def decimal_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+def with_average(item):
+    """
+    average_rating calcolata dai contatori ratings_sum / ratings_count, come in
+    lambda/albums; un album legacy senza ratings_sum tiene la media salvata.
+    """
+    count = int(item.pop("ratings_count", 0) or 0)
+    if "ratings_sum" in item:
+        total = item.pop("ratings_sum") or 0
+        item["average_rating"] = float(total) / count if count > 0 else 0
+    else:
+        item.setdefault("average_rating", 0)
+    return item
+
+def update_favorites(user_id, email, action, album_id):
+    """
+    ADD/DELETE sullo String Set in un solo update_item: crea l'utente se manca
+    (email solo se non c'è già), niente put_item condizionale prima.
+    Togliendo l'ultimo album DynamoDB elimina l'attributo favorites.
+    """
+    expr = f"{action} favorites :a"
+    values = {":a": {album_id}}
+    if email:
+        expr += " SET email = if_not_exists(email, :e)"
+        values[":e"] = email
+    table.update_item(
+        Key={"user_id": user_id},
+        UpdateExpression=expr,
+        ExpressionAttributeValues=values,
+    )
+
+def encode_cursor(album_id):
+    return base64.urlsafe_b64encode(album_id.encode("utf-8")).decode("ascii") if album_id else None
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor.encode("ascii"), altchars=b"-_", validate=True).decode("utf-8")
+    except (ValueError, UnicodeError):
+        raise ValueError("Cursor non valido")
+
+def fetch_albums(ids):
+    """≤ 100 id → album_id → item, con BatchGetItem (retry con backoff sulle UnprocessedKeys)."""
+    names = {f"#{f}": f for f in LIST_FIELDS}
+    request = {ALBUMS_TABLE: {"Keys": [{"album_id": i} for i in ids],
+                              "ProjectionExpression": ", ".join(names),   # year è parola riservata
+                              "ExpressionAttributeNames": names}}
+    found, backoff = {}, 0.05
+    for attempt in range(8):
+        resp = dynamodb.batch_get_item(RequestItems=request)
+        for it in resp.get("Responses", {}).get(ALBUMS_TABLE, []):
+            found[it["album_id"]] = with_average(it)
+        request = resp.get("UnprocessedKeys") or None
+        if not request:
+            return found
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 1.0)
+    raise RuntimeError("BatchGetItem: UnprocessedKeys dopo troppi tentativi")
+
+def list_favorites(user_id, params):
+    """
+    Una pagina dei preferiti con i metadati degli album. Lo String Set non ha
+    ordine: si ordina per album_id e il cursor è l'ultimo id restituito, così
+    aggiunte/rimozioni tra una pagina e l'altra non fanno saltare né ripetere album.
+    """
+    try:
+        limit = max(1, min(int(params.get("limit") or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit non valido")
+    after = decode_cursor(params["cursor"]) if params.get("cursor") else None
+
+    item = table.get_item(Key={"user_id": user_id}, ProjectionExpression="favorites").get("Item") or {}
+    favorites = sorted(item.get("favorites") or ())
+    start = bisect_right(favorites, after) if after is not None else 0
+    ids = favorites[start:start + limit]
+
+    found = fetch_albums(ids) if ids else {}
+    more = start + limit < len(favorites)
+    return {
+        "items": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],   # album non (più) in AlbumsTable
+        "total": len(favorites),
+        "next_cursor": encode_cursor(ids[-1]) if more else None,
     }
 
 def handler(event, context):
@@ -34,33 +135,30 @@ def handler(event, context):
     if not user_id:
         return response(401, {"error": "Unauthorized"})
 
-    # ✅ POST /users/favorites/{album_id}
-    if http_method == "POST" and "album_id" in path_params:
-        album_id = path_params["album_id"]
-        print(f"Aggiungo album {album_id} ai preferiti di {user_id}")
-
-        # Se l’utente non esiste ancora → lo creo SENZA favorites
+    # ✅ GET /users/favorites?limit=&cursor= (preferiti con i metadati degli album)
+    if http_method == "GET" and "album_id" not in path_params:
+        params = event.get("queryStringParameters") or {}
         try:
-            table.put_item(
-                Item={"user_id": user_id, "email": email},
-                ConditionExpression="attribute_not_exists(user_id)"
-            )
-            print(f"Creato nuovo utente {user_id} in DynamoDB")
+            return response(200, list_favorites(user_id, params))
+        except ValueError as e:
+            return response(400, {"error": str(e)})
         except Exception as e:
-            print(f"Utente già esistente o errore su put_item: {str(e)}")
+            print(f"Errore leggendo i preferiti: {str(e)}")
+            return response(500, {"error": "Errore leggendo i preferiti"})
 
-        # Aggiorna i preferiti con ADD su String Set
+    # ✅ POST / DELETE /users/favorites/{album_id}
+    if http_method in ("POST", "DELETE") and "album_id" in path_params:
+        album_id = path_params["album_id"]
+        action = "ADD" if http_method == "POST" else "DELETE"
+        print(f"{action} album {album_id} nei preferiti di {user_id}")
         try:
-            table.update_item(
-                Key={"user_id": user_id},
-                UpdateExpression="ADD favorites :a",
-                ExpressionAttributeValues={":a": set([album_id])}
-            )
-            print(f"Album {album_id} aggiunto ai preferiti di {user_id}")
+            update_favorites(user_id, email, action, album_id)
         except Exception as e:
             print(f"Errore in update_item: {str(e)}")
             return response(500, {"error": "Errore aggiornando i preferiti"})
 
-        return response(200, {"message": f"Album {album_id} aggiunto ai preferiti"})
+        if action == "ADD":
+            return response(200, {"message": f"Album {album_id} aggiunto ai preferiti"})
+        return response(200, {"message": f"Album {album_id} rimosso dai preferiti"})
 
     return response(400, {"error": "Bad request"})
@@ -0,0 +1,129 @@
+"""
+Migrazione una tantum di ChartsTable verso lo schema a chiavi esatte:
+
+- classifica globale:  chart_key = "1999"            (rank 1..N)
+- classifica regione:  chart_key = "1999#EUROPE"     (regione MAIUSCOLA, niente attributo region)
+- manifest dell'anno:  chart_key = "1999", rank = 0  (kind = "manifest", regions = {"GLOBAL", "EUROPE", ...})
+
+charts_read legge solo per chiave esatta (una query), senza più scan di fallback.
+
+Ripartibile: dopo ogni pagina di scan salva il LastEvaluatedKey in un item di
+checkpoint nella tabella stessa; ogni scrittura è idempotente, quindi rilanciare
+dopo un crash (o un timeout) riprende da dove era arrivata. Si rilancia finché
+la risposta non ha "done": true.
+"""
+import json
+import os
+import re
+import time
+from collections import defaultdict
+
+import boto3
+
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ["CHARTS_TABLE"])
+
+MANIFEST_RANK = 0
+CHECKPOINT_KEY = {"chart_key": "MIGRATION#chart-keys-v2", "rank": 0}
+LEGACY_KEY = re.compile(r"^(\d{4})#(.+)$")
+PAGE_SIZE = int(os.getenv("MIGRATION_PAGE_SIZE", "500"))
+TIME_MARGIN_MS = 30_000   # si ferma (salvando il checkpoint) prima del timeout Lambda
+
+
+def load_checkpoint():
+    return table.get_item(Key=CHECKPOINT_KEY, ConsistentRead=True).get("Item") or {}
+
+
+def save_checkpoint(last_key, stats, done=False):
+    item = dict(CHECKPOINT_KEY, done=done, stats=stats,
+                updated_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    if last_key:
+        item["last_key"] = json.dumps(last_key, default=str)
+    table.put_item(Item=item)
+
+
+def canonical(item):
+    """item legacy → (nuovo item o None se già canonico, anno, regione)"""
+    m = LEGACY_KEY.match(item["chart_key"])
+    year, region = m.group(1), m.group(2).strip().upper()
+    key = f"{year}#{region}"
+    if key == item["chart_key"] and "region" not in item:
+        return None, year, region
+    new = dict(item, chart_key=key, year=int(year))
+    new.pop("region", None)
+    return new, year, region
+
+
+def update_manifests(regions_by_year):
+    ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    for year, regions in regions_by_year.items():
+        table.update_item(
+            Key={"chart_key": year, "rank": MANIFEST_RANK},
+            UpdateExpression="ADD regions :r SET kind = :k, updated_at = :ts",
+            ExpressionAttributeValues={":r": set(regions), ":k": "manifest", ":ts": ts},
+        )
+
+
+def migrate_page(items, stats):
+    regions_by_year = defaultdict(set)
+    with table.batch_writer() as batch:
+        for item in items:
+            chart_key = item["chart_key"]
+            if chart_key.isdigit():
+                if int(item["rank"]) != MANIFEST_RANK:
+                    regions_by_year[chart_key].add("GLOBAL")
+                continue
+            if not LEGACY_KEY.match(chart_key):
+                continue   # checkpoint o altro
+            new, year, region = canonical(item)
+            regions_by_year[year].add(region)
+            if new is None:
+                stats["already_canonical"] += 1
+                continue
+            # prima la copia, poi la cancellazione: un crash nel mezzo lascia solo un duplicato
+            batch.put_item(Item=new)
+            if new["chart_key"] != chart_key:
+                batch.delete_item(Key={"chart_key": chart_key, "rank": item["rank"]})
+            stats["rewritten"] += 1
+    update_manifests(regions_by_year)
+    stats["manifests"] += len(regions_by_year)
+
+
+def run(max_pages=None, remaining_ms=lambda: float("inf")):
+    checkpoint = load_checkpoint()
+    stats = defaultdict(int, {k: int(v) for k, v in (checkpoint.get("stats") or {}).items()})
+    if checkpoint.get("done"):
+        return {"done": True, "stats": dict(stats)}
+
+    scan_kwargs = {"Limit": PAGE_SIZE}
+    if checkpoint.get("last_key"):
+        scan_kwargs["ExclusiveStartKey"] = json.loads(checkpoint["last_key"])
+        print(f"↪️ Riprendo da {checkpoint['last_key']}")
+
+    pages = 0
+    while True:
+        resp = table.scan(**scan_kwargs)
+        migrate_page(resp.get("Items", []), stats)
+        stats["scanned"] += resp.get("Count", 0)
+        pages += 1
+        last_key = resp.get("LastEvaluatedKey")
+        if not last_key:
+            save_checkpoint(None, dict(stats), done=True)
+            print(f"🎉 Migrazione completata: {dict(stats)}")
+            return {"done": True, "stats": dict(stats)}
+        # rank è numerico: nel checkpoint va salvato come numero
+        last_key = {k: (int(v) if k == "rank" else v) for k, v in last_key.items()}
+        save_checkpoint(last_key, dict(stats))
+        scan_kwargs["ExclusiveStartKey"] = last_key
+        if (max_pages and pages >= max_pages) or remaining_ms() < TIME_MARGIN_MS:
+            print(f"⏸️ Interrotta dopo {pages} pagine, rilanciare per continuare: {dict(stats)}")
+            return {"done": False, "stats": dict(stats)}
+
+
+def handler(event, context):
+    event = event or {}
+    if event.get("restart"):
+        table.delete_item(Key=CHECKPOINT_KEY)
+    remaining = context.get_remaining_time_in_millis if context else (lambda: float("inf"))
+    result = run(max_pages=event.get("max_pages"), remaining_ms=remaining)
+    return {"statusCode": 200, "body": json.dumps(result)}
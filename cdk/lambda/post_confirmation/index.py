@@ -1,5 +1,6 @@
 import boto3
 import os
+import time
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(os.environ["USERS_TABLE"])
@@ -28,12 +29,21 @@ def handler(event, context):
     # --- Nuova parte: iscrizione SNS ---
     if email:
         try:
-            sns.subscribe(
+            resp = sns.subscribe(
                 TopicArn=TOPIC_ARN,
                 Protocol="email",
                 Endpoint=email
             )
             print(f"Email {email} sottoscritta a {TOPIC_ARN}")
+            # stesso stato scritto dal job lambda/sns: i rilanci saltano questo utente
+            table.update_item(
+                Key={"user_id": user_id},
+                UpdateExpression="SET sns_topic_arn = :t, sns_endpoint = :e, sns_subscription_arn = :a, "
+                                 "sns_subscribed_at = :ts",
+                ConditionExpression="email = :e",
+                ExpressionAttributeValues={":t": TOPIC_ARN, ":e": email, ":a": resp["SubscriptionArn"],
+                                           ":ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+            )
         except Exception as e:
             print(f"Errore iscrizione SNS per {email}: {e}")
 
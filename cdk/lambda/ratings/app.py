@@ -1,3 +1,4 @@
+import base64
 import boto3
 import json
 import os
@@ -9,10 +10,23 @@ from botocore.exceptions import ClientError
 dynamodb = boto3.resource("dynamodb")
 ratings_table = dynamodb.Table(os.environ["RATINGS_TABLE"])
 albums_table = dynamodb.Table(os.environ["ALBUMS_TABLE"])
-users_table = dynamodb.Table(os.environ["USERS_TABLE"])
+LIKES_TABLE = os.environ["LIKES_TABLE"]   # un item per (recensione, utente che mette like)
 
-sns = boto3.client("sns")   # 👈 client SNS
-TOPIC_ARN = os.environ["SNS_TOPIC_ARN"]  # 👈 lo passi come variabile ambiente
+# Le notifiche like passano dalla coda (consumer): niente SNS/Users nel path HTTP
+sqs = boto3.client("sqs")
+QUEUE_URL = os.environ["QUEUE_URL"]
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+BATCH_GET_SIZE = 100   # limite BatchGetItem
+
+# Campi restituiti nella lista recensioni (niente liked_by legacy & co.)
+REVIEW_PROJECTION = ["album_id", "user_id", "timestamp", "rating", "comment", "likes"]
+
+# GSI user_id / timestamp (proiezione = REVIEW_PROJECTION): recensioni di un utente senza scan
+USER_INDEX = "UserIndex"
+
+MAX_REVIEW_ATTEMPTS = 8   # transazione recensione + album ritentata su conflitti
 
 
 # Encoder per serializzare Decimal in JSON
@@ -35,6 +49,275 @@ def response(status, body):
     }
 
 
+def album_aggregate_update(album_id, rating, old_rating=None):
+    """ADD atomico su ratings_sum / ratings_count / ratings_hist_N: nessuna lost update sotto concorrenza."""
+    values = {}
+    if old_rating is None:
+        values[":d"], values[":c"] = rating, 1
+        adds = ["ratings_sum :d", "ratings_count :c", f"ratings_hist_{rating} :one"]
+        values[":one"] = 1
+    else:
+        old_rating = int(old_rating)
+        values[":d"], values[":c"] = rating - old_rating, 0
+        adds = ["ratings_sum :d", "ratings_count :c"]
+        if old_rating != rating:
+            adds += [f"ratings_hist_{rating} :one", f"ratings_hist_{old_rating} :minus"]
+            values[":one"], values[":minus"] = 1, -1
+
+    # updated_at → Last-Modified lato albums
+    values[":now"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    return {
+        "TableName": albums_table.name,
+        "Key": {"album_id": album_id},
+        "UpdateExpression": "ADD " + ", ".join(adds) + " SET updated_at = :now",
+        # album legacy (ratings_count + average_rating, senza ratings_sum): prima va convertito,
+        # altrimenti ADD crea ratings_sum = voto e la media crolla
+        "ConditionExpression": "attribute_exists(ratings_sum) OR attribute_not_exists(ratings_count)",
+        "ExpressionAttributeValues": values,
+    }
+
+
+def save_review(album_id, user_id, rating, comment, ts):
+    """
+    Recensione + contatori dell'album in UNA TransactWriteItems: o entrambe o nessuna.
+    La scrittura della recensione è condizionata al voto letto prima, così il delta
+    applicato all'album è quello giusto anche con richieste concorrenti o ritentate
+    (un retry dopo un successo vede old == new e applica delta 0, correttamente).
+    Ritorna la recensione precedente (None se è la prima).
+    """
+    for attempt in range(MAX_REVIEW_ATTEMPTS):
+        old = ratings_table.get_item(Key={"album_id": album_id, "user_id": user_id},
+                                     ProjectionExpression="rating, likes", ConsistentRead=True).get("Item")
+        old_rating = old.get("rating") if old else None
+        review = {
+            "TableName": ratings_table.name,
+            "Key": {"album_id": album_id, "user_id": user_id},
+            # I like già ricevuti restano invariati
+            "UpdateExpression": "SET #ts = :ts, rating = :r, #c = :c, likes = if_not_exists(likes, :zero)",
+            "ExpressionAttributeNames": {"#ts": "timestamp", "#c": "comment"},
+            "ExpressionAttributeValues": {":ts": ts, ":r": rating, ":c": comment, ":zero": 0},
+        }
+        if old is None:
+            review["ConditionExpression"] = "attribute_not_exists(user_id)"
+        else:
+            review["ConditionExpression"] = "rating = :old"
+            review["ExpressionAttributeValues"][":old"] = old_rating
+        try:
+            dynamodb.meta.client.transact_write_items(TransactItems=[
+                {"Update": review},
+                {"Update": album_aggregate_update(album_id, rating, old_rating)},
+            ])
+            return old
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            reasons = [r.get("Code") for r in e.response.get("CancellationReasons") or [{}, {}]]
+            if reasons[1] == "ConditionalCheckFailed":
+                seed_legacy_aggregate(album_id, user_id, old_rating)
+            elif reasons[0] != "ConditionalCheckFailed" and "TransactionConflict" not in reasons:
+                raise
+            # recensione cambiata nel frattempo / conflitto: si rilegge e si riprova
+            time.sleep(min(0.01 * 2 ** attempt, 0.5))
+    raise RuntimeError("Recensione non salvata: troppi conflitti")
+
+
+def legacy_histogram(album_id, user_id, old_rating):
+    """
+    Istogramma dalle recensioni in RatingsTable com'era PRIMA della recensione in
+    corso: si esclude quella di user_id e si rimette il voto precedente.
+    """
+    hist = {n: 0 for n in range(1, 6)}
+    kwargs = {"KeyConditionExpression": Key("album_id").eq(album_id), "ProjectionExpression": "user_id, rating"}
+    while True:
+        resp = ratings_table.query(**kwargs)
+        for it in resp.get("Items", []):
+            if it["user_id"] != user_id and int(it.get("rating", 0)) in hist:
+                hist[int(it["rating"])] += 1
+        if "LastEvaluatedKey" not in resp:
+            break
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+    if old_rating is not None and int(old_rating) in hist:
+        hist[int(old_rating)] += 1
+    return hist
+
+
+def seed_legacy_aggregate(album_id, user_id=None, old_rating=None):
+    """
+    Conversione (una volta sola, idempotente) di un album legacy ai contatori:
+    ratings_sum = average_rating × ratings_count; ratings_hist_N ricostruiti da
+    RatingsTable solo se le recensioni tornano col ratings_count salvato (altrimenti
+    l'istogramma resta incompleto e album_summary non lo serve).
+    """
+    album = albums_table.get_item(
+        Key={"album_id": album_id},
+        ProjectionExpression="ratings_sum, ratings_count, average_rating",
+        ConsistentRead=True,
+    ).get("Item", {})
+    if "ratings_sum" in album:
+        return   # già convertito da una richiesta concorrente
+    count = int(album.get("ratings_count", 0) or 0)
+    # la somma di voti interi è intera: arrotondo gli errori della media salvata
+    total = int(round(Decimal(str(album.get("average_rating", 0) or 0)) * count))
+    sets, values = ["ratings_sum = :s"], {":s": total}
+    hist = legacy_histogram(album_id, user_id, old_rating)
+    if sum(hist.values()) == count:
+        for n, c in hist.items():
+            sets.append(f"ratings_hist_{n} = :h{n}")
+            values[f":h{n}"] = c
+    try:
+        albums_table.update_item(
+            Key={"album_id": album_id},
+            UpdateExpression="SET " + ", ".join(sets),
+            ConditionExpression="attribute_not_exists(ratings_sum)",
+            ExpressionAttributeValues=values,
+        )
+        print(f"Album legacy {album_id} convertito: ratings_sum = {total}, "
+              f"istogramma {'ricostruito' if len(sets) > 1 else 'non ricostruibile'}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+
+def album_summary(album_id):
+    """Riepilogo (conteggio, media, istogramma 1-5) letto dall'aggregato dell'album."""
+    album = albums_table.get_item(
+        Key={"album_id": album_id},
+        ProjectionExpression="ratings_sum, ratings_count, average_rating, "
+                             + ", ".join(f"ratings_hist_{n}" for n in range(1, 6)),
+    ).get("Item", {})
+
+    count = int(album.get("ratings_count", 0) or 0)
+    if "ratings_sum" in album:
+        avg = float(album["ratings_sum"]) / count if count > 0 else 0
+    else:
+        # album legacy, senza contatori
+        avg = float(album.get("average_rating", 0) or 0)
+
+    # album legacy non ricostruito: l'istogramma non torna col conteggio → null invece di numeri sbagliati
+    histogram = {str(n): int(album.get(f"ratings_hist_{n}", 0)) for n in range(1, 6)}
+    if sum(histogram.values()) != count or min(histogram.values()) < 0:
+        histogram = None
+
+    return {
+        "ratings_count": count,
+        "average_rating": avg,
+        "histogram": histogram,
+    }
+
+
+def encode_cursor(last_key):
+    """LastEvaluatedKey → token opaco per il client."""
+    if not last_key:
+        return None
+    raw = json.dumps(last_key, cls=DecimalEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, dict):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def page_size(params):
+    try:
+        limit = int(params.get("limit") or DEFAULT_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("Invalid limit")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def enqueue_like_event(album_id, review_user_id, liker_id, liker_email):
+    """Evento like sulla coda; un errore qui non deve far fallire un like già registrato."""
+    try:
+        sqs.send_message(
+            QueueUrl=QUEUE_URL,
+            MessageBody=json.dumps({
+                "type": "review_liked",
+                "album_id": album_id,
+                "review_user_id": review_user_id,
+                "liker_id": liker_id,
+                "liker_email": liker_email,
+                "ts": int(time.time() * 1000),
+            }),
+        )
+    except Exception as e:
+        print("Errore invio evento like in coda:", str(e))
+
+
+def review_id(album_id, review_user_id):
+    return f"{album_id}#{review_user_id}"
+
+
+def add_like(album_id, review_user_id, liker_id):
+    """Put condizionale dell'item like + ADD atomico sul contatore della recensione,
+    nella stessa transazione: idempotente e senza liste che crescono."""
+    dynamodb.meta.client.transact_write_items(TransactItems=[
+        {
+            "Put": {
+                "TableName": LIKES_TABLE,
+                "Item": {
+                    "review_id": review_id(album_id, review_user_id),
+                    "liker_id": liker_id,
+                    "album_id": album_id,
+                    "created_at": int(time.time() * 1000),
+                },
+                "ConditionExpression": "attribute_not_exists(liker_id)",
+            }
+        },
+        {
+            "Update": {
+                "TableName": ratings_table.name,
+                "Key": {"album_id": album_id, "user_id": review_user_id},
+                "UpdateExpression": "ADD likes :inc",
+                # la recensione deve esistere; liked_by resta solo sulle recensioni legacy
+                "ConditionExpression": "attribute_exists(user_id) AND "
+                                       "(attribute_not_exists(liked_by) OR NOT contains(liked_by, :liker))",
+                "ExpressionAttributeValues": {":inc": 1, ":liker": liker_id},
+                "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+            }
+        },
+    ])
+
+
+def liked_reviews(album_id, review_user_ids, liker_id):
+    """
+    Quali di queste recensioni hanno già il like di liker_id? Nella stessa BatchGetItem
+    l'item like (LikesTable) e la recensione (liked_by legacy, che add_like rispetta:
+    senza, il bottone risulterebbe attivo e il click darebbe 409). Max 100 chiavi per
+    richiesta: 50 recensioni per blocco.
+    """
+    authors = list(dict.fromkeys(review_user_ids))
+    chunk = BATCH_GET_SIZE // 2
+    liked = set()
+    for i in range(0, len(authors), chunk):
+        part = authors[i:i + chunk]
+        request = {
+            LIKES_TABLE: {"Keys": [{"review_id": review_id(album_id, u), "liker_id": liker_id} for u in part],
+                          "ProjectionExpression": "review_id"},
+            ratings_table.name: {"Keys": [{"album_id": album_id, "user_id": u} for u in part],
+                                 "ProjectionExpression": "user_id, liked_by"},
+        }
+        backoff = 0.05
+        while request:
+            resp = dynamodb.batch_get_item(RequestItems=request)
+            responses = resp.get("Responses", {})
+            for it in responses.get(LIKES_TABLE, []):
+                liked.add(it["review_id"].split("#", 1)[1])
+            for it in responses.get(ratings_table.name, []):
+                if liker_id in (it.get("liked_by") or ()):
+                    liked.add(it["user_id"])
+            request = resp.get("UnprocessedKeys") or None
+            if request:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 1.0)
+    return [u for u in review_user_ids if u in liked]
+
+
 def handler(event, context):
     print("Evento ricevuto:", json.dumps(event))
     http_method = event.get("httpMethod", "")
@@ -63,39 +346,28 @@ def handler(event, context):
             if rating is None:
                 return response(400, {"error": "Missing rating"})
 
+            try:
+                rating = int(rating)
+            except (TypeError, ValueError):
+                rating = 0
+            if not 1 <= rating <= 5:
+                return response(400, {"error": "Rating must be between 1 and 5"})
+
             comment = body.get("comment") or body.get("review_text", "")
 
             item = {
                 "album_id": album_id,   # PK
                 "user_id": user_id,     # SK
                 "timestamp": int(time.time() * 1000),   # millisecondi
-                "rating": int(rating),
+                "rating": rating,
                 "comment": comment,
-                "likes": 0,
-                "liked_by": [],   # 👈 inizializzo array vuoto
             }
 
-            # Salva la recensione nella tabella Ratings
-            ratings_table.put_item(Item=item)
-
-            # Recupera i valori attuali dell'album
-            album = albums_table.get_item(Key={"album_id": album_id}).get("Item", {})
-            old_count = int(album.get("ratings_count", 0))
-            old_avg = float(album.get("average_rating", 0))
-
-            # Calcola i nuovi valori
-            new_count = old_count + 1
-            new_avg = ((old_avg * old_count) + int(rating)) / new_count
-
-            # Aggiorna l'album
-            albums_table.update_item(
-                Key={"album_id": album_id},
-                UpdateExpression="SET ratings_count = :c, average_rating = :a",
-                ExpressionAttributeValues={
-                    ":c": Decimal(new_count),
-                    ":a": Decimal(str(new_avg))
-                }
-            )
+            # Recensione e contatori atomici dell'album nella stessa transazione:
+            # per una ri-recensione si applica solo il delta
+            old = save_review(album_id, user_id, rating, comment, item["timestamp"])
+
+            item["likes"] = int(old.get("likes", 0)) if old else 0
 
             return response(201, {"message": "Review saved", "item": item})
 
@@ -120,38 +392,21 @@ def handler(event, context):
                 return response(401, {"error": "Unauthorized: missing liker user_id"})
 
             try:
-                # Incrementa likes solo se l’utente non ha già messo like
-                ratings_table.update_item(
-                    Key={"album_id": album_id, "user_id": review_user_id},
-                    UpdateExpression="""
-                        ADD likes :inc 
-                        SET liked_by = list_append(if_not_exists(liked_by, :empty), :u)
-                    """,
-                    ConditionExpression="attribute_not_exists(liked_by) OR not contains(liked_by, :liker)",
-                    ExpressionAttributeValues={
-                        ":inc": 1,
-                        ":u": [liker_id],
-                        ":empty": [],
-                        ":liker": liker_id,
-                    },
-                    ReturnValues="UPDATED_NEW"
-                )
+                add_like(album_id, review_user_id, liker_id)
             except ClientError as e:
-                if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-                    return response(409, {"error": "Hai già messo like a questo commento"})
-                else:
+                if e.response["Error"]["Code"] != "TransactionCanceledException":
                     raise
+                reasons = e.response.get("CancellationReasons") or [{}, {}]
+                like_failed = reasons[0].get("Code") == "ConditionalCheckFailed"
+                review_failed = reasons[1].get("Code") == "ConditionalCheckFailed"
+                if review_failed and not reasons[1].get("Item"):
+                    return response(404, {"error": "Recensione non trovata"})
+                if like_failed or review_failed:
+                    return response(409, {"error": "Hai già messo like a questo commento"})
+                raise
 
-            # Recupera email autore commento
-            user_item = users_table.get_item(Key={"user_id": review_user_id}).get("Item", {})
-            to_email = user_item.get("email")
-
-            if to_email:
-                sns.publish(
-                    TopicArn=TOPIC_ARN,
-                    Subject="Nuovo like al tuo commento",
-                    Message=f"Hai ricevuto un like da {liker_email} sul tuo commento all'album {album_id}!"
-                )
+            # Notifica all'autore in modo asincrono (consumer SQS)
+            enqueue_like_event(album_id, review_user_id, liker_id, liker_email)
 
             return response(200, {"message": "Like registrato"})
 
@@ -159,6 +414,70 @@ def handler(event, context):
             print("Errore durante LIKE:", str(e))
             return response(500, {"error": str(e)})
 
+    # ---------------- GET /ratings/{album_id}/likes?reviews=u1,u2 ----------------
+    if http_method == "GET" and resource_path.endswith("/likes"):
+        try:
+            album_id = (event.get("pathParameters") or {}).get("album_id")
+            claims = (event.get("requestContext") or {}).get("authorizer", {}).get("claims", {})
+            liker_id = claims.get("sub")
+            if not liker_id:
+                return response(401, {"error": "Unauthorized: missing user_id"})
+
+            raw = ((event.get("queryStringParameters") or {}).get("reviews") or "").strip()
+            review_user_ids = [u for u in raw.split(",") if u]
+            if not album_id or not review_user_ids:
+                return response(400, {"error": "Missing album_id or reviews"})
+            if len(review_user_ids) > MAX_PAGE_SIZE:
+                return response(400, {"error": f"Too many reviews (max {MAX_PAGE_SIZE})"})
+
+            return response(200, {"liked": liked_reviews(album_id, review_user_ids, liker_id)})
+
+        except Exception as e:
+            print("Errore durante GET likes:", str(e))
+            return response(500, {"error": str(e)})
+
+    # ---------------- GET /users/{user_id}/ratings ----------------
+    if http_method == "GET" and resource_path == "/users/{user_id}/ratings":
+        try:
+            user_id = (event.get("pathParameters") or {}).get("user_id")
+            if not user_id:
+                return response(400, {"error": "Missing user_id"})
+
+            params = event.get("queryStringParameters") or {}
+            try:
+                query_kwargs = {
+                    "IndexName": USER_INDEX,
+                    "KeyConditionExpression": Key("user_id").eq(user_id),
+                    "ScanIndexForward": False,   # più recenti prima
+                    "Limit": page_size(params),
+                    "ProjectionExpression": ", ".join(f"#{f}" for f in REVIEW_PROJECTION),
+                    "ExpressionAttributeNames": {f"#{f}": f for f in REVIEW_PROJECTION},
+                }
+                if params.get("cursor"):
+                    start_key = decode_cursor(params["cursor"])
+                    if start_key.get("user_id") != user_id:
+                        raise ValueError("Invalid cursor")
+                    query_kwargs["ExclusiveStartKey"] = start_key
+            except ValueError as e:
+                return response(400, {"error": str(e)})
+
+            # Una pagina dall'indice: costo proporzionale alle recensioni dell'utente
+            result = ratings_table.query(**query_kwargs)
+
+            items = result.get("Items", [])
+            for i in items:
+                if "likes" not in i:
+                    i["likes"] = 0
+
+            return response(200, {
+                "reviews": items,
+                "next_cursor": encode_cursor(result.get("LastEvaluatedKey")),
+            })
+
+        except Exception as e:
+            print("Errore durante GET recensioni utente:", str(e))
+            return response(500, {"error": str(e)})
+
     # ---------------- GET /ratings/{album_id} ----------------
     if http_method == "GET":
         try:
@@ -166,25 +485,40 @@ def handler(event, context):
             if not album_id:
                 return response(400, {"error": "Missing album_id"})
 
-            # Query tutte le recensioni per album, ordinate dal più recente
-            result = ratings_table.query(
-                KeyConditionExpression=Key("album_id").eq(album_id),
-                ScanIndexForward=False
-            )
+            params = event.get("queryStringParameters") or {}
+            try:
+                limit = page_size(params)
+                query_kwargs = {
+                    "KeyConditionExpression": Key("album_id").eq(album_id),
+                    "ScanIndexForward": False,
+                    "Limit": limit,
+                    # solo i campi utili alla lista (timestamp/comment sono parole riservate)
+                    "ProjectionExpression": ", ".join(f"#{f}" for f in REVIEW_PROJECTION),
+                    "ExpressionAttributeNames": {f"#{f}": f for f in REVIEW_PROJECTION},
+                }
+                if params.get("cursor"):
+                    start_key = decode_cursor(params["cursor"])
+                    if start_key.get("album_id") != album_id:
+                        raise ValueError("Invalid cursor")
+                    query_kwargs["ExclusiveStartKey"] = start_key
+            except ValueError as e:
+                return response(400, {"error": str(e)})
+
+            # Una pagina di recensioni, con token di continuazione
+            result = ratings_table.query(**query_kwargs)
 
             items = result.get("Items", [])
             for i in items:
                 if "likes" not in i:
                     i["likes"] = 0
 
-            # Calcola media e conteggio
-            count = len(items)
-            avg = sum(int(i["rating"]) for i in items) / count if count > 0 else 0
+            # Conteggio, media e istogramma dall'aggregato precalcolato
+            summary = album_summary(album_id)
 
             return response(200, {
                 "reviews": items,
-                "ratings_count": count,
-                "average_rating": avg
+                "next_cursor": encode_cursor(result.get("LastEvaluatedKey")),
+                **summary,
             })
 
         except Exception as e:
@@ -0,0 +1,152 @@
+"""
+Job che costruisce l'indice di ricerca album da AlbumsTable e lo salva su S3
+come UN solo artefatto compresso (gzip). Lo legge la Lambda albums
+(GET /albums/search), una volta per container warm.
+
+Formato (JSON gzippato, "v": 1):
+- docs:     [[album_id, title, artist, cover, year, title_slug], ...]
+- vocab:    parole normalizzate, ordinate (ricerca per prefisso con bisect)
+- post_off / post: posting list per parola, array uint32 little-endian in base64;
+            ogni voce è campo << 30 | doc_id (0 titolo, 1 artista, 2 canzone), ordinate:
+            prima i titoli, poi gli artisti, poi le canzoni, ciascuno per doc_id
+- grams, gram_off / gram_post: trigrammi → id parole del vocabolario (ricerca fuzzy)
+"""
+import base64
+import gzip
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+
+import boto3
+
+ALBUMS_TABLE = os.environ["ALBUMS_TABLE"]
+SEARCH_BUCKET = os.environ["SEARCH_BUCKET"]
+SEARCH_INDEX_KEY = os.getenv("SEARCH_INDEX_KEY", "search/albums-index.json.gz")
+
+FIELD_TITLE, FIELD_ARTIST, FIELD_SONG = 0, 1, 2
+FIELD_SHIFT = 30
+
+dynamodb = boto3.resource("dynamodb")
+s3 = boto3.client("s3")
+
+
+# ⚠️ normalize / trigrams devono restare identiche a quelle in lambda/albums/app.py
+def normalize(text):
+    """minuscolo, senza accenti, solo lettere/numeri → lista di parole"""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"\w+", text)
+
+
+def trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _u32(values):
+    arr = array("I", values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return base64.b64encode(arr.tobytes()).decode("ascii")
+
+
+def _csr(lists):
+    """lista di liste → (offsets, valori) appiattiti"""
+    offsets, flat = [0], []
+    for values in lists:
+        flat.extend(values)
+        offsets.append(len(flat))
+    return offsets, flat
+
+
+def build_index(albums):
+    """albums: iterabile di dict (album_id, title, artist, cover, year, title_slug, songs)"""
+    docs = []
+    postings = defaultdict(set)
+    for album in albums:
+        doc_id = len(docs)
+        docs.append([
+            album["album_id"],
+            album.get("title") or "",
+            album.get("artist") or "",
+            album.get("cover") or "",
+            int(album["year"]) if album.get("year") is not None else None,
+            album.get("title_slug") or "",
+        ])
+        for field, texts in ((FIELD_TITLE, [album.get("title")]),
+                             (FIELD_ARTIST, [album.get("artist")]),
+                             (FIELD_SONG, album.get("songs") or [])):
+            for text in texts:
+                for word in normalize(text):
+                    postings[word].add(field << FIELD_SHIFT | doc_id)
+
+    vocab = sorted(postings)
+    post_off, post = _csr(sorted(postings[w]) for w in vocab)
+
+    gram_words = defaultdict(list)
+    for word_id, word in enumerate(vocab):
+        for g in trigrams(word):
+            gram_words[g].append(word_id)
+    grams = sorted(gram_words)
+    gram_off, gram_post = _csr(gram_words[g] for g in grams)
+
+    return {
+        "v": 1,
+        "version": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "docs": docs,
+        "vocab": vocab,
+        "post_off": _u32(post_off),
+        "post": _u32(post),
+        "grams": grams,
+        "gram_off": _u32(gram_off),
+        "gram_post": _u32(gram_post),
+    }
+
+
+def serialize(index):
+    raw = json.dumps(index, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return gzip.compress(raw, compresslevel=6)
+
+
+def scan_albums():
+    """Scan paginata di AlbumsTable, solo i campi che servono all'indice."""
+    table = dynamodb.Table(ALBUMS_TABLE)
+    fields = ["album_id", "title", "artist", "cover", "year", "title_slug", "songs"]
+    kwargs = {
+        "ProjectionExpression": ", ".join(f"#{f}" for f in fields),   # year è parola riservata
+        "ExpressionAttributeNames": {f"#{f}": f for f in fields},
+    }
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp.get("Items", [])
+        lek = resp.get("LastEvaluatedKey")
+        if not lek:
+            break
+        kwargs["ExclusiveStartKey"] = lek
+
+
+def handler(event, context):
+    t0 = time.time()
+    index = build_index(scan_albums())
+    blob = serialize(index)
+    s3.put_object(
+        Bucket=SEARCH_BUCKET,
+        Key=SEARCH_INDEX_KEY,
+        Body=blob,
+        ContentType="application/json",
+        ContentEncoding="gzip",
+        Metadata={"version": index["version"]},
+    )
+    stats = {
+        "albums": len(index["docs"]),
+        "words": len(index["vocab"]),
+        "bytes": len(blob),
+        "seconds": round(time.time() - t0, 2),
+    }
+    print(f"🔎 Indice di ricerca salvato su s3://{SEARCH_BUCKET}/{SEARCH_INDEX_KEY}: {stats}")
+    return {"statusCode": 200, "body": json.dumps(stats)}
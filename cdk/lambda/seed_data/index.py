@@ -1,6 +1,6 @@
 import boto3
 import os
-from datetime import datetime
+import time
 
 dynamodb = boto3.resource("dynamodb")
 
@@ -32,14 +32,14 @@ def seed_ratings():
             "user_id": "user-123",
             "rating": 5,
             "comment": "Capolavoro assoluto",
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": int(time.time() * 1000)   # numerico: sort key di UserIndex
         },
         {
             "album_id": "a002",
             "user_id": "user-456",
             "rating": 4,
             "comment": "Innovativo e profondo",
-            "timestamp": datetime.utcnow().isoformat()
+            "timestamp": int(time.time() * 1000)   # numerico: sort key di UserIndex
         }
     ]
     for rating in ratings:
@@ -1,86 +1,117 @@
+"""
+ChartsTable → AlbumsTable: anagrafica degli album che compaiono nelle classifiche.
+
+Pipeline per segmento di scan, tutti i segmenti in parallelo (Segment/TotalSegments):
+
+    pagina di scan → album nuovi per questo run → BatchGetItem (blocchi da 100)
+      → confronto con i campi catalogo già in AlbumsTable → update_item solo per i cambiati
+
+Le scritture sono update_item con SET dei soli campi catalogo: ratings_sum,
+ratings_count, ratings_hist_N e average_rating non vengono mai toccati, anche
+se la Lambda ratings li incrementa (ADD) mentre la migrazione gira. Gli album
+già allineati non si riscrivono: updated_at (→ Last-Modified/ETag lato albums)
+cambia solo quando cambia davvero qualcosa. Campi catalogo, confronto e upsert
+sono in album_catalog (lambda/shared), gli stessi della sync dallo stream.
+"""
+import json
 import os
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 
-dynamodb = boto3.resource("dynamodb")
+from album_catalog import BATCH_GET_SIZE, catalog_fields, fetch_existing, same_catalog, upsert_album
+
+CHARTS_TABLE = os.environ["CHARTS_TABLE"]
+ALBUMS_TABLE = os.environ["ALBUMS_TABLE"]
+
+SCAN_SEGMENTS = int(os.getenv("SEED_SCAN_SEGMENTS", "16"))   # = thread del pool
+SCAN_FIELDS = ("album_id", "title", "artist", "release_date", "cover", "songs")
 
-charts_table = dynamodb.Table(os.environ["CHARTS_TABLE"])
-albums_table = dynamodb.Table(os.environ["ALBUMS_TABLE"])
+# I resource boto3 non sono thread-safe: uno per thread del pool (riusato tra invocazioni warm)
+_local = threading.local()
 
-def slugify(s: str) -> str:
-    s = s.lower().strip()
-    s = re.sub(r"[^\w\s-]", "", s)
-    s = re.sub(r"\s+", "-", s)
-    return s
+def _thread_tables():
+    if not hasattr(_local, "resource"):
+        _local.resource = boto3.session.Session().resource("dynamodb")
+        _local.charts = _local.resource.Table(CHARTS_TABLE)
+        _local.albums = _local.resource.Table(ALBUMS_TABLE)
+    return _local.resource, _local.charts, _local.albums
 
-def migrate_charts_to_albums():
-    seen = set()
-    count = 0
-    scan_kwargs = {}
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"pages": 0, "items_scanned": 0, "albums": 0, "duplicates": 0,
+                       "unchanged": 0, "written": 0, "batch_gets": 0}
 
+    def add(self, **deltas):
+        with self.lock:
+            for k, v in deltas.items():
+                self.counts[k] += v
+
+def migrate_segment(segment, total_segments, seen, seen_lock, stats, ts):
+    resource, charts, albums = _thread_tables()
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments,
+                   "ProjectionExpression": ", ".join(f"#{f}" for f in SCAN_FIELDS),
+                   "ExpressionAttributeNames": {f"#{f}": f for f in SCAN_FIELDS}}
     while True:
-        resp = charts_table.scan(**scan_kwargs)
+        resp = charts.scan(**scan_kwargs)
         items = resp.get("Items", [])
-        print(f"📄 Processata pagina con {len(items)} elementi")
 
+        # lo stesso album compare in più anni/regioni: lo prende il primo segmento che lo vede
+        page = {}
         for item in items:
-            album_id = item.get("album_id")
-            if not album_id:
-                continue
-            if album_id in seen:
+            album = catalog_fields(item)
+            if album and album["album_id"] not in page:
+                page[album["album_id"]] = album
+        with seen_lock:
+            fresh = [a for aid, a in page.items() if aid not in seen]
+            seen.update(page)
+
+        existing = fetch_existing(resource, ALBUMS_TABLE, [a["album_id"] for a in fresh]) if fresh else {}
+        written = 0
+        for album in fresh:
+            if same_catalog(album, existing.get(album["album_id"])):
                 continue
-            seen.add(album_id)
-
-            title = (item.get("title") or "").strip()
-            artist = (item.get("artist") or "").strip()
-            release_date = item.get("release_date") or ""
-
-            # tenta a derivare l'anno, ma non scrivere se non disponibile
-            year_val = None
-            if len(release_date) >= 4 and release_date[:4].isdigit():
-                year_val = int(release_date[:4])
-
-            # se esiste già, preserva rating e count
-            existing = albums_table.get_item(Key={"album_id": album_id}).get("Item", {}) or {}
-            avg_existing = existing.get("average_rating", 0)
-            cnt_existing = existing.get("ratings_count", 0)
-
-            album = {
-                "album_id": album_id,
-                "title": title,
-                "title_lower": title.lower(),
-                "title_slug": slugify(title),
-                "artist": artist,
-                "cover": item.get("cover", ""),
-                "genre": item.get("genre", []),
-                "songs": item.get("songs", []),
-                "average_rating": avg_existing if isinstance(avg_existing, (int, float)) else 0,
-                "ratings_count": cnt_existing if isinstance(cnt_existing, int) else 0,
-            }
-            if year_val is not None:
-                album["year"] = year_val  # non inserire se None
-
-            albums_table.put_item(Item=album)
-            count += 1
-            print(f"✅ Inserito/aggiornato album: {artist} – {title} ({album_id})")
-
-        # continua se ci sono altre pagine
+            upsert_album(albums, album, ts)
+            written += 1
+        stats.add(pages=1, items_scanned=len(items), albums=len(fresh), duplicates=len(page) - len(fresh),
+                  unchanged=len(fresh) - written, written=written,
+                  batch_gets=-(-len(fresh) // BATCH_GET_SIZE))
+
         lek = resp.get("LastEvaluatedKey")
-        if lek:
-            scan_kwargs["ExclusiveStartKey"] = lek
-        else:
-            break
+        if not lek:
+            return
+        scan_kwargs["ExclusiveStartKey"] = lek
+
+_executor = ThreadPoolExecutor(max_workers=SCAN_SEGMENTS)
+
+def migrate_charts_to_albums(total_segments=SCAN_SEGMENTS):
+    started = time.time()
+    ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    seen, seen_lock, stats = set(), threading.Lock(), Stats()
+    futures = [_executor.submit(migrate_segment, s, total_segments, seen, seen_lock, stats, ts)
+               for s in range(total_segments)]
+    for f in futures:
+        f.result()   # un segmento fallito fa fallire la migrazione (rilanciarla è idempotente)
 
-    print(f"🎉 {count} album migrati da ChartsTable a AlbumsTable")
-    return count
+    result = dict(stats.counts)
+    seconds = time.time() - started
+    result["seconds"] = round(seconds, 2)
+    result["albums_per_s"] = round(result["albums"] / seconds, 1) if seconds else None
+    print(f"🎉 {result['albums']} album da ChartsTable ({result['items_scanned']} voci, {result['pages']} pagine, "
+          f"{total_segments} segmenti): {result['written']} scritti, {result['unchanged']} invariati "
+          f"in {result['seconds']}s ({result['albums_per_s']} album/s)", flush=True)
+    return result
 
 # 👉 Entry point per Lambda
 def handler(event, context):
     try:
-        count = migrate_charts_to_albums()
+        stats = migrate_charts_to_albums()
         return {
             "statusCode": 200,
-            "body": f"{count} album migrati correttamente"
+            "body": json.dumps({"message": f"{stats['written']} album migrati correttamente", "stats": stats})
         }
     except Exception as e:
         print("❌ Errore:", e)
@@ -0,0 +1,104 @@
+"""
+Campi catalogo degli album derivati dalle voci di ChartsTable, condivisi da
+seed_from_charts (backfill con scan) e charts_sync (stream): stessa
+normalizzazione, stesso confronto, stesso upsert.
+
+Non è una Lambda: il Dockerfile di ognuna delle due lo copia accanto ad app.py
+(build context = lambda/, vedi cdk_stack.py). Niente tabelle né env qui: le
+Lambda passano resource/Table/nome tabella, ognuna con i suoi thread.
+"""
+import re
+import time
+
+from botocore.exceptions import ClientError
+
+BATCH_GET_SIZE = 100   # limite BatchGetItem
+
+# Campi scritti dalla migrazione/sync (e confrontati per decidere se riscrivere)
+CATALOG_FIELDS = ("title", "title_lower", "title_slug", "artist", "artist_lower", "cover", "songs", "year")
+
+def slugify(s: str) -> str:
+    s = s.lower().strip()
+    s = re.sub(r"[^\w\s-]", "", s)
+    s = re.sub(r"\s+", "-", s)
+    return s
+
+def catalog_fields(item):
+    """Voce di classifica → campi catalogo dell'album (None se non è una voce con album_id)."""
+    album_id = (item or {}).get("album_id")
+    if not album_id:
+        return None   # manifest (rank 0), checkpoint di scraper/migrazioni
+    title = (item.get("title") or "").strip()
+    artist = (item.get("artist") or "").strip()
+    release_date = item.get("release_date") or ""
+    album = {
+        "album_id": album_id,
+        "title": title,
+        "title_lower": title.lower(),
+        "title_slug": slugify(title),
+        "artist": artist,
+        "cover": item.get("cover", ""),
+        "songs": item.get("songs", []),
+    }
+    # tenta a derivare l'anno, ma non scrivere se non disponibile
+    if len(release_date) >= 4 and release_date[:4].isdigit():
+        album["year"] = int(release_date[:4])
+    if artist:
+        album["artist_lower"] = artist.lower()  # chiave di ArtistIndex (mai stringa vuota)
+    return album
+
+def same_catalog(album, current):
+    """True se l'album in tabella ha già tutti i campi catalogo della voce."""
+    return album is not None and current is not None and all(album.get(f) == current.get(f)
+                                                             for f in CATALOG_FIELDS)
+
+def fetch_existing(resource, table_name, album_ids):
+    """album_id → campi catalogo attuali, con BatchGetItem (blocchi da 100, retry su UnprocessedKeys)."""
+    names = {f"#{f}": f for f in ("album_id",) + CATALOG_FIELDS}
+    existing = {}
+    for i in range(0, len(album_ids), BATCH_GET_SIZE):
+        request = {table_name: {"Keys": [{"album_id": a} for a in album_ids[i:i + BATCH_GET_SIZE]],
+                                "ProjectionExpression": ", ".join(names),
+                                "ExpressionAttributeNames": names}}
+        backoff = 0.05
+        while request:
+            resp = resource.batch_get_item(RequestItems=request)
+            for it in resp.get("Responses", {}).get(table_name, []):
+                existing[it["album_id"]] = it
+            request = resp.get("UnprocessedKeys") or None
+            if request:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 1.0)
+    return existing
+
+def upsert_album(table, album, ts, fetched_at=None):
+    """
+    SET dei soli campi catalogo: ratings_sum, ratings_count, ratings_hist_N e
+    average_rating non si toccano (i contatori si inizializzano solo se mancano).
+    Con fetched_at (sync dallo stream) l'update è condizionato su chart_fetched_at:
+    False se l'album è già stato aggiornato da una voce più recente.
+    """
+    fields = [f for f in CATALOG_FIELDS if f in album]
+    sets = [f"#{f} = :{f}" for f in fields]
+    sets += ["#updated_at = :updated_at",
+             "#ratings_count = if_not_exists(#ratings_count, :zero)",
+             "#average_rating = if_not_exists(#average_rating, :zero)",
+             "#genre = if_not_exists(#genre, :genre)"]
+    names = {f"#{f}": f for f in fields + ["updated_at", "ratings_count", "average_rating", "genre"]}
+    values = {f":{f}": album[f] for f in fields}
+    values.update({":updated_at": ts, ":zero": 0, ":genre": []})
+    kwargs = {}
+    if fetched_at is not None:
+        sets.append("#chart_fetched_at = :fetched_at")
+        names["#chart_fetched_at"] = "chart_fetched_at"
+        values[":fetched_at"] = fetched_at
+        kwargs["ConditionExpression"] = ("attribute_not_exists(#chart_fetched_at) "
+                                         "OR #chart_fetched_at <= :fetched_at")
+    try:
+        table.update_item(Key={"album_id": album["album_id"]}, UpdateExpression="SET " + ", ".join(sets),
+                          ExpressionAttributeNames=names, ExpressionAttributeValues=values, **kwargs)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return False
+        raise
@@ -1,34 +1,289 @@
-import boto3
-import os
+"""
+Iscrizione in blocco degli utenti al topic SNS delle notifiche like.
+
+    scan parallela di UsersTable (Segment/TotalSegments, pagine da PAGE_SIZE)
+      → solo utenti con email non ancora iscritti a questo topic
+      → sns.subscribe su un pool di thread limitato (SUBSCRIBE_WORKERS) e a rate
+        limitato (SUBSCRIBE_RATE/s, Subscribe ha una quota per account)
+      → stato dell'iscrizione sull'item utente (sns_topic_arn, sns_endpoint,
+        sns_subscription_arn, sns_subscribed_at)
+
+Idempotente: gli utenti già iscritti (da un run precedente o da post_confirmation,
+che scrive lo stesso stato) vengono scartati dal FilterExpression della scan.
+Le iscrizioni già presenti sul topic (utenti di prima di questo stato) si leggono
+con ListSubscriptionsByTopic e si registrano senza richiamare subscribe: per una
+email non ancora confermata SNS rimanderebbe la mail di conferma. La lista si legge
+una volta per run e si salva (compressa, a blocchi) accanto al checkpoint: le
+invocazioni che riprendono il run la rileggono da lì invece di ripaginare il topic.
+
+Ripartibile: dopo ogni pagina completata il LastEvaluatedKey del segmento va
+nell'item di checkpoint (in UsersTable, senza email: la scan lo ignora). Vicino
+al timeout Lambda i segmenti si fermano e il run continua all'invocazione
+successiva; si rilancia finché la risposta non ha "done": true. Un run finito
+non blocca i successivi: rilanciato, ne parte uno nuovo che tocca solo gli utenti
+arrivati (o falliti) nel frattempo. {"restart": true} scarta un run interrotto.
+"""
+import base64
 import json
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-sns = boto3.client("sns")
-dynamodb = boto3.resource("dynamodb")
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 USERS_TABLE = os.environ["USERS_TABLE"]
 TOPIC_ARN = os.environ["SNS_TOPIC_ARN"]
 
-def handler(event, context):
-    print("Evento ricevuto:", event)
+SCAN_SEGMENTS = int(os.getenv("SUBSCRIBE_SCAN_SEGMENTS", "8"))
+WORKERS = int(os.getenv("SUBSCRIBE_WORKERS", "16"))
+RATE = float(os.getenv("SUBSCRIBE_RATE", "80"))      # subscribe/s, 0 = senza limite
+PAGE_SIZE = int(os.getenv("SUBSCRIBE_PAGE_SIZE", "500"))
+TIME_MARGIN_MS = 30_000   # i segmenti si fermano (col checkpoint salvato) prima del timeout
+
+CHECKPOINT_KEY = {"user_id": "JOB#sns-subscribe"}
+DONE = "done"
+KNOWN_CHUNK = 1000   # iscrizioni già sul topic per item (compresse: ben sotto i 400 KB di un item)
+
+# client thread-safe, condiviso dal pool; retry adattivi sui throttling di SNS
+sns = boto3.client("sns", config=Config(max_pool_connections=WORKERS + SCAN_SEGMENTS,
+                                        retries={"mode": "adaptive", "max_attempts": 8}))
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(USERS_TABLE)
+
+# I resource boto3 non sono thread-safe: uno per thread (riusato tra invocazioni warm)
+_local = threading.local()
+
+def _thread_table():
+    if not hasattr(_local, "table"):
+        _local.table = boto3.session.Session().resource("dynamodb").Table(USERS_TABLE)
+    return _local.table
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class RateLimiter:
+    """Token bucket condiviso dai thread del pool (rate <= 0: nessun limite)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(1, int(burst or rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Stats:
+    def __init__(self, initial=None):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int, {k: int(v) for k, v in (initial or {}).items()})
 
-    table = dynamodb.Table(USERS_TABLE)
-    resp = table.scan()
-    users = resp.get("Items", [])
+    def add(self, **deltas):
+        with self.lock:
+            for k, v in deltas.items():
+                self.counts[k] += v
 
-    subscribed = []
-    for user in users:
-        email = user.get("email")
-        if not email:
-            continue
 
-        sns.subscribe(
-            TopicArn=TOPIC_ARN,
-            Protocol="email",
-            Endpoint=email
+# -------- Stato delle iscrizioni --------
+def already_done(user, topic_arn=TOPIC_ARN):
+    """Stesso criterio del FilterExpression (ricontrollato lato client)."""
+    email = user.get("email")
+    return not email or (user.get("sns_topic_arn") == topic_arn and user.get("sns_endpoint") == email)
+
+def existing_subscriptions(topic_arn=TOPIC_ARN):
+    """email → SubscriptionArn ("PendingConfirmation" compreso) delle iscrizioni email già sul topic."""
+    found, kwargs = {}, {"TopicArn": topic_arn}
+    while True:
+        resp = sns.list_subscriptions_by_topic(**kwargs)
+        for sub in resp.get("Subscriptions", []):
+            if sub.get("Protocol") == "email":
+                found[sub["Endpoint"].lower()] = sub["SubscriptionArn"]
+        if not resp.get("NextToken"):
+            return found
+        kwargs["NextToken"] = resp["NextToken"]
+
+def record_subscription(users, user_id, email, subscription_arn, topic_arn=TOPIC_ARN):
+    """Stato sull'item utente; non ricrea utenti cancellati né sovrascrive un'email cambiata nel frattempo."""
+    try:
+        users.update_item(
+            Key={"user_id": user_id},
+            UpdateExpression="SET sns_topic_arn = :t, sns_endpoint = :e, sns_subscription_arn = :a, "
+                             "sns_subscribed_at = :ts",
+            ConditionExpression="email = :e",
+            ExpressionAttributeValues={":t": topic_arn, ":e": email, ":a": subscription_arn, ":ts": _now()},
         )
-        subscribed.append(email)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+class Job:
+    def __init__(self, total_segments, remaining_ms, known, stats):
+        self.total_segments = total_segments
+        self.remaining_ms = remaining_ms
+        self.known = known                      # iscrizioni già presenti sul topic
+        self.stats = stats
+        self.limiter = RateLimiter(RATE)
+        self.pool = ThreadPoolExecutor(max_workers=WORKERS)   # limita le subscribe in volo
+        self.stopped = threading.Event()
+
+    def subscribe_user(self, user):
+        users = _thread_table()
+        email = user["email"]
+        arn = self.known.get(email.lower())
+        if arn:
+            self.stats.add(already_on_topic=1)
+        else:
+            self.limiter.acquire()
+            try:
+                arn = sns.subscribe(TopicArn=TOPIC_ARN, Protocol="email", Endpoint=email,
+                                    ReturnSubscriptionArn=False)["SubscriptionArn"]
+            except ClientError as e:
+                # email non valida o throttling oltre i retry: resta da fare, la riprova il prossimo run
+                print(f"Errore iscrizione SNS per {user['user_id']}: {e}")
+                self.stats.add(failed=1)
+                return
+            self.stats.add(subscribed=1)
+        if not record_subscription(users, user["user_id"], email, arn):
+            self.stats.add(changed_meanwhile=1)
+
+    def run_segment(self, segment, cursor):
+        users = _thread_table()
+        scan_kwargs = {
+            "Segment": segment, "TotalSegments": self.total_segments, "Limit": PAGE_SIZE,
+            "ProjectionExpression": "user_id, email, sns_topic_arn, sns_endpoint",
+            "FilterExpression": "attribute_exists(email) AND email <> :empty AND "
+                                "(attribute_not_exists(sns_topic_arn) OR sns_topic_arn <> :t "
+                                "OR attribute_not_exists(sns_endpoint) OR sns_endpoint <> email)",
+            "ExpressionAttributeValues": {":t": TOPIC_ARN, ":empty": ""},
+        }
+        if cursor:
+            scan_kwargs["ExclusiveStartKey"] = json.loads(cursor)
+        while not self.stopped.is_set():
+            resp = users.scan(**scan_kwargs)
+            pending = [u for u in resp.get("Items", []) if not already_done(u)]
+            # la pagina si chiude solo quando tutte le sue subscribe sono finite
+            for f in [self.pool.submit(self.subscribe_user, u) for u in pending]:
+                f.result()
+            self.stats.add(pages=1, scanned=resp.get("ScannedCount", 0), pending=len(pending))
+
+            last_key = resp.get("LastEvaluatedKey")
+            save_cursor(users, segment, json.dumps(last_key) if last_key else DONE, self.stats)
+            if not last_key:
+                return True
+            scan_kwargs["ExclusiveStartKey"] = last_key
+            if self.remaining_ms() < TIME_MARGIN_MS:
+                self.stopped.set()
+        return False
+
+
+# -------- Checkpoint --------
+def load_checkpoint():
+    return table.get_item(Key=CHECKPOINT_KEY, ConsistentRead=True).get("Item")
+
+def _known_key(n):
+    return {"user_id": f"{CHECKPOINT_KEY['user_id']}#known#{n}"}
+
+def save_known(known):
+    """Iscrizioni già sul topic a inizio run → item (senza email, la scan li ignora); ritorna quanti."""
+    emails = sorted(known)
+    chunks = [emails[i:i + KNOWN_CHUNK] for i in range(0, len(emails), KNOWN_CHUNK)]
+    for n, chunk in enumerate(chunks):
+        blob = zlib.compress(json.dumps({e: known[e] for e in chunk}).encode("utf-8"))
+        table.put_item(Item=dict(_known_key(n), known=base64.b64encode(blob).decode("ascii")))
+    return len(chunks)
 
+def load_known(chunks):
+    """Le iscrizioni salvate da save_known; None se mancano (checkpoint di prima, item persi)."""
+    known = {}
+    for n in range(chunks):
+        item = table.get_item(Key=_known_key(n), ConsistentRead=True).get("Item")
+        if not item:
+            return None
+        known.update(json.loads(zlib.decompress(base64.b64decode(item["known"]))))
+    return known
+
+def start_checkpoint(total_segments, known_chunks):
+    item = dict(CHECKPOINT_KEY, topic_arn=TOPIC_ARN, total_segments=total_segments,
+                cursors={str(s): "" for s in range(total_segments)}, stats={},
+                known_chunks=known_chunks, started_at=_now(), done=False)
+    table.put_item(Item=item)
+    return item
+
+def save_cursor(users, segment, cursor, stats):
+    """Cursore del solo segmento (chiavi diverse della mappa: i segmenti non si pestano)."""
+    with stats.lock:
+        snapshot = dict(stats.counts)
+    users.update_item(Key=CHECKPOINT_KEY,
+                      UpdateExpression="SET cursors.#s = :c, stats = :st, updated_at = :ts",
+                      ExpressionAttributeNames={"#s": str(segment)},
+                      ExpressionAttributeValues={":c": cursor, ":st": snapshot, ":ts": _now()})
+
+
+def run(remaining_ms=lambda: float("inf"), restart=False):
+    checkpoint = None if restart else load_checkpoint()
+    if checkpoint and checkpoint.get("topic_arn") != TOPIC_ARN:
+        checkpoint = None   # topic cambiato: si ricomincia (gli utenti iscritti al vecchio non contano)
+    if checkpoint and checkpoint.get("done"):
+        checkpoint = None   # run precedente finito: se ne parte uno nuovo (gli iscritti sono filtrati)
+    known = None
+    if checkpoint:
+        print(f"↪️ Riprendo: {checkpoint['cursors']}")
+        if "known_chunks" in checkpoint:
+            known = load_known(int(checkpoint["known_chunks"]))
+        if known is None:
+            known = existing_subscriptions()
+    else:
+        known = existing_subscriptions()
+        checkpoint = start_checkpoint(SCAN_SEGMENTS, save_known(known))
+
+    total_segments = int(checkpoint["total_segments"])
+    stats = Stats(checkpoint.get("stats"))
+    started = time.time()
+    job = Job(total_segments, remaining_ms, known, stats)
+    todo = {int(s): c for s, c in checkpoint["cursors"].items() if c != DONE}
+    with ThreadPoolExecutor(max_workers=len(todo) or 1) as segments:
+        futures = [segments.submit(job.run_segment, s, c) for s, c in todo.items()]
+        finished = [f.result() for f in futures]
+    job.pool.shutdown()
+
+    done = all(finished)
+    result = dict(stats.counts)
+    if done:
+        table.update_item(Key=CHECKPOINT_KEY, UpdateExpression="SET done = :d, stats = :st, updated_at = :ts",
+                          ExpressionAttributeValues={":d": True, ":st": result, ":ts": _now()})
+    print(f"{'🎉 Iscrizioni completate' if done else '⏸️ Interrotto, rilanciare per continuare'} "
+          f"in {time.time() - started:.1f}s: {result}", flush=True)
+    return {"done": done, "stats": result}
+
+
+def handler(event, context):
+    print("Evento ricevuto:", event)
+    event = event or {}
+    remaining = context.get_remaining_time_in_millis if context else (lambda: float("inf"))
+    result = run(remaining_ms=remaining, restart=bool(event.get("restart")))
     return {
         "statusCode": 200,
-        "body": json.dumps({"subscribed": subscribed})
+        "body": json.dumps(result)
     }
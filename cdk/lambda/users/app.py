@@ -1,7 +1,6 @@
 import json
 import boto3
 import os
-from boto3.dynamodb.conditions import Attr
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table(os.environ["USERS_TABLE"])
@@ -39,21 +38,15 @@ def handler(event, context):
     if http_method == "POST" and path_params.get("album_id"):
         album_id = path_params["album_id"]
 
-        # Se utente non esiste ancora (fallback), lo creo
-        try:
-            table.put_item(
-                Item={"user_id": user_id, "email": email, "favorites": set()},
-                ConditionExpression="attribute_not_exists(user_id)"
-            )
-            print(f"Created user {user_id}")
-        except Exception as e:
-            print("User already exists or error:", e)
-
-        # Aggiorno i preferiti
+        # Aggiorno i preferiti con un solo update (crea l'utente se manca, come lambda/favorites)
+        expr, values = "ADD favorites :a", {":a": set([album_id])}
+        if email:
+            expr += " SET email = if_not_exists(email, :e)"
+            values[":e"] = email
         table.update_item(
             Key={"user_id": user_id},
-            UpdateExpression="ADD favorites :a",
-            ExpressionAttributeValues={":a": set([album_id])},
+            UpdateExpression=expr,
+            ExpressionAttributeValues=values,
         )
 
         return response(200, {"message": f"Album {album_id} aggiunto ai preferiti"})
@@ -0,0 +1,95 @@
+import importlib.util
+import sys
+import threading
+from functools import wraps
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_aws
+from moto.dynamodb.responses import DynamoHandler
+
+LAMBDA_DIR = Path(__file__).resolve().parents[2] / "lambda"
+CONTAINERS_DIR = Path(__file__).resolve().parents[2] / "containers"
+SHARED_DIR = LAMBDA_DIR / "shared"   # moduli copiati nelle immagini di più Lambda
+
+
+def load_lambda(name, filename="app.py"):
+    """Importa il modulo di una Lambda (le cartelle in lambda/ non sono package)."""
+    return _load(LAMBDA_DIR / name / filename, f"lambda_{name}_{Path(filename).stem}", SHARED_DIR)
+
+
+def load_scraper():
+    """Importa lo scraper Spotify (containers/app.py, task Fargate)."""
+    return _load(CONTAINERS_DIR / "app.py", "scraper_app")
+
+
+def load_scoring():
+    """Modulo di scoring delle classifiche, accanto allo scraper."""
+    return _load(CONTAINERS_DIR / "scoring.py", "scraper_scoring")
+
+
+def _load(path, module_name, *extra_dirs):
+    dirs = [str(path.parent)] + [str(d) for d in extra_dirs]
+    sys.path[:0] = dirs
+    try:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for d in dirs:
+            sys.path.remove(d)
+    return module
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """AWS finto in memoria (moto) con credenziali fittizie."""
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        yield
+
+
+def _serialized(fn, lock):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with lock:
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+@pytest.fixture
+def dynamodb(aws, monkeypatch):
+    """DynamoDB finto. Le scritture vengono serializzate come su DynamoDB reale
+    (moto legge il vecchio item e scrive in due passi, non atomici tra thread)."""
+    lock = threading.RLock()
+    for name in ("put_item", "update_item", "delete_item", "batch_write_item", "transact_write_items"):
+        monkeypatch.setattr(DynamoHandler, name, _serialized(getattr(DynamoHandler, name), lock))
+    return boto3.resource("dynamodb")
+
+
+def create_table(dynamodb, name, pk, sk=None, sk_type="S", indexes=()):
+    """indexes: tuple (nome, pk, pk_type, sk, sk_type) per i GSI, proiezione ALL."""
+    keys = [{"AttributeName": pk, "KeyType": "HASH"}]
+    attrs = {pk: "S"}
+    if sk:
+        keys.append({"AttributeName": sk, "KeyType": "RANGE"})
+        attrs[sk] = sk_type
+    gsis = []
+    for index_name, ipk, ipk_type, isk, isk_type in indexes:
+        schema = [{"AttributeName": ipk, "KeyType": "HASH"}]
+        attrs[ipk] = ipk_type
+        if isk:
+            schema.append({"AttributeName": isk, "KeyType": "RANGE"})
+            attrs[isk] = isk_type
+        gsis.append({"IndexName": index_name, "KeySchema": schema, "Projection": {"ProjectionType": "ALL"}})
+    kwargs = {"GlobalSecondaryIndexes": gsis} if gsis else {}
+    return dynamodb.create_table(
+        TableName=name,
+        KeySchema=keys,
+        AttributeDefinitions=[{"AttributeName": k, "AttributeType": t} for k, t in attrs.items()],
+        BillingMode="PAY_PER_REQUEST",
+        **kwargs,
+    )
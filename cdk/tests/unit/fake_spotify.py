@@ -0,0 +1,130 @@
+"""
+Finto Web API Spotify su localhost per i test dello scraper: search, album
+singolo e multiplo, con latenza simulata e 429 (Retry-After) iniettati.
+Registra ogni richiesta (istante di arrivo, path, status).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_album(album_id, year, popularity=50, n_tracks=12):
+    return {
+        "id": album_id,
+        "name": "Album %s" % album_id,
+        "album_type": "album",
+        "release_date": "%d-01-01" % year,
+        "popularity": popularity,
+        "artists": [{"name": "Artist %s" % album_id}],
+        "images": [{"url": "https://img/%s.jpg" % album_id}],
+        "total_tracks": n_tracks,
+    }
+
+
+class FakeSpotify:
+    def __init__(self, latency=0.0, throttle_every=0, retry_after=1, albums_per_year=60, n_tracks=12):
+        self.latency = latency
+        self.throttle_every = throttle_every      # ogni N richieste una risposta 429
+        self.retry_after = retry_after
+        self.albums_per_year = albums_per_year
+        self.n_tracks = n_tracks
+        self.log = []                              # (arrivo, path, status)
+        self.queries = []                          # (path, query string) nello stesso ordine
+        self.in_flight = self.max_in_flight = 0    # richieste servite in contemporanea
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d/v1/" % self.server.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- risposte ---
+    def album(self, album_id):
+        year = int(album_id.split("x")[0])
+        album = fake_album(album_id, year, n_tracks=self.n_tracks)
+        tracks = [{"name": "Track %d" % n} for n in range(self.n_tracks)]
+        album["tracks"] = {"items": tracks[:50], "total": len(tracks), "offset": 0, "limit": 50,
+                           "next": (self.url + "albums/%s/tracks?offset=50&limit=50" % album_id)
+                           if len(tracks) > 50 else None}
+        return album
+
+    def album_tracks(self, album_id, offset, limit):
+        tracks = [{"name": "Track %d" % n} for n in range(self.n_tracks)]
+        page = tracks[offset:offset + limit]
+        nxt = offset + limit < len(tracks)
+        return {"items": page, "total": len(tracks), "offset": offset, "limit": limit,
+                "next": (self.url + "albums/%s/tracks?offset=%d&limit=%d" % (album_id, offset + limit, limit))
+                if nxt else None}
+
+    def search(self, q, market, offset, limit):
+        year = int(q.split(":")[1])
+        # ogni mercato vede gli stessi album in un ordine un po' diverso
+        shift = sum(map(ord, market or "")) % 7
+        # id base-62 come quelli veri (spotipy li valida): "<anno>x<n>"
+        ids = ["%dx%d" % (year, (n + shift) % self.albums_per_year) for n in range(self.albums_per_year)]
+        page = ids[offset:offset + limit]
+        return {"albums": {"items": [fake_album(i, year, popularity=100 - int(i.split("x")[1])) for i in page],
+                           "total": len(ids), "offset": offset, "limit": limit}}
+
+    def respond(self, path, qs):
+        parts = path.strip("/").split("/")[1:]   # senza "v1"
+        if parts == ["search"]:
+            return self.search(qs["q"][0], qs.get("market", [None])[0],
+                               int(qs.get("offset", ["0"])[0]), int(qs.get("limit", ["20"])[0]))
+        if parts == ["albums"]:
+            return {"albums": [self.album(i) for i in qs["ids"][0].split(",")]}
+        if len(parts) == 3 and parts[0] == "albums" and parts[2] == "tracks":
+            return self.album_tracks(parts[1], int(qs.get("offset", ["0"])[0]), int(qs.get("limit", ["50"])[0]))
+        if len(parts) == 2 and parts[0] == "albums":
+            return self.album(parts[1])
+        return None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                arrived = time.monotonic()
+                url = urlparse(self.path)
+                with fake.lock:
+                    n = len(fake.log) + 1
+                    throttle = fake.throttle_every and n % fake.throttle_every == 0
+                    fake.log.append((arrived, url.path, 429 if throttle else 200))
+                    fake.queries.append((url.path, parse_qs(url.query)))
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                try:
+                    self.reply(url, throttle)
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def reply(self, url, throttle):
+                if throttle:
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(fake.retry_after))
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(b'{"error": {"status": 429, "message": "API rate limit exceeded"}}')
+                    return
+                time.sleep(fake.latency)
+                body = fake.respond(url.path, parse_qs(url.query))
+                payload = json.dumps(body if body is not None else {"error": {"status": 404}}).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
@@ -0,0 +1,198 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from .conftest import create_table, load_lambda
+
+ALBUM_INDEXES = (
+    ("TitleLowerIndex", "title_lower", "S", None, None),
+    ("TitleSlugIndex", "title_slug", "S", None, None),
+    ("YearIndex", "year", "N", "title_lower", "S"),
+    ("ArtistIndex", "artist_lower", "S", "year", "N"),
+)
+
+
+@pytest.fixture
+def albums(dynamodb, monkeypatch):
+    table = create_table(dynamodb, "Albums", "album_id", indexes=ALBUM_INDEXES)
+    with table.batch_writer() as batch:
+        for n in range(60):
+            artist = "Artist %d" % (n % 3)
+            title = "Album %02d" % n
+            batch.put_item(Item={
+                "album_id": "a%02d" % n,
+                "title": title,
+                "title_lower": title.lower(),
+                "title_slug": title.lower().replace(" ", "-"),
+                "artist": artist,
+                "artist_lower": artist.lower(),
+                "year": 1990 + n % 4,
+                "cover": "https://img/%d.jpg" % n,
+                "songs": ["song"] * 30,
+                "ratings_sum": n % 5 + 1,
+                "ratings_count": 1,
+            })
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    return load_lambda("albums")
+
+
+def get(app, resource, path_params=None, **params):
+    resp = app.handler({
+        "httpMethod": "GET",
+        "resource": resource,
+        "pathParameters": path_params,
+        "queryStringParameters": params or None,
+    }, None)
+    return resp["statusCode"], json.loads(resp["body"]) if resp.get("body") else None
+
+
+def list_all(app, **params):
+    seen, cursor = [], None
+    while True:
+        page_params = dict(params, **({"cursor": cursor} if cursor else {}))
+        status, body = get(app, "/albums", **page_params)
+        assert status == 200
+        seen += body["items"]
+        cursor = body["next_cursor"]
+        if not cursor:
+            return seen
+
+
+def test_list_is_paginated_and_projected(albums):
+    status, body = get(albums, "/albums", limit="10")
+    assert len(body["items"]) == 10 and body["next_cursor"]
+    assert set(body["items"][0]) <= {"album_id", "title", "artist", "cover", "year",
+                                     "average_rating", "ratings_count"}
+
+    items = list_all(albums, limit="25")
+    assert sorted(i["album_id"] for i in items) == ["a%02d" % n for n in range(60)]
+
+
+# None: indice non ancora passato dallo stack (albums_index_stage)
+@pytest.mark.parametrize("year_index,artist_index", [("YearIndex", "ArtistIndex"), ("YearIndex", None),
+                                                     (None, None)])
+def test_list_filters_use_indexes(albums, monkeypatch, year_index, artist_index):
+    monkeypatch.setattr(albums, "YEAR_INDEX", year_index)
+    monkeypatch.setattr(albums, "ARTIST_INDEX", artist_index)
+    if artist_index:
+        monkeypatch.setattr(albums.albums_table, "scan", None)     # i filtri non devono mai fare scan
+    by_year = list_all(albums, year="1991", limit="4")
+    assert len(by_year) == 15 and {i["year"] for i in by_year} == {1991}
+
+    by_artist = list_all(albums, artist="Artist 1")
+    assert len(by_artist) == 20 and {i["artist"] for i in by_artist} == {"Artist 1"}
+
+    both = list_all(albums, artist="artist 1", year="1993")
+    assert {i["album_id"] for i in both} == {"a%02d" % n for n in range(60) if n % 3 == 1 and n % 4 == 3}
+
+
+def test_list_falls_back_to_scan_while_index_is_creating(albums, monkeypatch):
+    monkeypatch.setattr(albums, "YEAR_INDEX", "YearIndex")
+    monkeypatch.setattr(albums, "ARTIST_INDEX", "ArtistIndex")
+
+    def creating(**kw):
+        raise ClientError({"Error": {"Code": "ValidationException",
+                                     "Message": "Cannot read from backfilling global secondary index"}}, "Query")
+    monkeypatch.setattr(albums.albums_table, "query", creating)
+    assert len(list_all(albums, year="1991", limit="4")) == 15
+    assert len(list_all(albums, artist="Artist 1")) == 20
+
+
+def test_list_rejects_bad_params(albums):
+    assert get(albums, "/albums", year="19x1")[0] == 400
+    assert get(albums, "/albums", cursor="%%%")[0] == 400
+
+
+def test_cache_lru_ttl_and_byte_bound(albums):
+    now = [0.0]
+    cache = albums.LRUCache(max_entries=3, max_bytes=100, clock=lambda: now[0])
+    for k in "abc":
+        cache.put(k, 200, "x" * 10, ttl=10)
+    cache.get("a")                      # "a" diventa la più recente
+    cache.put("d", 200, "x" * 10, ttl=10)
+    assert cache.get("b") is None       # espelle la meno recente
+    assert cache.get("a") == (200, "x" * 10, {})
+
+    cache.put("big", 200, "x" * 90, ttl=10)
+    assert cache.bytes <= 100 and cache.get("big")
+
+    now[0] = 11
+    assert cache.get("big") is None and cache.stats["expired"] == 1
+
+
+def test_album_lookups_are_cached_including_404(albums, monkeypatch):
+    calls = []
+    real_get = albums.albums_table.get_item
+    monkeypatch.setattr(albums.albums_table, "get_item", lambda **kw: calls.append(kw) or real_get(**kw))
+
+    for _ in range(3):
+        assert get(albums, "/albums/{id}", {"id": "a01"})[0] == 200
+        assert get(albums, "/albums/{id}", {"id": "missing"})[0] == 404
+    assert len(calls) == 2
+
+
+def test_cached_counters_carry_their_age(albums, monkeypatch):
+    """Media e voti dalla cache possono essere vecchi fino al TTL: l'header Age lo dichiara."""
+    now = [1000.0]
+    monkeypatch.setattr(albums, "cache", albums.LRUCache(100, 10**6, clock=lambda: now[0]))
+    first = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"}}, None)
+    assert "Age" not in first["headers"]
+
+    albums.albums_table.update_item(Key={"album_id": "a01"},
+                                    UpdateExpression="SET ratings_sum = :s, ratings_count = :c",
+                                    ExpressionAttributeValues={":s": 5, ":c": 1})
+    now[0] += 42
+    hit = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"}}, None)
+    assert hit["headers"]["Age"] == "42" and hit["body"] == first["body"]
+
+    now[0] += albums.CACHE_TTL
+    fresh = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"}}, None)
+    assert "Age" not in fresh["headers"] and json.loads(fresh["body"])["average_rating"] == 5
+
+
+def test_conditional_get_returns_304(albums):
+    albums.albums_table.update_item(Key={"album_id": "a01"}, UpdateExpression="SET updated_at = :t",
+                                    ExpressionAttributeValues={":t": "2025-03-01T03:10:00Z"})
+    first = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"}}, None)
+    etag = first["headers"]["ETag"]
+    assert first["headers"]["Last-Modified"] == "Sat, 01 Mar 2025 03:10:00 GMT"
+    assert "max-age" in first["headers"]["Cache-Control"]
+
+    again = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"},
+                            "headers": {"If-None-Match": etag}}, None)
+    assert again["statusCode"] == 304 and again["body"] == ""
+
+    since = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"},
+                            "headers": {"if-modified-since": "Sun, 02 Mar 2025 00:00:00 GMT"}}, None)
+    assert since["statusCode"] == 304
+
+    changed = albums.handler({"resource": "/albums/{id}", "pathParameters": {"id": "a01"},
+                              "headers": {"If-None-Match": '"stale"'}}, None)
+    assert changed["statusCode"] == 200 and changed["body"]
+
+
+def test_bulk_fetch_preserves_order_and_reports_missing(albums, monkeypatch):
+    ids = ["a%02d" % n for n in range(59, -1, -1)] * 2 + ["nope", "a05"]
+    ids += ["x%d" % n for n in range(150)]   # più di un blocco da 100
+
+    # la prima chiamata lascia metà chiavi non processate
+    real = albums.dynamodb.batch_get_item
+    state = {"first": True}
+
+    def flaky(RequestItems):
+        if state["first"]:
+            state["first"] = False
+            table, req = next(iter(RequestItems.items()))
+            keys = req["Keys"]
+            resp = real(RequestItems={table: dict(req, Keys=keys[:50])})
+            resp["UnprocessedKeys"] = {table: dict(req, Keys=keys[50:])}
+            return resp
+        return real(RequestItems=RequestItems)
+    monkeypatch.setattr(albums.dynamodb, "batch_get_item", flaky)
+
+    status, body = get(albums, "/albums", ids=",".join(ids), fields="title,average_rating")
+    assert status == 200
+    assert [i["album_id"] for i in body["items"]] == ["a%02d" % n for n in range(59, -1, -1)]
+    assert set(body["items"][0]) == {"album_id", "title", "average_rating"}
+    assert body["missing"] == ["nope"] + ["x%d" % n for n in range(150)]
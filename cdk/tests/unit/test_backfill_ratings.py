@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def backfill(dynamodb, monkeypatch):
+    table = create_table(dynamodb, "Ratings", "album_id", "user_id")
+    with table.batch_writer() as batch:
+        for n in range(30):
+            batch.put_item(Item={"album_id": "a%d" % n, "user_id": "u1", "rating": 4,
+                                 "timestamp": "2024-05-01T10:00:%02d.123456" % n})   # seed_data legacy
+        batch.put_item(Item={"album_id": "b1", "user_id": "u1", "rating": 3, "timestamp": "1714557600000"})
+        batch.put_item(Item={"album_id": "b2", "user_id": "u1", "rating": 3})
+        batch.put_item(Item={"album_id": "b3", "user_id": "u2", "rating": 5, "timestamp": 1714557600123})
+    monkeypatch.setenv("RATINGS_TABLE", "Ratings")
+    monkeypatch.setenv("BACKFILL_PAGE_SIZE", "7")
+    return load_lambda("backfill_ratings"), table
+
+
+def test_backfill_makes_every_timestamp_numeric_and_resumes(backfill, monkeypatch):
+    app, table = backfill
+    assert json.loads(app.handler({"max_pages": 2}, None)["body"])["done"] is False
+
+    # una recensione riscritta dalla Lambda ratings mentre il backfill gira non va toccata
+    table.put_item(Item={"album_id": "a29", "user_id": "u1", "rating": 1, "timestamp": 1800000000000})
+    fixed = []
+    real = app.fix_review
+    monkeypatch.setattr(app, "fix_review", lambda item, *a: fixed.append(item["album_id"]) or real(item, *a))
+    body = json.loads(app.handler({}, None)["body"])
+    assert body["done"] is True
+    assert body["stats"]["converted"] + body["stats"]["estimated"] == 31 and body["stats"]["estimated"] == 1
+    assert "b3" not in fixed and "a29" not in fixed
+
+    items = {i["album_id"]: i for i in table.scan()["Items"] if i["album_id"] != app.CHECKPOINT_KEY["album_id"]}
+    assert all(isinstance(i["timestamp"], type(items["b3"]["timestamp"])) for i in items.values())
+    assert items["a0"]["timestamp"] == 1714557600123 and items["a29"]["timestamp"] == 1800000000000
+    assert items["b1"]["timestamp"] == 1714557600000
+    assert items["b2"]["timestamp_backfilled"] is True and "timestamp_backfilled" not in items["a5"]
+
+    assert json.loads(app.handler({}, None)["body"])["done"] is True   # già finito: no-op
@@ -1,5 +1,6 @@
 import aws_cdk as core
 import aws_cdk.assertions as assertions
+import pytest
 
 from cdk.cdk_stack import CdkStack
 
@@ -13,3 +14,25 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+@pytest.mark.parametrize("stage,indexes,env", [
+    (0, [], {}),
+    (1, ["YearIndex"], {}),
+    (2, ["YearIndex", "ArtistIndex"], {"ALBUMS_YEAR_INDEX": "YearIndex"}),
+    (3, ["YearIndex", "ArtistIndex"], {"ALBUMS_YEAR_INDEX": "YearIndex", "ALBUMS_ARTIST_INDEX": "ArtistIndex"}),
+])
+def test_album_list_indexes_roll_out_one_per_deploy(stage, indexes, env):
+    """Ogni stadio aggiunge al più un GSI, e la Lambda vede solo quelli creati dagli stadi precedenti."""
+    template = assertions.Template.from_stack(CdkStack(core.App(context={"albums_index_stage": stage}), "cdk"))
+    tables = template.find_resources("AWS::DynamoDB::Table")
+    albums = next(t for t in tables.values()
+                  if any(k["AttributeName"] == "album_id" for k in t["Properties"]["KeySchema"])
+                  and "TitleLowerIndex" in str(t))
+    names = [g["IndexName"] for g in albums["Properties"]["GlobalSecondaryIndexes"]]
+    assert names == ["TitleLowerIndex", "TitleSlugIndex"] + indexes
+
+    functions = template.find_resources("AWS::Lambda::Function")
+    get_albums = next(f for k, f in functions.items() if k.startswith("GetAlbumsLambda"))
+    variables = get_albums["Properties"]["Environment"]["Variables"]
+    assert {k: v for k, v in variables.items() if k.endswith("_INDEX")} == env
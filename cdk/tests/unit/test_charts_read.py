@@ -0,0 +1,175 @@
+import json
+
+import pytest
+
+import boto3
+
+from .conftest import create_table, load_lambda, load_scraper
+
+
+@pytest.fixture
+def charts(dynamodb, monkeypatch):
+    table = create_table(dynamodb, "Charts", "chart_key", "rank", sk_type="N")
+    with table.batch_writer() as batch:
+        for rank in range(1, 21):
+            batch.put_item(Item={"chart_key": "1999", "rank": rank, "year": 1999,
+                                 "album_id": "a%d" % rank, "title": "Album %d" % rank,
+                                 "artist": "Artist", "fetched_at": "2025-03-01T03:%02d:00Z" % rank})
+            batch.put_item(Item={"chart_key": "1999#EUROPE", "rank": rank, "year": 1999,
+                                 "album_id": "e%d" % rank, "title": "Euro %d" % rank, "artist": "Artist"})
+        batch.put_item(Item={"chart_key": "1999", "rank": 0, "kind": "manifest", "regions": {"GLOBAL", "EUROPE"}})
+        # anno con sole classifiche regionali (dati legacy migrati)
+        batch.put_item(Item={"chart_key": "1975", "rank": 0, "kind": "manifest", "regions": {"US"}})
+        batch.put_item(Item={"chart_key": "1975#US", "rank": 1, "year": 1975, "album_id": "u1",
+                             "title": "Us 1", "artist": "Artist"})
+    monkeypatch.setenv("CHARTS_TABLE", "Charts")
+    return load_lambda("charts_read")
+
+
+def get_chart(app, year, headers=None, region=None):
+    if region:
+        return app.handler({"resource": "/charts/{year}/{region}",
+                            "pathParameters": {"year": year, "region": region}}, None)
+    return app.handler({"resource": "/charts/{year}", "pathParameters": {"year": year},
+                        "headers": headers}, None)
+
+
+def album_ids(resp):
+    return [i["album_id"] for i in json.loads(resp["body"])["items"]]
+
+
+def test_chart_is_sorted_and_cleaned(charts):
+    resp = get_chart(charts, "1999")
+    items = json.loads(resp["body"])["items"]
+    assert [i["rank"] for i in items] == list(range(1, 21))
+    assert all("fetched_at" not in i for i in items)
+
+
+def test_chart_conditional_get(charts):
+    first = get_chart(charts, "1999")
+    assert first["headers"]["Last-Modified"] == "Sat, 01 Mar 2025 03:20:00 GMT"
+    assert "s-maxage" in first["headers"]["Cache-Control"]
+
+    assert get_chart(charts, "1999", {"If-None-Match": first["headers"]["ETag"]})["statusCode"] == 304
+    assert get_chart(charts, "1999", {"If-Modified-Since": first["headers"]["Last-Modified"]})["statusCode"] == 304
+    assert get_chart(charts, "1999", {"If-Modified-Since": "Fri, 28 Feb 2025 00:00:00 GMT"})["statusCode"] == 200
+
+
+def test_regions_and_manifest_without_scan(charts, monkeypatch):
+    queries = []
+    real_query = charts.table.query
+    monkeypatch.setattr(charts.table, "query", lambda **kw: queries.append(kw) or real_query(**kw))
+    monkeypatch.setattr(charts.table, "scan", lambda **kw: pytest.fail("scan su ChartsTable"))
+
+    assert album_ids(get_chart(charts, "1999"))[:2] == ["a1", "a2"]          # niente manifest tra le voci
+    assert album_ids(get_chart(charts, "1999", region="europe"))[:2] == ["e1", "e2"]
+    assert album_ids(get_chart(charts, "1975")) == ["u1"]                     # solo regionale → via manifest
+
+    queries.clear()
+    assert get_chart(charts, "2031")["statusCode"] == 404
+    assert get_chart(charts, "1999", region="ASIA")["statusCode"] == 404
+    assert len(queries) == 2                                                  # una lettura per 404
+
+
+def test_year_range_fans_out_with_limit(charts, monkeypatch):
+    limits = []
+    real_query = charts._query_chart
+    monkeypatch.setattr(charts, "_query_chart",
+                        lambda key, limit=None, tbl=None: limits.append(limit) or real_query(key, limit, tbl))
+
+    resp = charts.handler({"resource": "/charts",
+                           "queryStringParameters": {"from": "1970", "to": "2025", "top": "5"}}, None)
+    body = json.loads(resp["body"])
+    assert [c["year"] for c in body["charts"]] == [1975, 1999]
+    assert [i["rank"] for i in body["charts"][1]["items"]] == [1, 2, 3, 4, 5]
+    assert len(body["missing"]) == 54 and 2025 in body["missing"]
+    assert set(limits) == {5, 6}                 # mai l'intera partizione (6 = top + manifest)
+    assert "ETag" in resp["headers"]
+
+    europe = charts.handler({"resource": "/charts", "queryStringParameters":
+                             {"from": "1999", "to": "1999", "top": "3", "region": "europe"}}, None)
+    assert [i["album_id"] for i in json.loads(europe["body"])["charts"][0]["items"]] == ["e1", "e2", "e3"]
+
+
+@pytest.mark.parametrize("qs", [{"from": "x"}, {"from": "2000", "to": "1990"},
+                                {"from": "1800", "to": "2025"}, {"from": "1990", "top": "500"}])
+def test_year_range_rejects_bad_params(charts, qs):
+    assert charts.handler({"resource": "/charts", "queryStringParameters": qs}, None)["statusCode"] == 400
+
+
+@pytest.fixture
+def snapshots(charts, monkeypatch):
+    """Scraper che pubblica le snapshot + charts_read che le legge."""
+    boto3.client("s3").create_bucket(Bucket="snapshots",
+                                     CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+    for var, value in {"SNAPSHOT_BUCKET": "snapshots", "SPOTIPY_CLIENT_ID": "x",
+                       "SPOTIPY_CLIENT_SECRET": "x"}.items():
+        monkeypatch.setenv(var, value)
+    return load_scraper(), load_lambda("charts_read")
+
+
+def publish(scraper, version, years):
+    docs = {}
+    for year, titles in years.items():
+        items = [{"chart_key": str(year), "rank": rank, "year": year, "album_id": "%d-%d" % (year, rank),
+                  "title": title, "artist": "Artist", "fetched_at": "2025-03-02T03:00:00Z"}
+                 for rank, title in enumerate(titles, start=1)]
+        docs[str(year)] = scraper.write_snapshot(version, year, items)
+    scraper.publish_manifest(version, docs)
+
+
+def test_snapshots_served_without_dynamodb(snapshots, monkeypatch):
+    scraper, app = snapshots
+    publish(scraper, "v1", {1999: ["Snap A", "Snap B"], 2001: ["Only snapshot"]})
+
+    gets = []
+    real_get = app.s3.get_object
+    monkeypatch.setattr(app.s3, "get_object", lambda **kw: gets.append(kw["Key"]) or real_get(**kw))
+    monkeypatch.setattr(app.table, "query", lambda **kw: pytest.fail("query DynamoDB"))
+
+    for _ in range(3):
+        resp = get_chart(app, "1999")
+        assert album_ids(resp) == ["1999-1", "1999-2"]
+    assert resp["headers"]["Last-Modified"] == "Sun, 02 Mar 2025 03:00:00 GMT"
+    assert gets == ["charts/manifest.json", "charts/v1/1999.json.gz"]   # poi tutto dalla cache
+    assert get_chart(app, "1999", {"If-None-Match": resp["headers"]["ETag"]})["statusCode"] == 304
+
+    # nuovo run: la versione del manifest invalida la cache
+    publish(scraper, "v2", {1999: ["New"]})
+    app._snapshots["checked_at"] = None
+    assert album_ids(get_chart(app, "1999")) == ["1999-1"]
+    assert album_ids(get_chart(app, "2001")) == ["2001-1"]                # anno del run precedente
+
+
+def test_same_version_republished_serves_the_new_body(snapshots):
+    """Due shard partiti nello stesso secondo pubblicano la stessa versione: la cache non deve servire il body vecchio."""
+    scraper, app = snapshots
+    publish(scraper, "20250302T030000Z", {1999: ["Shard A"]})
+    first = get_chart(app, "1999")
+    assert album_ids(first) == ["1999-1"] and json.loads(first["body"])["items"][0]["title"] == "Shard A"
+
+    publish(scraper, "20250302T030000Z", {1999: ["Shard B", "Again"]})
+    app._snapshots["checked_at"] = None
+    again = get_chart(app, "1999")
+    assert [i["title"] for i in json.loads(again["body"])["items"]] == ["Shard B", "Again"]
+    assert again["headers"]["ETag"] != first["headers"]["ETag"]
+    assert len(app._snapshots["docs"]) == 1                              # il body sostituito non resta in cache
+
+
+def test_years_without_snapshot_fall_back_to_dynamodb(snapshots):
+    scraper, app = snapshots
+    publish(scraper, "v1", {2001: ["x"]})
+    assert album_ids(get_chart(app, "1999"))[:2] == ["a1", "a2"]
+    assert get_chart(app, "2030")["statusCode"] == 404
+
+
+def test_snapshot_and_dynamodb_bodies_match(snapshots):
+    """Stessa classifica da snapshot e da DynamoDB → stesso body e stesso ETag (JSON canonico)."""
+    scraper, app = snapshots
+    items = [{"title": "Album %d" % rank, "rank": rank, "year": 1999, "album_id": "a%d" % rank,
+              "artist": "Artist", "chart_key": "1999", "fetched_at": "2025-03-01T03:%02d:00Z" % rank}
+             for rank in range(1, 21)]
+    body = scraper.chart_document(list(reversed(items)))
+    from_dynamodb = get_chart(app, "1999")
+    assert from_dynamodb["body"] == body
+    assert from_dynamodb["headers"]["ETag"] == scraper.write_snapshot("v1", 1999, items)["etag"]
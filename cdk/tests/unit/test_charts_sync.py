@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from .conftest import create_table, load_lambda
+
+_serializer = TypeSerializer()
+
+
+def record(seq, event, new=None, old=None):
+    images = {}
+    if new is not None:
+        images["NewImage"] = {k: _serializer.serialize(v) for k, v in new.items()}
+    if old is not None:
+        images["OldImage"] = {k: _serializer.serialize(v) for k, v in old.items()}
+    return {"eventName": event, "dynamodb": dict(images, SequenceNumber=str(seq))}
+
+
+def entry(n, chart_key="2019", fetched_at="2026-01-01T00:00:00Z", **overrides):
+    item = {"chart_key": chart_key, "rank": n, "album_id": "a%d" % n, "title": " Album %d " % n,
+            "artist": "Artist %d" % n, "release_date": "2019-05-01", "cover": "https://img/%d.jpg" % n,
+            "songs": ["s1", "s2"], "fetched_at": fetched_at}
+    item.update(overrides)
+    return item
+
+
+@pytest.fixture
+def sync(dynamodb, monkeypatch):
+    albums = create_table(dynamodb, "Albums", "album_id")
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    return load_lambda("charts_sync"), albums
+
+
+def test_new_entries_become_albums_and_keep_ratings(sync):
+    app, albums = sync
+    albums.put_item(Item={"album_id": "a2", "title": "Old", "ratings_sum": 9, "ratings_count": 2,
+                          "average_rating": Decimal("4.5"), "genre": ["rock"]})
+    resp = app.handler({"Records": [
+        record(100, "INSERT", entry(1)),
+        record(101, "INSERT", entry(1, chart_key="2019#EUROPE")),      # stesso album, una sola scrittura
+        record(102, "INSERT", entry(2)),
+        record(103, "INSERT", {"chart_key": "2019", "rank": 0, "kind": "manifest"}),
+        record(104, "REMOVE", old=entry(3)),
+    ]}, None)
+    assert resp == {"batchItemFailures": []}
+
+    a1 = albums.get_item(Key={"album_id": "a1"})["Item"]
+    assert (a1["title"], a1["title_slug"], a1["artist_lower"], a1["year"]) == ("Album 1", "album-1", "artist 1", 2019)
+    assert (a1["ratings_count"], a1["average_rating"], a1["genre"]) == (0, 0, [])
+    a2 = albums.get_item(Key={"album_id": "a2"})["Item"]
+    assert a2["title"] == "Album 2" and (a2["ratings_sum"], a2["ratings_count"], a2["genre"]) == (9, 2, ["rock"])
+    assert {i["album_id"] for i in albums.scan()["Items"]} == {"a1", "a2"}
+
+
+def test_replays_and_noop_modifies_do_not_write(sync, capsys):
+    app, albums = sync
+    batch = {"Records": [record(1, "INSERT", entry(1)), record(2, "INSERT", entry(2))]}
+    app.handler(batch, None)
+    before = albums.get_item(Key={"album_id": "a1"})["Item"]["updated_at"]
+
+    app.handler(batch, None)                                            # replay dello stream
+    app.handler({"Records": [record(3, "MODIFY", entry(1, fetched_at="2026-02-01T00:00:00Z"),
+                                    old=entry(1))]}, None)              # cambia solo fetched_at
+    out = capsys.readouterr().out
+    assert "'unchanged': 2, 'written': 0" in out and "'skipped': 1, 'albums': 0" in out
+    assert albums.get_item(Key={"album_id": "a1"})["Item"]["updated_at"] == before
+
+
+def test_out_of_order_entry_does_not_roll_back(sync):
+    app, albums = sync
+    new = entry(1, fetched_at="2026-03-01T00:00:00Z", cover="https://img/new.jpg")
+    old = entry(1, fetched_at="2026-01-01T00:00:00Z", cover="https://img/old.jpg")
+    app.handler({"Records": [record(10, "MODIFY", new, old=old)]}, None)
+    app.handler({"Records": [record(5, "INSERT", old)]}, None)          # riconsegnata dopo
+    assert albums.get_item(Key={"album_id": "a1"})["Item"]["cover"] == "https://img/new.jpg"
+
+    # nello stesso batch vince la voce più recente, qualunque sia l'ordine
+    app.handler({"Records": [record(20, "INSERT", entry(2, fetched_at="2026-03-01T00:00:00Z", title="B")),
+                             record(21, "INSERT", entry(2, chart_key="2019#ASIA", title="A"))]}, None)
+    assert albums.get_item(Key={"album_id": "a2"})["Item"]["title"] == "B"
+
+
+def test_failed_upsert_reports_first_sequence_number(sync, monkeypatch):
+    app, albums = sync
+    real = app.upsert_album
+
+    def flaky(table, album, ts, fetched_at=None):
+        if album["album_id"] in ("a2", "a3"):
+            raise RuntimeError("throttled")
+        return real(table, album, ts, fetched_at)
+    monkeypatch.setattr(app, "upsert_album", flaky)
+
+    resp = app.handler({"Records": [record(9, "INSERT", entry(1)), record(1000, "INSERT", entry(3)),
+                                    record(99, "INSERT", entry(2))]}, None)
+    assert resp == {"batchItemFailures": [{"itemIdentifier": "99"}]}
+    assert "Item" in albums.get_item(Key={"album_id": "a1"})
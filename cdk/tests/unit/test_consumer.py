@@ -0,0 +1,125 @@
+import itertools
+import json
+import random
+
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+class FakeSES:
+    """Registra le email inviate; può fallire per alcuni destinatari."""
+
+    def __init__(self, fail_once=()):
+        self.sent = []
+        self.fail_once = set(fail_once)
+
+    def send_email(self, Source, Destination, Message):
+        to = Destination["ToAddresses"][0]
+        if to in self.fail_once:
+            self.fail_once.discard(to)
+            raise RuntimeError("SES throttling")
+        self.sent.append((to, Message["Subject"]["Data"], Message["Body"]["Text"]["Data"]))
+
+
+class FakeSQS:
+    """Coda in memoria che consegna a batch come l'event source Lambda e ripropone i falliti."""
+
+    def __init__(self):
+        self.pending = []
+        self.ids = itertools.count()
+
+    def send_message(self, body):
+        self.pending.append({"messageId": "m%d" % next(self.ids), "body": json.dumps(body)})
+
+    def deliver(self, handler, batch_size):
+        invocations = 0
+        while self.pending:
+            batch, self.pending = self.pending[:batch_size], self.pending[batch_size:]
+            failed = {f["itemIdentifier"] for f in handler({"Records": batch}, None)["batchItemFailures"]}
+            self.pending += [r for r in batch if r["messageId"] in failed]
+            invocations += 1
+        return invocations
+
+
+@pytest.fixture
+def consumer(dynamodb, monkeypatch):
+    users = create_table(dynamodb, "Users", "user_id")
+    for n in range(10):
+        users.put_item(Item={"user_id": "author%d" % n, "email": "author%d@example.com" % n})
+    monkeypatch.setenv("USERS_TABLE", "Users")
+    monkeypatch.setenv("SES_SOURCE_EMAIL", "noreply@example.com")
+    return load_lambda("consumer", "consumer.py")
+
+
+def like_event(author, liker, album="a1"):
+    return {"type": "review_liked", "album_id": album, "review_user_id": author,
+            "liker_id": liker, "liker_email": liker + "@example.com", "ts": 0}
+
+
+def test_digest_coalesces_and_dedupes(consumer, monkeypatch):
+    ses = FakeSES()
+    monkeypatch.setattr(consumer, "ses", ses)
+    queue = FakeSQS()
+
+    rnd = random.Random(7)
+    for _ in range(300):
+        queue.send_message(like_event("author%d" % rnd.randrange(10), "fan%d" % rnd.randrange(40)))
+    queue.send_message({"note": "messaggio non-like"})
+
+    invocations = queue.deliver(consumer.handler, batch_size=500)
+
+    messages_in, sends_out = 301, len(ses.sent)
+    print(f"messages in: {messages_in}, sends out: {sends_out}")
+    assert invocations == 1
+    assert sends_out == 10   # una email per destinatario
+    for to, _, text in ses.sent:
+        # i like duplicati (stesso liker, stessa recensione) compaiono una volta sola
+        lines = [l for l in text.splitlines() if l.startswith("- ")]
+        assert len(lines) == len(set(lines))
+
+
+def test_partial_batch_failure_retries_only_failed_recipient(consumer, monkeypatch):
+    ses = FakeSES(fail_once={"author3@example.com"})
+    monkeypatch.setattr(consumer, "ses", ses)
+    queue = FakeSQS()
+    for n in range(10):
+        queue.send_message(like_event("author%d" % n, "fan"))
+        queue.send_message(like_event("author%d" % n, "other-fan"))
+
+    invocations = queue.deliver(consumer.handler, batch_size=500)
+
+    assert invocations == 2
+    recipients = [to for to, _, _ in ses.sent]
+    assert sorted(recipients) == sorted("author%d@example.com" % n for n in range(10))
+
+
+class FakeContext:
+    """Tempo rimasto che cala a ogni email inviata (timeout simulato)."""
+
+    def __init__(self, ses, budget_ms, per_send_ms):
+        self.ses, self.budget_ms, self.per_send_ms = ses, budget_ms, per_send_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.budget_ms - self.per_send_ms * len(self.ses.sent)
+
+
+def test_digests_left_near_timeout_are_retried_not_resent(consumer, monkeypatch):
+    ses = FakeSES()
+    monkeypatch.setattr(consumer, "ses", ses)
+    queue = FakeSQS()
+    for n in range(10):
+        queue.send_message(like_event("author%d" % n, "fan"))
+
+    # 4 email e poi si è a ridosso del timeout: le altre 6 ripartono nella consegna successiva
+    context = FakeContext(ses, budget_ms=consumer.TIME_MARGIN_MS + 3500, per_send_ms=1000)
+    batch = queue.pending
+    failed = consumer.handler({"Records": batch}, context)["batchItemFailures"]
+    assert len(ses.sent) == 4 and len(failed) == 6
+    sent_to = {to for to, _, _ in ses.sent}
+    retried = [r for r in batch if r["messageId"] in {f["itemIdentifier"] for f in failed}]
+    assert not sent_to & {json.loads(r["body"])["review_user_id"] + "@example.com" for r in retried}
+
+    consumer.handler({"Records": retried}, None)
+    recipients = [to for to, _, _ in ses.sent]
+    assert sorted(recipients) == sorted("author%d@example.com" % n for n in range(10))   # nessun doppio invio
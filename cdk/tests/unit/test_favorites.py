@@ -0,0 +1,95 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def favorites(dynamodb, monkeypatch):
+    users = create_table(dynamodb, "Users", "user_id")
+    albums = create_table(dynamodb, "Albums", "album_id")
+    with albums.batch_writer() as batch:
+        for n in range(150):
+            batch.put_item(Item={"album_id": "a%03d" % n, "title": "Album %d" % n, "artist": "Artist",
+                                 "cover": "https://img/%d.jpg" % n, "year": 2000, "songs": ["s"] * 20,
+                                 "ratings_sum": 9, "ratings_count": 2})
+        # album legacy: media salvata, niente ratings_sum
+        batch.put_item(Item={"album_id": "legacy", "title": "Old", "artist": "Artist", "year": 1990,
+                             "average_rating": Decimal("3.75"), "ratings_count": 4})
+        batch.put_item(Item={"album_id": "unrated", "title": "New", "artist": "Artist", "year": 2020})
+    monkeypatch.setenv("USERS_TABLE", "Users")
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    return load_lambda("favorites"), users
+
+
+def call(app, method, album_id=None, sub="u1", **params):
+    resp = app.handler({
+        "httpMethod": method,
+        "pathParameters": {"album_id": album_id} if album_id else None,
+        "queryStringParameters": params or None,
+        "requestContext": {"authorizer": {"claims": {"sub": sub, "email": "u1@example.com"}}},
+    }, None)
+    return resp["statusCode"], json.loads(resp["body"])
+
+
+def test_add_and_remove_are_single_writes(favorites, monkeypatch):
+    app, users = favorites
+    users.put_item(Item={"user_id": "u1", "email": "old@example.com", "sns_topic_arn": "t"})
+    calls = []
+    for name in ("put_item", "update_item"):
+        real = getattr(app.table, name)
+        monkeypatch.setattr(app.table, name, lambda real=real, name=name, **kw: calls.append(name) or real(**kw))
+
+    assert call(app, "POST", "a001")[0] == 200
+    assert call(app, "POST", "a002")[0] == 200
+    assert call(app, "DELETE", "a001")[0] == 200
+    assert calls == ["update_item"] * 3
+    user = users.get_item(Key={"user_id": "u1"})["Item"]
+    assert user["favorites"] == {"a002"} and user["email"] == "old@example.com" and user["sns_topic_arn"] == "t"
+
+    call(app, "DELETE", "a002")
+    assert "favorites" not in users.get_item(Key={"user_id": "u1"})["Item"]
+
+    # utente nuovo: creato dallo stesso update
+    call(app, "POST", "a003", sub="u2")
+    assert users.get_item(Key={"user_id": "u2"})["Item"] == {"user_id": "u2", "email": "u1@example.com",
+                                                             "favorites": {"a003"}}
+
+
+def test_get_is_hydrated_and_paginated(favorites, monkeypatch):
+    app, users = favorites
+    ids = ["a%03d" % n for n in range(0, 150, 2)] + ["gone"]
+    users.put_item(Item={"user_id": "u1", "favorites": set(ids)})
+    batch_calls = []
+    real = app.dynamodb.batch_get_item
+    monkeypatch.setattr(app.dynamodb, "batch_get_item",
+                        lambda **kw: batch_calls.append(len(kw["RequestItems"]["Albums"]["Keys"])) or real(**kw))
+
+    status, page = call(app, "GET", limit="30")
+    assert status == 200 and page["total"] == 76 and batch_calls == [30]
+    first = page["items"][0]
+    assert first == {"album_id": "a000", "title": "Album 0", "artist": "Artist", "cover": "https://img/0.jpg",
+                     "year": 2000, "average_rating": 4.5}
+
+    seen, missing = [i["album_id"] for i in page["items"]], []
+    call(app, "POST", "a001")                                          # aggiunta prima del cursor: non sposta le pagine
+    while page["next_cursor"]:
+        status, page = call(app, "GET", limit="30", cursor=page["next_cursor"])
+        seen += [i["album_id"] for i in page["items"]]
+        missing += page["missing"]
+    assert seen == sorted(ids[:-1]) and missing == ["gone"]
+
+    assert call(app, "GET", sub="nobody") == (200, {"items": [], "missing": [], "total": 0, "next_cursor": None})
+    assert call(app, "GET", limit="x")[0] == 400 and call(app, "GET", cursor="%%%")[0] == 400
+
+
+def test_legacy_albums_keep_their_average(favorites):
+    app, users = favorites
+    users.put_item(Item={"user_id": "u1", "favorites": {"a000", "legacy", "unrated"}})
+    status, page = call(app, "GET")
+    assert status == 200
+    assert {i["album_id"]: i["average_rating"] for i in page["items"]} == {"a000": 4.5, "legacy": 3.75,
+                                                                           "unrated": 0}
+    assert not any("ratings_sum" in i or "ratings_count" in i for i in page["items"])
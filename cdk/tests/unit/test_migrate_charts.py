@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def charts(dynamodb, monkeypatch):
+    table = create_table(dynamodb, "Charts", "chart_key", "rank", sk_type="N")
+    with table.batch_writer() as batch:
+        for year in range(1970, 1980):
+            for region in ("europe", "US"):
+                for rank in range(1, 6):
+                    batch.put_item(Item={"chart_key": "%d#%s" % (year, region), "rank": rank,
+                                         "region": region, "album_id": "%d-%s-%d" % (year, region, rank)})
+        for rank in range(1, 6):
+            batch.put_item(Item={"chart_key": "1999", "rank": rank, "album_id": "g%d" % rank})
+    monkeypatch.setenv("CHARTS_TABLE", "Charts")
+    monkeypatch.setenv("MIGRATION_PAGE_SIZE", "7")
+    app = load_lambda("migrate_charts")
+    app.table = table
+    return app
+
+
+def all_items(table):
+    items, kwargs = [], {}
+    while True:
+        resp = table.scan(**kwargs)
+        items += resp["Items"]
+        if "LastEvaluatedKey" not in resp:
+            return items
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def test_migration_is_resumable_and_idempotent(charts, monkeypatch):
+    # primo giro: si interrompe dopo 3 pagine, poi "crash" a metà della quarta
+    assert json.loads(charts.handler({"max_pages": 3}, None)["body"])["done"] is False
+
+    real_page = charts.migrate_page
+    def crash(items, stats):
+        real_page(items[:3], stats)
+        raise RuntimeError("Lambda interrotta")
+    monkeypatch.setattr(charts, "migrate_page", crash)
+    with pytest.raises(RuntimeError):
+        charts.handler({}, None)
+    monkeypatch.setattr(charts, "migrate_page", real_page)
+
+    runs = 0
+    while not json.loads(charts.handler({"max_pages": 5}, None)["body"])["done"]:
+        runs += 1
+        assert runs < 50
+
+    items = all_items(charts.table)
+    keys = {i["chart_key"] for i in items}
+    assert not any(k.endswith("#europe") for k in keys)
+    assert {"1975#EUROPE", "1975#US"} <= keys
+    assert all("region" not in i for i in items)
+
+    entries = [i for i in items if i.get("album_id")]
+    assert len(entries) == 10 * 2 * 5 + 5                      # niente persi, niente duplicati
+
+    manifests = {i["chart_key"]: i["regions"] for i in items if i.get("kind") == "manifest"}
+    assert manifests["1975"] == {"EUROPE", "US"}
+    assert manifests["1999"] == {"GLOBAL"}
+
+    # rilanciata a migrazione finita non fa nulla
+    assert json.loads(charts.handler({}, None)["body"])["done"] is True
@@ -0,0 +1,239 @@
+import json
+import random
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def ratings(dynamodb, monkeypatch):
+    create_table(dynamodb, "Ratings", "album_id", "user_id",
+                 indexes=[("UserIndex", "user_id", "S", "timestamp", "N")])
+    create_table(dynamodb, "Albums", "album_id")
+    create_table(dynamodb, "Likes", "review_id", "liker_id")
+    monkeypatch.setenv("RATINGS_TABLE", "Ratings")
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    monkeypatch.setenv("LIKES_TABLE", "Likes")
+    monkeypatch.setenv("QUEUE_URL", boto3.client("sqs").create_queue(QueueName="AppQueue")["QueueUrl"])
+    return load_lambda("ratings")
+
+
+def post_review(app, album_id, user_id, rating):
+    return app.handler({
+        "httpMethod": "POST",
+        "resource": "/ratings/{album_id}",
+        "pathParameters": {"album_id": album_id},
+        "requestContext": {"authorizer": {"claims": {"sub": user_id}}},
+        "body": json.dumps({"rating": rating, "comment": "ok"}),
+    }, None)
+
+
+def test_rereview_applies_delta(ratings):
+    post_review(ratings, "a1", "u1", 2)
+    post_review(ratings, "a1", "u2", 4)
+    post_review(ratings, "a1", "u1", 5)
+
+    album = ratings.albums_table.get_item(Key={"album_id": "a1"})["Item"]
+    assert album["ratings_count"] == 2
+    assert album["ratings_sum"] == 9
+
+
+def test_review_and_aggregate_fail_together(ratings):
+    post_review(ratings, "a1", "u1", 2)
+    # contatore corrotto: l'ADD sull'album fallisce → la recensione non deve cambiare
+    ratings.albums_table.update_item(Key={"album_id": "a1"}, UpdateExpression="SET ratings_sum = :s",
+                                     ExpressionAttributeValues={":s": "broken"})
+    assert post_review(ratings, "a1", "u1", 5)["statusCode"] == 500
+    assert ratings.ratings_table.get_item(Key={"album_id": "a1", "user_id": "u1"})["Item"]["rating"] == 2
+
+    # album sistemato, il client ritenta: il delta 2 → 5 si applica una volta sola
+    ratings.albums_table.update_item(Key={"album_id": "a1"}, UpdateExpression="SET ratings_sum = :s",
+                                     ExpressionAttributeValues={":s": 2})
+    assert post_review(ratings, "a1", "u1", 5)["statusCode"] == 201
+    assert post_review(ratings, "a1", "u1", 5)["statusCode"] == 201          # retry dopo un successo
+    album = ratings.albums_table.get_item(Key={"album_id": "a1"})["Item"]
+    assert (album["ratings_sum"], album["ratings_count"], album["ratings_hist_5"], album["ratings_hist_2"]) == \
+        (5, 1, 1, 0)
+
+
+def test_legacy_album_keeps_its_average(ratings):
+    # album di prima dei contatori: solo media e conteggio
+    ratings.albums_table.put_item(Item={"album_id": "old", "average_rating": Decimal("4.0"), "ratings_count": 10})
+    post_review(ratings, "old", "u1", 4)
+    post_review(ratings, "old", "u2", 1)
+    post_review(ratings, "old", "u1", 5)                               # ri-recensione: solo il delta
+
+    album = ratings.albums_table.get_item(Key={"album_id": "old"})["Item"]
+    assert (album["ratings_sum"], album["ratings_count"]) == (46, 12)
+    status, body = get_reviews(ratings, "old")
+    assert status == 200 and body["ratings_count"] == 12 and body["average_rating"] == pytest.approx(46 / 12)
+    assert body["histogram"] is None      # 10 voti legacy senza recensioni in RatingsTable: non ricostruibile
+
+
+def test_legacy_histogram_is_rebuilt_from_reviews(ratings):
+    # album legacy le cui recensioni sono tutte in RatingsTable
+    for n, r in enumerate([5, 5, 4, 2]):
+        ratings.ratings_table.put_item(Item={"album_id": "old", "user_id": "v%d" % n, "rating": r, "timestamp": n})
+    ratings.albums_table.put_item(Item={"album_id": "old", "average_rating": Decimal("4.0"), "ratings_count": 4})
+    post_review(ratings, "old", "v3", 3)                               # ri-recensione legacy 2 → 3
+    post_review(ratings, "old", "new", 1)
+
+    body = get_reviews(ratings, "old")[1]
+    assert body["ratings_count"] == 5 and body["average_rating"] == pytest.approx(3.6)
+    assert body["histogram"] == {"1": 1, "2": 0, "3": 1, "4": 1, "5": 2}
+
+
+def test_concurrent_reviews_are_exact(ratings):
+    rnd = random.Random(42)
+    # 300 POST in parallelo, con ri-recensioni degli stessi utenti
+    calls = [("u%d" % rnd.randrange(120), rnd.randint(1, 5)) for _ in range(300)]
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(lambda c: post_review(ratings, "hot", *c), calls))
+    assert all(r["statusCode"] == 201 for r in results)
+
+    album = ratings.albums_table.get_item(Key={"album_id": "hot"})["Item"]
+    reviews = ratings.ratings_table.scan()["Items"]
+    assert album["ratings_count"] == len(reviews) == len({u for u, _ in calls})
+    assert album["ratings_sum"] == sum(r["rating"] for r in reviews)
+
+
+def get_reviews(app, album_id, **params):
+    resp = app.handler({
+        "httpMethod": "GET",
+        "resource": "/ratings/{album_id}",
+        "pathParameters": {"album_id": album_id},
+        "queryStringParameters": params or None,
+    }, None)
+    return resp["statusCode"], json.loads(resp["body"])
+
+
+def test_get_paginates_with_cursor_and_summary(ratings):
+    for n in range(45):
+        post_review(ratings, "a1", "u%02d" % n, n % 5 + 1)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": "20"}
+        if cursor:
+            params["cursor"] = cursor
+        status, body = get_reviews(ratings, "a1", **params)
+        assert status == 200
+        assert all("liked_by" not in r for r in body["reviews"])
+        seen += [r["user_id"] for r in body["reviews"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+
+    assert sorted(seen) == ["u%02d" % n for n in range(45)]
+    assert body["ratings_count"] == 45
+    assert body["average_rating"] == 3
+    assert body["histogram"] == {str(n): 9 for n in range(1, 6)}
+
+
+def test_get_rejects_bad_cursor(ratings):
+    status, _ = get_reviews(ratings, "a1", cursor="not-a-cursor")
+    assert status == 400
+
+
+def test_user_reviews_come_from_the_index_newest_first(ratings, monkeypatch):
+    for n in range(25):
+        post_review(ratings, "a%02d" % n, "me", n % 5 + 1)
+        post_review(ratings, "a%02d" % n, "other", 3)
+    monkeypatch.setattr(ratings.ratings_table, "scan", None)          # niente scan sul percorso profilo
+
+    def get_user(user_id, **params):
+        resp = ratings.handler({"httpMethod": "GET", "resource": "/users/{user_id}/ratings",
+                                "pathParameters": {"user_id": user_id},
+                                "queryStringParameters": params or None}, None)
+        return resp["statusCode"], json.loads(resp["body"])
+
+    seen, params = [], {"limit": "10"}
+    while True:
+        status, body = get_user("me", **params)
+        assert status == 200 and all(r["user_id"] == "me" for r in body["reviews"])
+        seen += body["reviews"]
+        if not body["next_cursor"]:
+            break
+        params["cursor"] = body["next_cursor"]
+    assert [r["album_id"] for r in seen] == ["a%02d" % n for n in reversed(range(25))]
+    assert set(seen[0]) == {"album_id", "user_id", "timestamp", "rating", "comment", "likes"}
+
+    first = get_user("me", limit="10")[1]["next_cursor"]
+    assert get_user("other", cursor=first)[0] == 400                    # cursor di un altro utente
+    assert get_user("nobody") == (200, {"reviews": [], "next_cursor": None})
+
+
+def like(app, album_id, review_user_id, liker_id):
+    return app.handler({
+        "httpMethod": "POST",
+        "resource": "/ratings/{album_id}/{review_user_id}/like",
+        "pathParameters": {"album_id": album_id, "review_user_id": review_user_id},
+        "requestContext": {"authorizer": {"claims": {"sub": liker_id, "email": liker_id + "@example.com"}}},
+    }, None)["statusCode"]
+
+
+def test_like_enqueues_notification_event(ratings):
+    post_review(ratings, "a1", "author", 4)
+    assert like(ratings, "a1", "author", "fan") == 200
+
+    msgs = boto3.client("sqs").receive_message(QueueUrl=ratings.QUEUE_URL).get("Messages", [])
+    assert len(msgs) == 1
+    event = json.loads(msgs[0]["Body"])
+    assert event["type"] == "review_liked"
+    assert (event["album_id"], event["review_user_id"], event["liker_email"]) == ("a1", "author", "fan@example.com")
+
+
+def test_like_is_idempotent_and_counted(ratings):
+    post_review(ratings, "a1", "author", 4)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        codes = list(pool.map(lambda n: like(ratings, "a1", "author", "fan%d" % (n % 50)), range(200)))
+    assert codes.count(200) == 50
+    assert codes.count(409) == 150
+    assert like(ratings, "a1", "missing", "fan1") == 404
+
+    review = ratings.ratings_table.get_item(Key={"album_id": "a1", "user_id": "author"})["Item"]
+    assert review["likes"] == 50
+    assert "liked_by" not in review
+
+
+def test_like_respects_legacy_liked_by(ratings):
+    ratings.ratings_table.put_item(Item={
+        "album_id": "a1", "user_id": "author", "rating": 3, "likes": 1, "liked_by": ["old-fan"],
+    })
+    assert like(ratings, "a1", "author", "old-fan") == 409
+    assert like(ratings, "a1", "author", "new-fan") == 200
+
+
+def test_batch_liked_lookup(ratings):
+    for u in ("r1", "r2", "r3"):
+        post_review(ratings, "a1", u, 5)
+    like(ratings, "a1", "r1", "me")
+    like(ratings, "a1", "r3", "me")
+    like(ratings, "a1", "r2", "someone-else")
+
+    resp = ratings.handler({
+        "httpMethod": "GET",
+        "resource": "/ratings/{album_id}/likes",
+        "pathParameters": {"album_id": "a1"},
+        "queryStringParameters": {"reviews": "r1,r2,r3"},
+        "requestContext": {"authorizer": {"claims": {"sub": "me"}}},
+    }, None)
+    assert json.loads(resp["body"]) == {"liked": ["r1", "r3"]}
+
+
+def test_batch_liked_lookup_includes_legacy_liked_by(ratings):
+    ratings.ratings_table.put_item(Item={"album_id": "a1", "user_id": "old", "rating": 3, "likes": 1,
+                                         "liked_by": ["me"]})
+    post_review(ratings, "a1", "new", 4)
+    like(ratings, "a1", "new", "me")
+    post_review(ratings, "a1", "none", 2)
+
+    authors = ["old", "new", "none"] + ["ghost%d" % n for n in range(120)]   # più blocchi da 50
+    assert ratings.liked_reviews("a1", authors, "me") == ["old", "new"]
+    assert like(ratings, "a1", "old", "me") == 409                   # coerente col bottone già attivo
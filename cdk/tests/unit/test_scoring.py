@@ -0,0 +1,71 @@
+import numpy as np
+
+from .conftest import load_scoring
+
+
+def album(aid, artist="Artist", title=None):
+    return load_scoring().Candidate.from_album({"id": aid, "name": title or "Album %s" % aid,
+                                                "artists": [{"name": artist}], "images": [{"url": "u"}],
+                                                "available_markets": ["IT"] * 180})
+
+
+def observations(rows):
+    """rows: (album_id, [(mercato, segnale), ...])"""
+    return [(m, album(aid), signal) for aid, seen in rows for m, signal in seen]
+
+
+def test_aggregate_counts_sums_and_coverage():
+    scoring = load_scoring()
+    agg = scoring.aggregate([
+        ("IT", album("a"), 80), ("IT", album("b"), 40), ("FR", album("a"), 60),
+        ("FR", album("a"), 70),   # stesso album due volte nello stesso mercato (es. ricerca tracce)
+        ("US", album("c"), None),
+    ])
+    assert agg.ids == ["a", "b", "c"] and agg.n_markets == 3
+    # del payload restano solo i campi della classifica, senza __dict__
+    c = agg.candidates[0]
+    assert (c.id, c.title, c.artist, c.cover) == ("a", "Album a", "Artist", "u") and not hasattr(c, "__dict__")
+    assert agg.sums.tolist() == [210, 40, 0]
+    assert agg.counts.tolist() == [3, 1, 1]
+    assert agg.markets_hit.tolist() == [2, 1, 1]
+
+
+def test_weightings_trade_off_mean_against_coverage():
+    scoring = load_scoring()
+    markets = ["US", "GB", "DE", "FR", "IT"]
+    agg = scoring.aggregate(observations([
+        ("niche", [("IT", 85)]),                         # il più alto, ma in un solo mercato
+        ("global", [(m, 80) for m in markets]),
+        ("mid", [(m, 60) for m in markets[:3]]),
+    ]))
+    top = {name: [c.id for c, _ in scoring.rank(agg, 3, name)] for name in scoring.WEIGHTINGS}
+    assert top["mean"] == ["niche", "global", "mid"]
+    assert top["coverage"] == ["global", "mid", "niche"]
+    assert top["bayesian"][0] == "global"
+    np.testing.assert_allclose(scoring.bayesian_score(agg, prior_weight=0), scoring.mean_score(agg))
+
+    # pesatura esterna: basta una funzione Aggregate → array
+    assert scoring.rank(agg, 1, lambda a: -a.sums)[0][0].id == "niche"   # somma più bassa
+
+
+def test_top_k_is_stable_and_skips_duplicates():
+    scoring = load_scoring()
+    scores = np.array([5.0, 9.0, 5.0, 7.0, 9.0, 1.0])
+    assert scoring.top_k(scores, 4) == [1, 4, 3, 0]                   # pari merito: vince la riga prima
+    assert scoring.top_k(scores, 4, key=lambda row: row % 3) == [1, 3, 2]   # 4 e 0 duplicano 1 e 3
+    assert scoring.top_k(scores[:0], 3) == []
+
+    rng = np.random.default_rng(7)
+    many = rng.integers(0, 50, size=2000).astype(float)
+    assert scoring.top_k(many, 25) == sorted(range(2000), key=lambda i: (-many[i], i))[:25]
+
+
+def test_rank_dedups_same_record_released_twice():
+    scoring = load_scoring()
+    agg = scoring.aggregate([
+        ("IT", album("x1", "Band", "Record"), 90),
+        ("FR", album("x2", "band", "RECORD"), 85),        # stessa uscita, id diverso per mercato
+        ("FR", album("y", "Other", "Other"), 70),
+    ])
+    ranked = scoring.rank(agg, 2, "mean", key=lambda c: (c.artist.lower(), c.title.lower()))
+    assert [c.id for c, _ in ranked] == ["x1", "y"]
@@ -0,0 +1,339 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import boto3
+import pytest
+from spotipy import Spotify
+
+from .conftest import CONTAINERS_DIR, create_table, load_scraper
+from .fake_spotify import FakeSpotify
+
+# Un processo = un task Fargate: scraper con Spotify puntato sul server finto, summary JSON sull'ultima riga
+SHARD_DRIVER = """
+import importlib.util, json, os, sys
+from spotipy import Spotify
+sys.path.insert(0, os.path.dirname(sys.argv[1]))   # scoring.py accanto ad app.py, come nell'immagine
+spec = importlib.util.spec_from_file_location("scraper_app", sys.argv[1])
+scraper = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(scraper)
+scraper.sp = Spotify(auth="fake-token", requests_session=scraper.http_session())
+scraper.sp.prefix = sys.argv[2]
+print(json.dumps(scraper.main()))
+"""
+
+
+@pytest.fixture
+def charts_table(dynamodb, monkeypatch, tmp_path):
+    table = create_table(dynamodb, "Charts", "chart_key", "rank", sk_type="N")
+    for var, value in {"CHARTS_TABLE": "Charts", "SPOTIPY_CLIENT_ID": "x", "SPOTIPY_CLIENT_SECRET": "x",
+                       "START_YEAR": "2000", "END_YEAR": "2002", "PER_MARKET_FETCH": "50",
+                       "TOP_K": "10", "CACHE_PATH": str(tmp_path / "spotify-cache.sqlite")}.items():
+        monkeypatch.setenv(var, value)
+    return table
+
+
+def scraper_for(fake, monkeypatch, **env):
+    """Scraper con il client Spotify puntato sul server finto (token fittizio)."""
+    for var, value in env.items():
+        monkeypatch.setenv(var, str(value))
+    scraper = load_scraper()
+    scraper.sp = Spotify(auth="fake-token", requests_session=scraper.http_session())
+    scraper.sp.prefix = fake.url
+    return scraper
+
+
+def chart(table, year):
+    items = table.query(KeyConditionExpression="chart_key = :k",
+                        ExpressionAttributeValues={":k": str(year)})["Items"]
+    return [(int(i["rank"]), i["album_id"], len(i["songs"])) for i in items if int(i["rank"]) > 0]
+
+
+def test_rate_limiter_is_global_and_adapts(charts_table):
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    limiter = load_scraper().RateLimiter(rate=5, burst=1, clock=lambda: now[0], sleep=sleep)
+    for _ in range(11):
+        limiter.acquire()
+    assert now[0] == pytest.approx(2.0)            # 5 richieste/s dopo il primo token
+
+    limiter.throttled(3)
+    assert limiter.rate == 2.5
+    limiter.acquire()
+    assert now[0] >= 2.0 + 3 + 1 / 2.5 - 1e-9      # pausa Retry-After, poi rate dimezzato
+    for _ in range(100):
+        limiter.succeeded()
+    assert limiter.rate == 5
+
+
+class VirtualTime:
+    """Clock/sleep del RateLimiter: sleep fa avanzare il tempo invece di aspettare."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.lock = threading.Lock()
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.now += seconds
+
+
+class EventLog(dict):
+    """stats del limiter: ogni incremento (fatto sotto il lock del limiter) finisce in ordine in events."""
+
+    def __init__(self, clock, *args):
+        super().__init__(*args)
+        self.clock, self.events = clock, []
+
+    def __setitem__(self, key, value):
+        self.events.append((key, self.clock()))
+        super().__setitem__(key, value)
+
+
+def test_concurrent_run_with_429s(charts_table, monkeypatch, record_property):
+    charts, timings = {}, {}
+    for label, workers in (("sequenziale", 1), ("parallelo", 8)):
+        with FakeSpotify(latency=0.02, throttle_every=15, retry_after=0.3) as fake:
+            scraper = scraper_for(fake, monkeypatch, SPOTIFY_WORKERS=workers, FORCE_REFRESH=1,
+                                  CACHE_PATH="")   # stessa tabella per i due run, tutto via HTTP
+            vt = VirtualTime()
+            scraper.limiter = scraper.RateLimiter(200, workers, clock=vt.clock, sleep=vt.sleep)
+            scraper.limiter.stats = events = EventLog(vt.clock, scraper.limiter.stats)
+            started = time.perf_counter()
+            scraper.main()
+            # tempo reale del run (latenza HTTP) + pause del limiter (Retry-After, tempo virtuale):
+            # solo riportati, niente assert sul tempo → il test non dipende dal carico della macchina
+            timings[label] = {"seconds": round(time.perf_counter() - started, 3),
+                              "limiter_wait_s": round(vt.now, 3)}
+            log, max_in_flight = list(fake.log), fake.max_in_flight
+        charts[label] = {year: chart(charts_table, year) for year in (2000, 2001, 2002)}
+
+        # ogni richiesta arrivata al server è passata dal limiter, ogni 429 è stato visto e ritentato
+        grants = [t for key, t in events.events if key == "requests"]
+        throttles = [t for key, t in events.events if key == "throttled"]
+        assert len(grants) == len(log) and len(throttles) == sum(status == 429 for _, _, status in log) > 0
+        # dopo un 429 nessun thread riparte prima di Retry-After (ordine degli eventi sotto il lock)
+        for i, (key, t) in enumerate(events.events):
+            if key == "throttled":
+                assert all(g >= t + 0.3 - 1e-9 for k, g in events.events[i + 1:] if k == "requests")
+        assert (max_in_flight > 1) if workers > 1 else (max_in_flight == 1)
+
+    print("tempo totale:", timings)
+    record_property("timings", timings)                       # nel report junit (--junitxml)
+    assert charts["parallelo"] == charts["sequenziale"]       # stesso risultato, stesso ordine
+    assert all(len(c) == 10 and c[0][2] == 12 for c in charts["parallelo"].values())
+
+
+def test_album_details_bulk_paginated_and_cached(charts_table, monkeypatch):
+    with FakeSpotify(n_tracks=75) as fake:
+        scraper = scraper_for(fake, monkeypatch, SPOTIFY_WORKERS=4, SPOTIFY_RATE=500, SPOTIFY_BURST=4)
+        ids = ["2000x%d" % n for n in range(25)]
+        details = scraper.get_album_details(ids)
+        assert len(details) == 25 and all(len(d["songs"]) == 75 for d in details.values())
+        calls = [path for _, path, _ in fake.log]
+        assert calls.count("/v1/albums/") == 2                      # 25 id → 2 chiamate da max 20
+        assert sum(p.endswith("/tracks") for p in calls) == 25     # seconda pagina di tracce
+
+        # un altro anno con album già visti: solo quelli nuovi vanno a Spotify
+        fake.log.clear()
+        scraper.get_album_details(["2000x3", "2000x30"])
+        assert [path for _, path, _ in fake.log] == ["/v1/albums/", "/v1/albums/2000x30/tracks"]
+
+        fake.log.clear()
+        scraper.main()
+        paths = [path for _, path, _ in fake.log]
+        assert paths.count("/v1/albums/") == 2                     # bulk per 2001 e 2002; il 2000 è già in cache
+        singles = [p for p in paths if p.startswith("/v1/albums/") and p != "/v1/albums/" and not p.endswith("/tracks")]
+        assert not singles                                           # niente più sp.album uno per uno
+    assert all(c[2] == 75 for c in chart(charts_table, 2001))
+
+
+def test_refresh_policy(charts_table):
+    scraper = load_scraper()
+    policy = scraper.parse_refresh_policy("0:1,5:7,*:30")
+    now = scraper._epoch("2025-06-01T03:00:00Z")
+    assert [scraper.refresh_interval(y, now, policy) / 86400 for y in (2025, 2024, 2020, 2019, 1975)] == [1, 7, 7, 30, 30]
+
+    state = {"fingerprint": "f", "checked_at": "2025-05-31T03:04:00Z"}   # run di ieri, finito 4 minuti dopo
+    assert scraper.year_due(2025, state, now, policy)
+    assert not scraper.year_due(2024, state, now, policy)
+    assert scraper.year_due(2024, {}, now, policy)
+
+
+def test_incremental_runs_skip_unchanged_years(charts_table, monkeypatch):
+    day = 86400
+    with FakeSpotify() as fake:
+        scraper = scraper_for(fake, monkeypatch, SPOTIFY_WORKERS=4, SPOTIFY_RATE=500, SPOTIFY_BURST=4, CACHE_PATH="")
+        now = scraper._epoch("2025-06-01T03:00:00Z")
+        summary = scraper.main(now)
+        assert summary["years"]["scraped"] == 3 and summary["peak_rss_mb"] > 0
+        first = {year: chart(charts_table, year) for year in (2000, 2001, 2002)}
+
+        # il giorno dopo: anni vecchi non ancora da ricontrollare → zero chiamate Spotify
+        fake.log.clear()
+        assert scraper.main(now + day)["years"]["skipped"] == 3
+        assert fake.log == []
+
+        # dopo un mese si ricontrolla, ma la classifica è identica: niente tracce né scritture
+        fake.log.clear()
+        puts = []
+        monkeypatch.setattr(scraper, "save_chart", lambda *a: puts.append(a))
+        assert scraper.main(now + 31 * day)["years"]["unchanged"] == 3
+        assert fake.log and not [p for _, p, _ in fake.log if p.startswith("/v1/albums/")]
+        assert puts == []
+    assert {year: chart(charts_table, year) for year in (2000, 2001, 2002)} == first
+    manifest = charts_table.get_item(Key={"chart_key": "2001", "rank": 0})["Item"]
+    assert manifest["checked_at"] == scraper._iso(now + 31 * day) and manifest["regions"] == {"GLOBAL"}
+
+
+def test_crashed_run_resumes_from_last_completed_year(charts_table, monkeypatch):
+    with FakeSpotify() as fake:
+        scraper = scraper_for(fake, monkeypatch, SPOTIFY_WORKERS=4, SPOTIFY_RATE=500, SPOTIFY_BURST=4,
+                              FORCE_REFRESH=1)
+        real_save = scraper.save_chart
+
+        def crash_on_2001(year, entries):
+            if year == 2001:
+                raise RuntimeError("task Fargate interrotto")
+            return real_save(year, entries)
+        monkeypatch.setattr(scraper, "save_chart", crash_on_2001)
+        now = scraper._epoch("2025-06-01T03:00:00Z")
+        with pytest.raises(RuntimeError):
+            scraper.main(now)
+        assert chart(charts_table, 2000) and not chart(charts_table, 2001)
+
+        monkeypatch.setattr(scraper, "save_chart", real_save)
+        fake.log.clear()
+        summary = scraper.main(now + 3600)   # anche con FORCE_REFRESH il 2000 non si rifà
+        searches = [p for _, p, _ in fake.log if p == "/v1/search"]
+    assert summary["years"] == {"scraped": 2, "unchanged": 0, "skipped": 0, "empty": 0, "resumed": 1}
+    assert summary["version"] == "20250601T030000Z"
+    assert len(searches) == 5                    # solo il 2002: le search del 2001 sono in cache dal run crashato
+    assert all(len(chart(charts_table, year)) == 10 for year in (2000, 2001, 2002))
+    run = charts_table.get_item(Key={"chart_key": "SCRAPER#run", "rank": 0})["Item"]
+    assert run["status"] == "done" and "done_years" not in run
+
+
+def test_response_cache_ttl_and_eviction(charts_table, tmp_path):
+    now = [0.0]
+    scraper = load_scraper()
+    cache = scraper.ResponseCache(str(tmp_path / "c.sqlite"), max_bytes=2000,
+                                  ttls={"search": 10, "album": 100}, clock=lambda: now[0])
+    key = cache.key("search", q="year:2001", market="IT", offset=0)
+    assert key == cache.key("search", offset=0, market="IT", q="year:2001")   # ordine dei parametri irrilevante
+    cache.put("search", key, {"albums": {"items": [1, 2]}})
+    assert cache.get(key) == {"albums": {"items": [1, 2]}}
+    now[0] = 11
+    assert cache.get(key) is None and cache.stats["expired"] == 1
+
+    cache.put("unknown", "k", {"x": 1})                  # endpoint senza TTL: mai in cache
+    assert cache.get("k") is None
+
+    payload = {"songs": [str(n) * 40 for n in range(20)]}   # ~ 200 byte compressi, diversi per album
+    for n in range(30):
+        now[0] += 1
+        cache.put("album", cache.key("album", id=n), dict(payload, id=n))
+    assert cache.bytes <= 2000 and cache.stats["evictions"] > 0
+    assert cache.get(cache.key("album", id=1)) is None and cache.get(cache.key("album", id=29))
+    assert cache.stats["hits"] >= 2
+
+
+def test_response_cache_persists_across_tasks(charts_table, monkeypatch, tmp_path):
+    import boto3
+    boto3.client("s3").create_bucket(Bucket="scraper-cache",
+                                     CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+    summaries, logs = [], []
+    for task in ("primo", "secondo"):
+        with FakeSpotify() as fake:
+            # ogni task Fargate parte con un disco vuoto: la cache arriva solo da S3
+            scraper = scraper_for(fake, monkeypatch, SPOTIFY_WORKERS=4, SPOTIFY_RATE=500, SPOTIFY_BURST=4,
+                                  FORCE_REFRESH=1, CACHE_BUCKET="scraper-cache",
+                                  CACHE_PATH=tmp_path / ("%s.sqlite" % task))
+            summaries.append(scraper.main())
+            logs.append([p for _, p, _ in fake.log])
+
+    first, second = summaries
+    assert first["cache"]["hits"] == 0 and first["cache"]["stores"] > 0
+    assert logs[1] == []                                   # tutte le search e gli album dalla cache
+    assert second["cache"]["misses"] == 0 and second["cache"]["hits"] == first["cache"]["misses"]
+    assert second["years"]["scraped"] == 3 and all(len(chart(charts_table, y)) == 10 for y in (2000, 2001, 2002))
+
+
+def test_shard_years_and_rate_budget(charts_table, monkeypatch):
+    scraper = load_scraper()
+    shards = [scraper.shard_years(1970, 2025, i, 4) for i in range(4)]
+    assert sorted(sum(shards, [])) == list(range(1970, 2026))
+    assert all(any(y >= 2021 for y in years) for years in shards)   # anni recenti su tutti gli shard
+    with pytest.raises(ValueError):
+        scraper.shard_years(1970, 2025, 4, 4)
+
+    monkeypatch.setenv("SPOTIFY_RATE", "8")
+    monkeypatch.setenv("SHARD_COUNT", "4")
+    monkeypatch.setenv("SHARD_INDEX", "3")
+    scraper = load_scraper()
+    assert scraper.limiter.rate == 2 and scraper.CHECKPOINT_KEY["chart_key"] == "SCRAPER#run-3of4"
+
+
+@pytest.fixture
+def moto_server():
+    """moto come server HTTP: i processi degli shard devono vedere le stesse tabelle/bucket."""
+    from moto.server import ThreadedMotoServer
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    yield "http://%s:%d" % server.get_host_and_port()
+    server.stop()
+
+
+def test_shards_in_parallel_processes_cover_every_year_once(moto_server, tmp_path):
+    shards, rate = 3, 30
+    env = dict(os.environ, AWS_ENDPOINT_URL=moto_server, AWS_DEFAULT_REGION="eu-west-3",
+               AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing",
+               CHARTS_TABLE="Charts", SNAPSHOT_BUCKET="snapshots", SPOTIPY_CLIENT_ID="x", SPOTIPY_CLIENT_SECRET="x",
+               START_YEAR="2000", END_YEAR="2009", PER_MARKET_FETCH="50", TOP_K="10", CACHE_PATH="",
+               SPOTIFY_WORKERS="4", SPOTIFY_RATE=str(rate), SPOTIFY_BURST="3", SHARD_COUNT=str(shards))
+    aws = dict(endpoint_url=moto_server, region_name="eu-west-3",
+               aws_access_key_id="testing", aws_secret_access_key="testing")
+    table = create_table(boto3.resource("dynamodb", **aws), "Charts", "chart_key", "rank", sk_type="N")
+    s3 = boto3.client("s3", **aws)
+    s3.create_bucket(Bucket="snapshots", CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+
+    with FakeSpotify(latency=0.02) as fake:
+        procs = [subprocess.Popen([sys.executable, "-c", SHARD_DRIVER, str(CONTAINERS_DIR / "app.py"), fake.url],
+                                  env=dict(env, SHARD_INDEX=str(i)), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  text=True)
+                 for i in range(shards)]
+        outputs = [p.communicate(timeout=120) for p in procs]
+        assert [p.returncode for p in procs] == [0] * shards, [err[-2000:] for _, err in outputs]
+        log, queries = list(fake.log), list(fake.queries)
+
+    summaries = [json.loads(out.strip().splitlines()[-1]) for out, _ in outputs]
+    assigned = Counter(y for s in summaries for y in s["shard"]["years"])
+    assert assigned == Counter(range(2000, 2010))                       # ogni anno a uno e un solo shard
+    assert sum(s["years"]["scraped"] for s in summaries) == 10
+
+    # ogni anno cercato una volta sola per mercato, cioè da un solo processo
+    searched = Counter((q["q"][0], q["market"][0]) for path, q in queries if path == "/v1/search")
+    assert set(searched.values()) == {1} and len(searched) == 10 * 5
+
+    # insieme gli shard restano dentro la quota: mai più di rate (+ burst) richieste in un secondo
+    arrivals = sorted(t for t, _, _ in log)
+    busiest = max(sum(1 for t in arrivals if start <= t < start + 1) for start in arrivals)
+    assert busiest <= rate + 3
+
+    for year in range(2000, 2010):
+        items = table.query(KeyConditionExpression="chart_key = :k",
+                            ExpressionAttributeValues={":k": str(year)})["Items"]
+        assert len([i for i in items if int(i["rank"]) > 0]) == 10
+    # i manifest scritti in concorrenza non si sono pestati i piedi
+    manifest = json.loads(s3.get_object(Bucket="snapshots", Key="charts/manifest.json")["Body"].read())
+    assert sorted(manifest["years"]) == [str(y) for y in range(2000, 2010)]
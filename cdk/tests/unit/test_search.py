@@ -0,0 +1,69 @@
+import json
+
+import boto3
+import pytest
+
+from .conftest import create_table, load_lambda
+
+ALBUMS = [
+    ("a1", "OK Computer", "Radiohead", ["Paranoid Android", "Karma Police"]),
+    ("a2", "Kid A", "Radiohead", ["Everything in Its Right Place", "Idioteque"]),
+    ("a3", "Computer World", "Kraftwerk", ["Pocket Calculator", "Computer Love"]),
+    ("a4", "Björk Début", "Björk", ["Human Behaviour", "Venus as a Boy"]),
+    ("a5", "Paranoid", "Black Sabbath", ["War Pigs", "Iron Man"]),
+]
+
+
+@pytest.fixture
+def search(dynamodb, monkeypatch):
+    table = create_table(dynamodb, "Albums", "album_id")
+    for album_id, title, artist, songs in ALBUMS:
+        table.put_item(Item={"album_id": album_id, "title": title, "artist": artist, "year": 1997,
+                             "cover": "https://img/%s.jpg" % album_id, "title_slug": album_id, "songs": songs})
+    boto3.client("s3").create_bucket(Bucket="search-bucket",
+                                      CreateBucketConfiguration={"LocationConstraint": "eu-west-3"})
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    monkeypatch.setenv("SEARCH_BUCKET", "search-bucket")
+
+    builder = load_lambda("search_index")
+    assert json.loads(builder.handler({}, None)["body"])["albums"] == 5
+    return load_lambda("albums")
+
+
+def query(app, q, **params):
+    resp = app.handler({"resource": "/albums/search", "queryStringParameters": dict(params, q=q)}, None)
+    return resp["statusCode"], json.loads(resp["body"])
+
+
+def ids(app, q, **params):
+    status, body = query(app, q, **params)
+    assert status == 200
+    return [i["album_id"] for i in body["items"]]
+
+
+def test_exact_prefix_and_typo(search):
+    assert ids(search, "ok computer")[0] == "a1"
+    assert ids(search, "comp")[:2] in (["a1", "a3"], ["a3", "a1"])
+    assert ids(search, "radiohed") == ["a1", "a2"]       # refuso sull'artista
+    assert ids(search, "bjork debut") == ["a4"]          # accenti normalizzati
+    assert ids(search, "idioteque") == ["a2"]            # nome canzone
+
+
+def test_title_outranks_song(search):
+    # "paranoid" è titolo di a5 ma solo canzone in a1
+    assert ids(search, "paranoid") == ["a5", "a1"]
+    assert ids(search, "computer", k="1") == ["a1"]     # a parità vince l'ordine dell'indice
+
+
+def test_index_loaded_once_per_container(search, monkeypatch):
+    calls = []
+    real = search.s3.get_object
+    monkeypatch.setattr(search.s3, "get_object", lambda **kw: calls.append(kw) or real(**kw))
+    for _ in range(5):
+        ids(search, "kid")
+    assert len(calls) == 1
+
+
+def test_bad_params(search):
+    assert query(search, "")[0] == 400
+    assert query(search, "kid", k="x")[0] == 400
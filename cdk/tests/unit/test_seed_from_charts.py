@@ -0,0 +1,88 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def tables(dynamodb, monkeypatch):
+    charts = create_table(dynamodb, "Charts", "chart_key", "rank", sk_type="N")
+    albums = create_table(dynamodb, "Albums", "album_id")
+    with charts.batch_writer() as batch:
+        for year in range(2000, 2010):
+            batch.put_item(Item={"chart_key": str(year), "rank": 0, "kind": "manifest", "regions": {"GLOBAL"}})
+            for rank in range(1, 21):
+                n = (year - 2000) * 15 + rank          # 5 album per anno compaiono anche l'anno dopo
+                item = {"chart_key": str(year), "rank": rank, "album_id": "a%d" % n,
+                        "title": " Album %d " % n, "artist": "Artist %d" % (n % 7),
+                        "release_date": "%d-03-01" % (2000 + (n - 1) // 15), "cover": "https://img/%d.jpg" % n,
+                        "songs": ["s1", "s2"]}
+                batch.put_item(Item=item)
+                batch.put_item(Item=dict(item, chart_key="%d#EUROPE" % year))
+        batch.put_item(Item={"chart_key": "SCRAPER#run", "rank": 0, "status": "done"})
+    # album già votato: i contatori non si devono perdere
+    albums.put_item(Item={"album_id": "a3", "title": "Old title", "ratings_sum": 9, "ratings_count": 2,
+                          "ratings_hist_5": 1, "average_rating": Decimal("4.5"), "genre": ["rock"]})
+    monkeypatch.setenv("CHARTS_TABLE", "Charts")
+    monkeypatch.setenv("ALBUMS_TABLE", "Albums")
+    monkeypatch.setenv("SEED_SCAN_SEGMENTS", "4")
+    return load_lambda("seed_from_charts"), albums
+
+
+def test_migration_upserts_once_per_album_and_keeps_ratings(tables):
+    app, albums = tables
+    resp = app.handler({}, None)
+    stats = json.loads(resp["body"])["stats"]
+    assert resp["statusCode"] == 200
+    assert stats["albums"] == 9 * 15 + 20 and stats["written"] == stats["albums"]
+    assert stats["items_scanned"] == 10 * 41 + 1                       # manifest e checkpoint scansionati, scartati
+    assert stats["batch_gets"] >= 4 and stats["albums_per_s"] > 0
+
+    a3 = albums.get_item(Key={"album_id": "a3"})["Item"]
+    assert (a3["title"], a3["title_slug"], a3["artist_lower"], a3["year"]) == ("Album 3", "album-3", "artist 3", 2000)
+    assert (a3["ratings_sum"], a3["ratings_count"], a3["ratings_hist_5"]) == (9, 2, 1)
+    assert a3["average_rating"] == Decimal("4.5") and a3["genre"] == ["rock"]
+
+    a7 = albums.get_item(Key={"album_id": "a7"})["Item"]
+    assert (a7["ratings_count"], a7["average_rating"], a7["genre"]) == (0, 0, [])
+    assert "SCRAPER#run" not in {i["album_id"] for i in albums.scan()["Items"]}
+
+
+def test_rerun_writes_only_what_changed(tables):
+    app, albums = tables
+    app.migrate_charts_to_albums()
+    before = albums.get_item(Key={"album_id": "a10"})["Item"]["updated_at"]
+
+    albums.update_item(Key={"album_id": "a10"}, UpdateExpression="SET cover = :c",
+                       ExpressionAttributeValues={":c": "stale"})
+    albums.update_item(Key={"album_id": "a11"}, UpdateExpression="ADD ratings_sum :s, ratings_count :c",
+                       ExpressionAttributeValues={":s": 4, ":c": 1})
+    stats = app.migrate_charts_to_albums(total_segments=3)
+    assert stats["written"] == 1 and stats["unchanged"] == stats["albums"] - 1
+
+    a10 = albums.get_item(Key={"album_id": "a10"})["Item"]
+    assert a10["cover"] == "https://img/10.jpg" and a10["updated_at"] >= before
+    assert albums.get_item(Key={"album_id": "a11"})["Item"]["ratings_count"] == 1
+
+
+def test_unprocessed_keys_are_retried(tables, monkeypatch):
+    app, albums = tables
+    resource = app._thread_tables()[0]
+    real = resource.batch_get_item
+    state = {"first": True}
+
+    def flaky(RequestItems):
+        if state["first"]:
+            state["first"] = False
+            table, req = next(iter(RequestItems.items()))
+            resp = real(RequestItems={table: dict(req, Keys=req["Keys"][:10])})
+            resp["UnprocessedKeys"] = {table: dict(req, Keys=req["Keys"][10:])}
+            return resp
+        return real(RequestItems=RequestItems)
+    monkeypatch.setattr(resource, "batch_get_item", flaky)
+
+    ids = ["a%d" % n for n in range(1, 40)]
+    app.migrate_charts_to_albums()
+    assert set(app.fetch_existing(resource, "Albums", ids)) == set(ids) and not state["first"]
@@ -0,0 +1,199 @@
+import json
+import re
+import threading
+import time
+import zlib
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from .conftest import create_table, load_lambda
+
+
+@pytest.fixture
+def job(dynamodb, monkeypatch):
+    users = create_table(dynamodb, "Users", "user_id")
+    topic = boto3.client("sns").create_topic(Name="likes")["TopicArn"]
+    monkeypatch.setenv("USERS_TABLE", "Users")
+    monkeypatch.setenv("SNS_TOPIC_ARN", topic)
+    monkeypatch.setenv("SUBSCRIBE_SCAN_SEGMENTS", "3")
+    monkeypatch.setenv("SUBSCRIBE_PAGE_SIZE", "4")
+    monkeypatch.setenv("SUBSCRIBE_RATE", "0")
+    return load_lambda("sns"), users, topic
+
+
+def test_subscribes_each_pending_user_once_and_records_state(job, monkeypatch):
+    app, users, topic = job
+    with users.batch_writer() as batch:
+        for n in range(40):
+            batch.put_item(Item={"user_id": "u%d" % n, "email": "u%d@example.com" % n})
+        batch.put_item(Item={"user_id": "no-email"})
+        batch.put_item(Item={"user_id": "done", "email": "done@example.com", "sns_topic_arn": topic,
+                             "sns_endpoint": "done@example.com"})
+        batch.put_item(Item={"user_id": "moved", "email": "new@example.com", "sns_topic_arn": topic,
+                             "sns_endpoint": "old@example.com"})
+    app.sns.subscribe(TopicArn=topic, Protocol="email", Endpoint="u0@example.com")   # iscritto prima dello stato
+
+    calls = []
+    real = app.sns.subscribe
+    monkeypatch.setattr(app.sns, "subscribe", lambda **kw: calls.append(kw["Endpoint"]) or real(**kw))
+    resp = app.handler({}, None)
+    body = json.loads(resp["body"])
+    assert body["done"] and body["stats"]["subscribed"] == 40 and body["stats"]["already_on_topic"] == 1
+    assert sorted(calls) == sorted(["u%d@example.com" % n for n in range(1, 40)] + ["new@example.com"])
+
+    u5 = users.get_item(Key={"user_id": "u5"})["Item"]
+    assert (u5["sns_topic_arn"], u5["sns_endpoint"]) == (topic, "u5@example.com") and u5["sns_subscribed_at"]
+    assert users.get_item(Key={"user_id": "moved"})["Item"]["sns_endpoint"] == "new@example.com"
+    assert "sns_topic_arn" not in users.get_item(Key={"user_id": "no-email"})["Item"]
+
+    # rilancio: run nuovo, nessuno da iscrivere tranne chi è arrivato nel frattempo
+    calls.clear()
+    users.put_item(Item={"user_id": "late", "email": "late@example.com"})
+    body = json.loads(app.handler({}, None)["body"])
+    assert body["done"] and calls == ["late@example.com"]
+
+
+def test_checkpoint_resumes_across_invocations(job, monkeypatch):
+    app, users, topic = job
+    with users.batch_writer() as batch:
+        for n in range(60):
+            batch.put_item(Item={"user_id": "u%d" % n, "email": "u%d@example.com" % n})
+    app.sns.subscribe(TopicArn=topic, Protocol="email", Endpoint="u7@example.com")   # iscritto prima dello stato
+    calls, listed = [], []
+    real = app.sns.subscribe
+    monkeypatch.setattr(app.sns, "subscribe", lambda **kw: calls.append(kw["Endpoint"]) or real(**kw))
+    real_list = app.sns.list_subscriptions_by_topic
+    monkeypatch.setattr(app.sns, "list_subscriptions_by_topic", lambda **kw: listed.append(kw) or real_list(**kw))
+
+    first = app.run(remaining_ms=lambda: 0)                 # ogni segmento si ferma dopo una pagina
+    assert not first["done"] and 0 < len(calls) <= 3 * 4 and len(listed) == 1
+    checkpoint = users.get_item(Key=app.CHECKPOINT_KEY)["Item"]
+    assert all(c and c != app.DONE for c in checkpoint["cursors"].values())
+
+    second = app.run()                                      # il topic non si rilegge: lista dal checkpoint
+    assert second["done"] and second["stats"]["subscribed"] == 59 and second["stats"]["already_on_topic"] == 1
+    assert len(listed) == 1
+    assert sorted(calls) == sorted("u%d@example.com" % n for n in range(60) if n != 7)
+
+
+class FakeUsers:
+    """UsersTable in memoria: scan a segmenti (filtro ignorato, lo rifà il client) e update_item di SET."""
+
+    def __init__(self, items):
+        self.items = {it["user_id"]: it for it in items}
+        self.lock = threading.Lock()
+        self._segments = {}
+
+    def _segment(self, segment, total):
+        if total not in self._segments:
+            parts = [[] for _ in range(total)]
+            for uid in sorted(self.items):
+                parts[zlib.crc32(uid.encode()) % total].append(uid)
+            self._segments[total] = parts
+        return self._segments[total][segment]
+
+    def scan(self, Segment, TotalSegments, Limit, ExclusiveStartKey=None, **_):
+        ids = self._segment(Segment, TotalSegments)
+        start = ids.index(ExclusiveStartKey["user_id"]) + 1 if ExclusiveStartKey else 0
+        with self.lock:
+            page = [dict(self.items[uid]) for uid in ids[start:start + Limit]]
+        resp = {"Items": page, "ScannedCount": len(page)}
+        if start + Limit < len(ids):
+            resp["LastEvaluatedKey"] = {"user_id": page[-1]["user_id"]}
+        return resp
+
+    def get_item(self, Key, **_):
+        item = self.items.get(Key["user_id"])
+        return {"Item": json.loads(json.dumps(item))} if item else {}
+
+    def put_item(self, Item):
+        with self.lock:
+            self.items[Item["user_id"]] = json.loads(json.dumps(Item))
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+                    ConditionExpression=None):
+        names = ExpressionAttributeNames or {}
+        with self.lock:
+            item = self.items.get(Key["user_id"])
+            if ConditionExpression == "email = :e" and (item or {}).get("email") != ExpressionAttributeValues[":e"]:
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+            for path, value in re.findall(r"([\w.#]+) = (:\w+)", UpdateExpression[len("SET "):]):
+                target, *parts = [names.get(p, p) for p in path.split(".")]
+                if parts:
+                    item[target][parts[0]] = json.loads(json.dumps(ExpressionAttributeValues[value]))
+                else:
+                    item[target] = json.loads(json.dumps(ExpressionAttributeValues[value]))
+
+
+class FakeSNS:
+    def __init__(self, existing=()):
+        self.lock = threading.Lock()
+        self.subscribed = {e: "arn:sub:%s" % e for e in existing}
+        self.calls, self.in_flight, self.max_in_flight = [], 0, 0
+        self.list_calls = 0
+
+    def subscribe(self, TopicArn, Protocol, Endpoint, **_):
+        with self.lock:
+            self.calls.append(Endpoint)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.0005)
+        with self.lock:
+            self.in_flight -= 1
+            self.subscribed[Endpoint] = "pending confirmation"
+        return {"SubscriptionArn": "pending confirmation"}
+
+    def list_subscriptions_by_topic(self, TopicArn, NextToken=None):
+        self.list_calls += 1
+        emails = sorted(self.subscribed)
+        start = int(NextToken or 0)
+        resp = {"Subscriptions": [{"Protocol": "email", "Endpoint": e, "SubscriptionArn": self.subscribed[e]}
+                                  for e in emails[start:start + 100]]}
+        if start + 100 < len(emails):
+            resp["NextToken"] = str(start + 100)
+        return resp
+
+
+def test_50k_users_in_bounded_resumable_runs(aws, monkeypatch):
+    monkeypatch.setenv("USERS_TABLE", "Users")
+    monkeypatch.setenv("SNS_TOPIC_ARN", "arn:aws:sns:eu-west-3:123:likes")
+    monkeypatch.setenv("SUBSCRIBE_RATE", "0")
+    monkeypatch.setenv("SUBSCRIBE_PAGE_SIZE", "500")
+    app = load_lambda("sns")
+    topic = app.TOPIC_ARN
+
+    users = [{"user_id": "u%05d" % n, "email": "u%05d@example.com" % n} for n in range(50_000)]
+    for u in users[:5_000]:                                   # già iscritti da post_confirmation
+        u.update(sns_topic_arn=topic, sns_endpoint=u["email"])
+    users += [{"user_id": "x%d" % n} for n in range(100)]     # senza email
+    db = FakeUsers(users)
+    sns = FakeSNS(existing=["u%05d@example.com" % n for n in range(5_000, 6_000)])   # sul topic, senza stato
+    monkeypatch.setattr(app, "_thread_table", lambda: db)
+    monkeypatch.setattr(app, "table", db)
+    monkeypatch.setattr(app, "sns", sns)
+    monkeypatch.setattr(app, "KNOWN_CHUNK", 300)             # lista salvata in 4 item
+
+    budget = {"pages": 0}
+
+    def remaining_ms():                                       # "timeout" dopo ~40 pagine
+        budget["pages"] += 1
+        return float("inf") if budget["pages"] < 40 else 0
+
+    runs = [app.run(remaining_ms=remaining_ms)]
+    while not runs[-1]["done"]:
+        budget["pages"] = 0
+        runs.append(app.run(remaining_ms=remaining_ms))
+    assert len(runs) >= 2
+    assert sns.list_calls == 10                                # 1000 iscrizioni lette una volta sola per run
+
+    stats = runs[-1]["stats"]
+    assert stats["subscribed"] == 44_000 and stats["already_on_topic"] == 1_000 and not stats.get("failed")
+    assert len(sns.calls) == len(set(sns.calls)) == 44_000   # nessuna subscribe doppia tra le invocazioni
+    assert sns.max_in_flight <= app.WORKERS
+    assert all(db.items["u%05d" % n].get("sns_endpoint") == "u%05d@example.com" % n for n in range(50_000))
+    assert db.items["JOB#sns-subscribe"]["done"] is True
+
+    sns.calls.clear()
+    assert app.run()["done"] and sns.calls == []               # rilancio: tutti già fatti
@@ -33,6 +33,8 @@ export default function AlbumPage() {
   const [review, setReview] = useState("");
   const [rating, setRating] = useState(0);
   const [reviews, setReviews] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [liked, setLiked] = useState(() => new Set());
   const [token, setToken] = useState(null);
   const [busy, setBusy] = useState(false);
 
@@ -51,6 +53,25 @@ export default function AlbumPage() {
     };
   }, []);
 
+  // Una sola chiamata per sapere quali recensioni della pagina ho già likato
+  async function fetchLiked(albumId, page) {
+    const idToken = localStorage.getItem("id_token");
+    if (!idToken || !page?.length) return;
+    try {
+      const config = await getConfig();
+      const ids = page.map((r) => r.user_id).join(",");
+      const r = await fetch(
+        `${config.apiBaseUrl}ratings/${albumId}/likes?reviews=${encodeURIComponent(ids)}`,
+        { headers: { Authorization: `Bearer ${idToken}` } }
+      );
+      if (!r.ok) return;
+      const data = await r.json();
+      setLiked((prev) => new Set([...prev, ...(data.liked || [])]));
+    } catch {
+      // non bloccante
+    }
+  }
+
   async function fetchAlbumAndRatings({ showSpinner = true } = {}) {
     try {
       if (showSpinner) setLoading(true);
@@ -72,6 +93,8 @@ export default function AlbumPage() {
         if (!r.ok) throw new Error("Errore API ratings: " + r.status);
         const data = await r.json();
         setReviews(data.reviews || []);
+        setNextCursor(data.next_cursor || null);
+        fetchLiked(albumObj.album_id, data.reviews);
         setAlbum((prev) =>
           prev
             ? {
@@ -95,6 +118,23 @@ export default function AlbumPage() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [id]);
 
+  async function loadMoreReviews() {
+    if (!album?.album_id || !nextCursor) return;
+    try {
+      const config = await getConfig();
+      const r = await fetch(
+        `${config.apiBaseUrl}ratings/${album.album_id}?cursor=${encodeURIComponent(nextCursor)}`
+      );
+      if (!r.ok) throw new Error("Errore API ratings: " + r.status);
+      const data = await r.json();
+      setReviews((prev) => [...prev, ...(data.reviews || [])]);
+      setNextCursor(data.next_cursor || null);
+      fetchLiked(album.album_id, data.reviews);
+    } catch (e) {
+      alert(e.message || "Errore caricamento commenti");
+    }
+  }
+
   async function handleSubmitReview(e) {
     e?.preventDefault();
     if (!token) return alert("Devi effettuare il login per recensire");
@@ -132,6 +172,7 @@ export default function AlbumPage() {
       setReviews((prev) =>
         prev.map((r) => (r.user_id === reviewUserId ? { ...r, likes: (r.likes || 0) + 1 } : r))
       );
+      setLiked((prev) => new Set([...prev, reviewUserId]));
     } catch (e) {
       alert(e.message || "Errore like");
     }
@@ -231,13 +272,16 @@ export default function AlbumPage() {
                     {rev.comment && <p>{rev.comment}</p>}
                     <p className="meta">{rev.timestamp ? new Date(rev.timestamp).toLocaleString() : ""}</p>
                     {/* Il like si vede sempre, ma richiede login al click */}
-                    <button type="button" onClick={() => handleLike(rev.user_id)}>👍 {rev.likes || 0}</button>
+                    <button type="button" onClick={() => handleLike(rev.user_id)} disabled={liked.has(rev.user_id)}>👍 {rev.likes || 0}</button>
                   </li>
                 ))}
               </ul>
             ) : (
               <p className="muted">Nessun commento disponibile.</p>
             )}
+            {nextCursor && (
+              <button type="button" onClick={loadMoreReviews}>Carica altri commenti</button>
+            )}
           </div>
         </div>
       </div>
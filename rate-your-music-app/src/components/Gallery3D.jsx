@@ -14,14 +14,14 @@ export default function Gallery3D() {
         const configResp = await fetch("/config.json");
         const config = await configResp.json();
 
-        // prendo tutti gli album
-        const resp = await fetch(`${config.apiBaseUrl}albums`);
+        // prendo una pagina di album (lista paginata, solo campi essenziali)
+        const resp = await fetch(`${config.apiBaseUrl}albums?limit=50`);
         if (!resp.ok) throw new Error("Errore API albums");
 
         const data = await resp.json();
 
         // mischiare gli album e prenderne 8
-        const shuffled = data.sort(() => 0.5 - Math.random());
+        const shuffled = (data.items || []).sort(() => 0.5 - Math.random());
         const selected = shuffled.slice(0, 8);
 
         // costruire lista URL cover
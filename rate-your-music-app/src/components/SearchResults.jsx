@@ -12,27 +12,16 @@ function SearchResults() {
         const configResp = await fetch("/config.json");
         const config = await configResp.json();
 
-        // Prova ricerca diretta per titolo
+        // Ricerca su indice prebuilt: prefissi, refusi, artisti e canzoni
         const resp = await fetch(
-          `${config.apiBaseUrl}albums/by-title/${encodeURIComponent(query)}`
+          `${config.apiBaseUrl}albums/search?q=${encodeURIComponent(query)}&k=20`
         );
 
         if (resp.ok) {
           const data = await resp.json();
-          if (data.length > 0) {
-            setResults(data);
-          } else {
-            // Se non trova niente → fallback: prendi tutti e filtra
-            const allResp = await fetch(`${config.apiBaseUrl}albums`);
-            const allData = await allResp.json();
-            const q = query.toLowerCase();
-            const filtered = allData.filter(
-              (album) =>
-                album.title.toLowerCase().includes(q) ||
-                album.artist.toLowerCase().includes(q)
-            );
-            setResults(filtered);
-          }
+          setResults(data.items || []);
+        } else {
+          setResults([]);
         }
       } catch (err) {
         console.error("Errore ricerca:", err);